@@ -0,0 +1,324 @@
+import gzip
+import io
+import json
+import os
+import re
+from datetime import date, datetime
+
+import boto3
+import psycopg2
+from botocore.config import Config
+from psycopg2.extras import execute_values
+
+from db import get_pool
+from responses import error_response, success_response
+from tracing import traced
+
+S3_ENDPOINT_URL = os.environ.get('S3_ENDPOINT_URL', 'https://bucket.poehali.dev')
+BUCKET = 'files'
+ARCHIVE_PREFIX = 'archive/messages'
+ARCHIVE_AFTER_MONTHS = int(os.environ.get('MESSAGES_ARCHIVE_AFTER_MONTHS', '12'))
+PARTITIONS_AHEAD = int(os.environ.get('MESSAGES_PARTITIONS_AHEAD', '3'))
+EXPORT_BATCH = 5000
+# Объект архива ограничен, чтобы чтение истории держало в памяти один небольшой кусок:
+# новый объект начинается после стольких сообщений или байт JSONL (до сжатия)
+ARCHIVE_CHUNK_MESSAGES = 1000
+ARCHIVE_CHUNK_BYTES = 1024 * 1024
+COLUMNS = [
+    'id', 'chat_id', 'sender_id', 'msg_type', 'content', 'file_url', 'file_name', 'file_size',
+    'created_at', 'seq', 'thumb_url', 'preview', 'media_width', 'media_height'
+]
+BOUND_RE = re.compile(r"FROM \((MINVALUE|'[^']+')\) TO \((MAXVALUE|'[^']+')\)")
+
+_s3 = None
+
+@traced('archive')
+def handler(event: dict, context) -> dict:
+    '''
+    Обслуживание секционированной таблицы messages: заранее создаёт месячные секции,
+    а секции старше MESSAGES_ARCHIVE_AFTER_MONTHS выгружает в S3 по чатам и отсоединяет.
+    Вызывается раз в сутки по расписанию .github/workflows/archive-maintenance.yml
+    '''
+    method = event.get('httpMethod', 'GET')
+    
+    if method == 'OPTIONS':
+        return {
+            'statusCode': 200,
+            'headers': {
+                'Access-Control-Allow-Origin': '*',
+                'Access-Control-Allow-Methods': 'POST, OPTIONS',
+                'Access-Control-Allow-Headers': 'Content-Type, X-Archive-Secret'
+            },
+            'body': ''
+        }
+    
+    if method != 'POST':
+        return error_response('Method not allowed', 405)
+    
+    secret = os.environ.get('ARCHIVE_SECRET')
+    if not secret or event.get('headers', {}).get('X-Archive-Secret') != secret:
+        return error_response('Forbidden', 403)
+    
+    body = json.loads(event.get('body') or '{}')
+    dry_run = bool(body.get('dry_run'))
+    today = date.today()
+    
+    pool = get_pool()
+    conn = pool.getconn()
+    
+    try:
+        created, failed = ensure_partitions(conn, today, PARTITIONS_AHEAD)
+        
+        archived = []
+        for name in expired_partitions(conn, add_months(today.replace(day=1), -ARCHIVE_AFTER_MONTHS)):
+            if dry_run:
+                archived.append({'partition': name, 'chats': None, 'objects': None, 'messages': None})
+            else:
+                archived.append(archive_partition(conn, name))
+        
+        return success_response({'created': created, 'failed': failed, 'archived': archived, 'dry_run': dry_run})
+    
+    except Exception as e:
+        conn.rollback()
+        return error_response(f'Maintenance failed: {str(e)}', 500)
+    finally:
+        pool.putconn(conn)
+
+
+def partition_bounds(conn) -> list:
+    '''
+    (имя, нижняя граница, верхняя граница) для каждой секции messages;
+    None — MINVALUE/MAXVALUE, секция по умолчанию пропускается
+    '''
+    cur = conn.cursor()
+    cur.execute(
+        """
+        SELECT c.relname, pg_get_expr(c.relpartbound, c.oid)
+        FROM pg_inherits i
+        INNER JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = %s::regclass
+        """,
+        (f"{os.environ['MAIN_DB_SCHEMA']}.messages",)
+    )
+    bounds = []
+    for name, expr in cur.fetchall():
+        match = BOUND_RE.search(expr)
+        if not match:
+            continue
+        lower, upper = (None if value.endswith('VALUE') else datetime.fromisoformat(value.strip("'")) for value in match.groups())
+        bounds.append((name, lower, upper))
+    cur.close()
+    return bounds
+
+
+def default_partition(conn):
+    cur = conn.cursor()
+    cur.execute(
+        """
+        SELECT c.relname
+        FROM pg_partitioned_table p
+        INNER JOIN pg_class c ON c.oid = p.partdefid
+        WHERE p.partrelid = %s::regclass
+        """,
+        (f"{os.environ['MAIN_DB_SCHEMA']}.messages",)
+    )
+    row = cur.fetchone()
+    cur.close()
+    return row[0] if row else None
+
+
+def ensure_partitions(conn, today: date, ahead: int) -> tuple:
+    '''
+    Месячные секции на ahead месяцев вперёд и для каждого месяца, строки которого
+    уже попали в секцию по умолчанию. Пока такие строки там лежат, CREATE ... PARTITION OF
+    для их диапазона падает, поэтому они переносятся в новую секцию в той же транзакции.
+    Каждая секция — своя транзакция: ошибка одной попадает в failed и в лог, остальные создаются
+    '''
+    schema = os.environ['MAIN_DB_SCHEMA']
+    default = default_partition(conn)
+    cur = conn.cursor()
+    
+    months = {add_months(today.replace(day=1), offset) for offset in range(ahead + 1)}
+    stranded = set()
+    if default:
+        cur.execute(f"SELECT DISTINCT date_trunc('month', created_at)::date FROM {schema}.{default}")
+        stranded = {row[0] for row in cur.fetchall()}
+        conn.commit()
+    
+    bounds = partition_bounds(conn)
+    created, failed = [], []
+    for month in sorted(months | stranded):
+        start = datetime.combine(month, datetime.min.time())
+        end = datetime.combine(add_months(month, 1), datetime.min.time())
+        if any((lower is None or lower < end) and (upper is None or upper > start) for _, lower, upper in bounds):
+            continue
+        name = f"messages_p{start:%Y%m}"
+        try:
+            if month in stranded:
+                move_into_partition(cur, schema, default, name, start, end)
+            else:
+                cur.execute(
+                    f"CREATE TABLE {schema}.{name} PARTITION OF {schema}.messages FOR VALUES FROM (%s) TO (%s)",
+                    (start, end)
+                )
+            conn.commit()
+            created.append(name)
+        except psycopg2.Error as e:
+            conn.rollback()
+            print(f'Partition {name} was not created: {str(e)}')
+            failed.append({'partition': name, 'error': str(e)})
+    cur.close()
+    return created, failed
+
+
+def move_into_partition(cur, schema: str, default: str, name: str, start: datetime, end: datetime):
+    '''
+    Секция собирается отдельной таблицей, строки месяца переезжают в неё из секции
+    по умолчанию, и она присоединяется; вставки в секцию по умолчанию ждут конца транзакции
+    '''
+    columns = ', '.join(COLUMNS)
+    cur.execute(f"LOCK TABLE {schema}.{default} IN EXCLUSIVE MODE")
+    cur.execute(f"CREATE TABLE {schema}.{name} (LIKE {schema}.messages INCLUDING DEFAULTS INCLUDING GENERATED)")
+    cur.execute(
+        f"ALTER TABLE {schema}.{name} ADD CONSTRAINT {name}_range CHECK (created_at >= %s AND created_at < %s)",
+        (start, end)
+    )
+    cur.execute(
+        f"""
+        WITH moved AS (
+            DELETE FROM {schema}.{default} WHERE created_at >= %s AND created_at < %s
+            RETURNING {columns}
+        )
+        INSERT INTO {schema}.{name} ({columns}) SELECT {columns} FROM moved
+        """,
+        (start, end)
+    )
+    cur.execute(
+        f"ALTER TABLE {schema}.messages ATTACH PARTITION {schema}.{name} FOR VALUES FROM (%s) TO (%s)",
+        (start, end)
+    )
+
+
+def expired_partitions(conn, cutoff: date) -> list:
+    cutoff = datetime.combine(cutoff, datetime.min.time())
+    return [name for name, _, upper in sorted(partition_bounds(conn), key=lambda b: b[2] or datetime.max)
+            if upper is not None and upper <= cutoff]
+
+
+def archive_partition(conn, name: str) -> dict:
+    '''
+    Выгружает секцию в S3 ограниченными кусками истории каждого чата (ArchiveChunk),
+    записывает куски в message_archives и в той же транзакции отсоединяет и удаляет секцию;
+    повторный запуск после сбоя перезаписывает те же ключи
+    '''
+    schema = os.environ['MAIN_DB_SCHEMA']
+    s3 = s3_client()
+    archives = []
+    
+    export = conn.cursor(name=f'export_{name}')
+    export.itersize = EXPORT_BATCH
+    export.execute(f"SELECT {', '.join(COLUMNS)} FROM {schema}.{name} ORDER BY chat_id, created_at, id")
+    
+    chunk = None
+    try:
+        for row in export:
+            message = dict(zip(COLUMNS, row))
+            if chunk is not None and chunk.full_before(message):
+                archives.append(chunk.upload(s3, name))
+                chunk = None
+            if chunk is None:
+                index = archives[-1][6] + 1 if archives and archives[-1][0] == message['chat_id'] else 0
+                chunk = ArchiveChunk(message['chat_id'], index)
+            chunk.add(message)
+        if chunk is not None:
+            archives.append(chunk.upload(s3, name))
+    finally:
+        export.close()
+    
+    cur = conn.cursor()
+    if archives:
+        execute_values(
+            cur,
+            f"""
+            INSERT INTO {schema}.message_archives
+            (chat_id, first_at, last_at, partition_name, object_key, message_count)
+            VALUES %s
+            ON CONFLICT (chat_id, last_at) DO UPDATE SET
+                first_at = EXCLUDED.first_at,
+                partition_name = EXCLUDED.partition_name,
+                object_key = EXCLUDED.object_key,
+                message_count = EXCLUDED.message_count,
+                archived_at = CURRENT_TIMESTAMP
+            """,
+            [archive[:6] for archive in archives]
+        )
+    cur.execute(f"ALTER TABLE {schema}.messages DETACH PARTITION {schema}.{name}")
+    cur.execute(f"DROP TABLE {schema}.{name}")
+    conn.commit()
+    cur.close()
+    
+    return {
+        'partition': name,
+        'chats': len({a[0] for a in archives}),
+        'objects': len(archives),
+        'messages': sum(a[5] for a in archives)
+    }
+
+
+class ArchiveChunk:
+    '''
+    Кусок истории одного чата: до ARCHIVE_CHUNK_MESSAGES сообщений или ARCHIVE_CHUNK_BYTES,
+    один gzip JSONL в S3 и одна строка message_archives со своими first_at/last_at.
+    Граница куска не разрезает сообщения с одинаковым created_at — last_at входит в ключ
+    '''
+
+    def __init__(self, chat_id: int, index: int):
+        self.chat_id = chat_id
+        self.index = index
+        self.count = 0
+        self.size = 0
+        self.first_at = None
+        self.last_at = None
+        self._buffer = io.BytesIO()
+        self._gzip = gzip.GzipFile(fileobj=self._buffer, mode='wb')
+
+    def full_before(self, message: dict) -> bool:
+        if message['chat_id'] != self.chat_id:
+            return True
+        full = self.count >= ARCHIVE_CHUNK_MESSAGES or self.size >= ARCHIVE_CHUNK_BYTES
+        return full and message['created_at'] != self.last_at
+
+    def add(self, message: dict):
+        line = json.dumps(message, default=str, ensure_ascii=False).encode() + b'\n'
+        self._gzip.write(line)
+        self.count += 1
+        self.size += len(line)
+        self.first_at = self.first_at or message['created_at']
+        self.last_at = message['created_at']
+
+    def upload(self, s3, partition: str) -> tuple:
+        '''
+        Отправляет кусок в S3; возвращает строку для message_archives и номер куска
+        '''
+        self._gzip.close()
+        key = f'{ARCHIVE_PREFIX}/{partition}/{self.chat_id}/{self.index:05d}.jsonl.gz'
+        s3.put_object(Bucket=BUCKET, Key=key, Body=self._buffer.getvalue(), ContentType='application/gzip')
+        return self.chat_id, self.first_at, self.last_at, partition, key, self.count, self.index
+
+
+def add_months(day: date, months: int) -> date:
+    index = day.year * 12 + day.month - 1 + months
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def s3_client():
+    global _s3
+    if _s3 is None:
+        _s3 = boto3.client(
+            's3',
+            endpoint_url=S3_ENDPOINT_URL,
+            aws_access_key_id=os.environ['AWS_ACCESS_KEY_ID'],
+            aws_secret_access_key=os.environ['AWS_SECRET_ACCESS_KEY'],
+            config=Config(tcp_keepalive=True, retries={'max_attempts': 3, 'mode': 'standard'})
+        )
+    return _s3
@@ -0,0 +1,136 @@
+'''
+Пул соединений с Postgres, который переживает тёплые вызовы функции
+'''
+import os
+import threading
+import time
+
+import psycopg2
+import psycopg2.extensions
+
+from tracing import TracingCursor, span
+
+POOL_MAX_SIZE = int(os.environ.get('DB_POOL_MAX_SIZE', '4'))
+POOL_TIMEOUT = float(os.environ.get('DB_POOL_TIMEOUT', '5'))
+HEALTH_CHECK_INTERVAL = float(os.environ.get('DB_HEALTH_CHECK_INTERVAL', '30'))
+CONNECT_RETRIES = 2
+
+
+class PoolExhausted(Exception):
+    pass
+
+
+class ConnectionPool:
+    '''
+    Ограниченный пул: не больше max_size одновременно выданных соединений,
+    простаивающие соединения проверяются перед повторной выдачей
+    '''
+
+    def __init__(self, dsn: str, max_size: int = POOL_MAX_SIZE, timeout: float = POOL_TIMEOUT,
+                 health_check_interval: float = HEALTH_CHECK_INTERVAL):
+        self.dsn = dsn
+        self.max_size = max_size
+        self.timeout = timeout
+        self.health_check_interval = health_check_interval
+        self._idle = []
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(max_size)
+        self._stats = {'hits': 0, 'misses': 0, 'discarded': 0, 'reconnects': 0}
+
+    def getconn(self):
+        with span('pool'):
+            return self._getconn()
+
+    def _getconn(self):
+        if not self._slots.acquire(timeout=self.timeout):
+            raise PoolExhausted(f'No free connection within {self.timeout}s')
+        try:
+            while True:
+                with self._lock:
+                    item = self._idle.pop() if self._idle else None
+                if item is None:
+                    break
+                conn, last_used = item
+                if self._is_healthy(conn, last_used):
+                    self._count('hits')
+                    return conn
+                self._discard(conn)
+                self._count('reconnects')
+            self._count('misses')
+            return self._connect()
+        except BaseException:
+            self._slots.release()
+            raise
+
+    def putconn(self, conn):
+        try:
+            if conn.closed:
+                self._count('discarded')
+                return
+            try:
+                if conn.get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+                    conn.rollback()
+            except psycopg2.Error:
+                self._discard(conn)
+                return
+            with self._lock:
+                self._idle.append((conn, time.monotonic()))
+        finally:
+            self._slots.release()
+
+    def closeall(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for conn, _ in idle:
+            self._discard(conn)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return dict(self._stats, idle=len(self._idle), max_size=self.max_size)
+
+    def _connect(self):
+        for attempt in range(CONNECT_RETRIES + 1):
+            try:
+                with span('connect'):
+                    return psycopg2.connect(self.dsn, cursor_factory=TracingCursor)
+            except psycopg2.OperationalError:
+                if attempt == CONNECT_RETRIES:
+                    raise
+                time.sleep(0.05 * (attempt + 1))
+
+    def _is_healthy(self, conn, last_used: float) -> bool:
+        if conn.closed:
+            return False
+        if time.monotonic() - last_used < self.health_check_interval:
+            return True
+        try:
+            with conn.cursor() as cur:
+                cur.execute('SELECT 1')
+            conn.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    def _discard(self, conn):
+        self._count('discarded')
+        try:
+            conn.close()
+        except psycopg2.Error:
+            pass
+
+    def _count(self, key: str):
+        with self._lock:
+            self._stats[key] += 1
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool() -> ConnectionPool:
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ConnectionPool(os.environ['DATABASE_URL'])
+    return _pool
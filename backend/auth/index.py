@@ -1,11 +1,26 @@
 import json
 import os
 import random
-import psycopg2
 from datetime import datetime, timedelta
-import jwt
 import hashlib
 
+import queries
+import ratelimit
+import sms
+from db import get_pool
+from responses import error_response, success_response
+from session import AuthError, authenticate, cache as session_cache
+from tracing import tag, traced
+
+SMS_CODE_COOLDOWN = int(os.environ.get('SMS_CODE_COOLDOWN', '60'))
+SMS_RESEND_AFTER = int(os.environ.get('SMS_RESEND_AFTER', '15'))
+# Адреса своих прокси перед функцией, через запятую; пусто — X-Forwarded-For не читается
+TRUSTED_PROXIES = {ip.strip() for ip in os.environ.get('TRUSTED_PROXIES', '').split(',') if ip.strip()}
+PHONE_DIGITS_MAX = 15
+# Наибольшая длина изменяемых полей профиля: full_name — VARCHAR(255), остальные TEXT
+PROFILE_FIELDS_MAX = {'full_name': 255, 'avatar_url': 2048, 'status': 500}
+
+@traced('auth')
 def handler(event: dict, context) -> dict:
     '''
     API для аутентификации: отправка SMS-кода, верификация и получение JWT токена
@@ -32,31 +47,71 @@ def handler(event: dict, context) -> dict:
     
     body = json.loads(event.get('body', '{}'))
     action = body.get('action')
+    tag(action=action)
     
-    conn = psycopg2.connect(os.environ['DATABASE_URL'])
+    pool = get_pool()
+    conn = pool.getconn()
     cur = conn.cursor()
     
     try:
         if action == 'send_code':
-            phone = body.get('phone', '').strip()
+            phone = normalize_phone(body.get('phone', ''))
             if not phone:
                 return error_response('Phone is required', 400)
             
+            sms.sweep(cur, SMS_RESEND_AFTER)
+            conn.commit()
+            
+            cur.execute(
+                queries.RECENT_CODE,
+                (SMS_RESEND_AFTER, phone, SMS_CODE_COOLDOWN)
+            )
+            existing = cur.fetchone()
+            
+            if existing:
+                code_id, code, expires_in, undelivered = existing
+                if undelivered:
+                    # Переотправка — тоже SMS, она списывается с того же лимита номера
+                    try:
+                        ratelimit.take(cur, ratelimit.PHONE, phone)
+                    except ratelimit.RateLimited as e:
+                        conn.rollback()
+                        return too_many_requests(e)
+                    cur.execute(queries.MARK_DISPATCHED, (code_id,))
+                    conn.commit()
+                    sms.enqueue(code_id, phone, sms.MESSAGE.format(code=code))
+                return success_response({
+                    'message': 'SMS code sent',
+                    'expires_in': expires_in,
+                    'code': code,
+                    'reused': True
+                })
+            
+            # Токены обоих лимитов списываются вместе: отказ по номеру откатывает и списание по IP
+            try:
+                ratelimit.take(cur, ratelimit.IP, client_ip(event))
+                ratelimit.take(cur, ratelimit.PHONE, phone)
+            except ratelimit.RateLimited as e:
+                conn.rollback()
+                return too_many_requests(e)
+            
             code = ''.join([str(random.randint(0, 9)) for _ in range(6)])
             expires_at = datetime.now() + timedelta(minutes=10)
             
             cur.execute(
-                f"INSERT INTO {os.environ['MAIN_DB_SCHEMA']}.sms_codes (phone, code, expires_at) VALUES (%s, %s, %s)",
+                queries.INSERT_CODE,
                 (phone, code, expires_at)
             )
+            code_id = cur.fetchone()[0]
             conn.commit()
             
-            send_sms(phone, f'BizChat код: {code}')
+            sms.enqueue(code_id, phone, sms.MESSAGE.format(code=code))
             
             return success_response({
                 'message': 'SMS code sent',
                 'expires_in': 600,
-                'code': code
+                'code': code,
+                'reused': False
             })
         
         elif action == 'verify_code':
@@ -68,12 +123,8 @@ def handler(event: dict, context) -> dict:
                 return error_response('Phone and code are required', 400)
             
             cur.execute(
-                f"""
-                SELECT id FROM {os.environ['MAIN_DB_SCHEMA']}.sms_codes 
-                WHERE phone = %s AND code = %s AND expires_at > NOW() AND verified = false
-                ORDER BY created_at DESC LIMIT 1
-                """,
-                (phone, code)
+                queries.FIND_CODE,
+                (normalize_phone(phone), code)
             )
             
             sms_record = cur.fetchone()
@@ -81,19 +132,19 @@ def handler(event: dict, context) -> dict:
                 return error_response('Invalid or expired code', 400)
             
             cur.execute(
-                f"UPDATE {os.environ['MAIN_DB_SCHEMA']}.sms_codes SET verified = true WHERE id = %s",
+                queries.VERIFY_CODE,
                 (sms_record[0],)
             )
             
             cur.execute(
-                f"SELECT id, full_name, avatar_url, status FROM {os.environ['MAIN_DB_SCHEMA']}.users WHERE phone = %s",
+                queries.FIND_USER,
                 (phone,)
             )
             user = cur.fetchone()
             
             if not user:
                 cur.execute(
-                    f"INSERT INTO {os.environ['MAIN_DB_SCHEMA']}.users (phone, full_name) VALUES (%s, %s) RETURNING id, full_name, avatar_url, status",
+                    queries.INSERT_USER,
                     (phone, 'User')
                 )
                 user = cur.fetchone()
@@ -104,15 +155,10 @@ def handler(event: dict, context) -> dict:
             expires_at = datetime.now() + timedelta(days=30)
             
             cur.execute(
-                f"INSERT INTO {os.environ['MAIN_DB_SCHEMA']}.sessions (user_id, token, device_info, expires_at) VALUES (%s, %s, %s, %s)",
+                queries.INSERT_SESSION,
                 (user_id, token, device_info, expires_at)
             )
             
-            cur.execute(
-                f"UPDATE {os.environ['MAIN_DB_SCHEMA']}.users SET is_online = true WHERE id = %s",
-                (user_id,)
-            )
-            
             conn.commit()
             
             return success_response({
@@ -132,87 +178,118 @@ def handler(event: dict, context) -> dict:
                 return error_response('Token is required', 400)
             
             try:
-                payload = jwt.decode(token, os.environ['JWT_SECRET'], algorithms=['HS256'])
-                user_id = payload['user_id']
-                
-                cur.execute(
-                    f"SELECT id FROM {os.environ['MAIN_DB_SCHEMA']}.sessions WHERE token = %s AND expires_at > NOW()",
-                    (token,)
-                )
-                
-                if not cur.fetchone():
-                    return error_response('Invalid or expired token', 401)
-                
-                cur.execute(
-                    f"SELECT id, phone, full_name, avatar_url, status FROM {os.environ['MAIN_DB_SCHEMA']}.users WHERE id = %s",
-                    (user_id,)
-                )
-                user = cur.fetchone()
-                
-                if not user:
-                    return error_response('User not found', 404)
-                
-                return success_response({
-                    'user': {
-                        'id': user[0],
-                        'phone': user[1],
-                        'full_name': user[2],
-                        'avatar_url': user[3],
-                        'status': user[4]
-                    }
-                })
-            except jwt.ExpiredSignatureError:
-                return error_response('Token expired', 401)
-            except jwt.InvalidTokenError:
-                return error_response('Invalid token', 401)
+                return success_response({'user': authenticate(token)})
+            except AuthError as e:
+                return error_response(e.message, e.status_code)
+        
+        elif action == 'update_profile':
+            token = body.get('token', '')
+            try:
+                user = authenticate(token)
+            except AuthError as e:
+                return error_response(e.message, e.status_code)
+            
+            try:
+                fields = profile_fields(body)
+            except ValueError as e:
+                return error_response(str(e), 400)
+            if not fields:
+                return error_response('Nothing to update', 400)
+            
+            assignments = ', '.join(f'{key} = %s' for key in fields)
+            cur.execute(
+                queries.UPDATE_PROFILE.format(assignments=assignments),
+                (*fields.values(), user['id'])
+            )
+            conn.commit()
+            session_cache.invalidate_user(user['id'])
+            
+            return success_response({'user': dict(user, **fields)})
+        
+        elif action == 'logout':
+            token = body.get('token', '')
+            if not token:
+                return error_response('Token is required', 400)
+            
+            cur.execute(
+                queries.DELETE_SESSION,
+                (token,)
+            )
+            conn.commit()
+            session_cache.invalidate_token(token)
+            
+            return success_response({'message': 'Logged out'})
         
         else:
             return error_response('Invalid action', 400)
     
     finally:
         cur.close()
-        conn.close()
+        pool.putconn(conn)
 
 
-def send_sms(phone: str, message: str):
-    sms_api_key = os.environ.get('SMS_API_KEY', '')
-    if not sms_api_key:
-        print(f'[DEV MODE] SMS to {phone}: {message}')
-        return
-    
-    import requests
-    response = requests.post(
-        'https://smsc.ru/sys/send.php',
-        data={
-            'login': 'api',
-            'psw': sms_api_key,
-            'phones': phone,
-            'mes': message,
-            'fmt': 3
-        }
-    )
-    print(f'SMS sent to {phone}: {response.json()}')
+def client_ip(event: dict) -> str:
+    '''
+    Адрес соединения из requestContext. X-Forwarded-For клиент пишет сам, поэтому
+    он учитывается только за прокси из TRUSTED_PROXIES, и то справа налево:
+    берётся первый адрес, добавленный не доверенным прокси
+    '''
+    ip = event.get('requestContext', {}).get('identity', {}).get('sourceIp') or 'unknown'
+    headers = event.get('headers') or {}
+    forwarded = headers.get('X-Forwarded-For') or headers.get('x-forwarded-for') or ''
+    hops = [hop.strip() for hop in forwarded.split(',') if hop.strip()]
+    while ip in TRUSTED_PROXIES and hops:
+        ip = hops.pop()
+    return ip
+
+
+def normalize_phone(phone: str) -> str:
+    '''
+    Номер в виде «+цифры», ведущая 8 российского номера заменяется на 7:
+    «8 (999) 123-45-67» и «+79991234567» делят один код и один лимит.
+    Пустая строка, если номер не похож на номер
+    '''
+    digits = ''.join(ch for ch in phone if ch.isdigit())
+    if len(digits) == 11 and digits.startswith('8'):
+        digits = '7' + digits[1:]
+    if not digits or len(digits) > PHONE_DIGITS_MAX:
+        return ''
+    return '+' + digits
+
+
+def profile_fields(body: dict) -> dict:
+    '''
+    Изменяемые поля профиля из тела запроса; ValueError, если поле не строка,
+    длиннее колонки или имя пустое. avatar_url и status можно сбросить через null
+    '''
+    fields = {}
+    for key, max_length in PROFILE_FIELDS_MAX.items():
+        if key not in body:
+            continue
+        value = body[key]
+        if value is None and key != 'full_name':
+            fields[key] = None
+            continue
+        if not isinstance(value, str):
+            raise ValueError(f'{key} must be a string')
+        if len(value) > max_length:
+            raise ValueError(f'{key} must be at most {max_length} characters')
+        if key == 'full_name' and not value.strip():
+            raise ValueError('full_name must not be empty')
+        fields[key] = value
+    return fields
+
+
+def too_many_requests(e: ratelimit.RateLimited) -> dict:
+    response = error_response('Too many requests, try again later', 429)
+    response['headers']['Retry-After'] = str(int(e.retry_after))
+    return response
 
 
 def generate_jwt(user_id: int) -> str:
+    import jwt
     payload = {
         'user_id': user_id,
         'exp': datetime.utcnow() + timedelta(days=30)
     }
     return jwt.encode(payload, os.environ['JWT_SECRET'], algorithm='HS256')
-
-
-def success_response(data: dict):
-    return {
-        'statusCode': 200,
-        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-        'body': json.dumps(data)
-    }
-
-
-def error_response(message: str, status_code: int = 400):
-    return {
-        'statusCode': status_code,
-        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-        'body': json.dumps({'error': message})
-    }
@@ -0,0 +1,77 @@
+'''
+Тексты SQL функции auth: схема подставляется один раз при импорте модуля,
+а не f-строкой на каждом запросе
+'''
+import os
+
+SCHEMA = os.environ['MAIN_DB_SCHEMA']
+
+RECENT_CODE = f"""
+    SELECT id, code, EXTRACT(EPOCH FROM expires_at - NOW())::int,
+           sent_at IS NULL AND COALESCE(dispatched_at, created_at) < NOW() - %s * INTERVAL '1 second'
+    FROM {SCHEMA}.sms_codes
+    WHERE phone = %s AND verified = false AND expires_at > NOW()
+      AND created_at > NOW() - %s * INTERVAL '1 second'
+    ORDER BY created_at DESC LIMIT 1
+"""
+
+INSERT_CODE = f"INSERT INTO {SCHEMA}.sms_codes (phone, code, expires_at) VALUES (%s, %s, %s) RETURNING id"
+
+FIND_CODE = f"""
+    SELECT id FROM {SCHEMA}.sms_codes
+    WHERE phone = %s AND code = %s AND expires_at > NOW() AND verified = false
+    ORDER BY created_at DESC LIMIT 1
+"""
+
+VERIFY_CODE = f"UPDATE {SCHEMA}.sms_codes SET verified = true WHERE id = %s"
+
+MARK_SENT = f"UPDATE {SCHEMA}.sms_codes SET sent_at = NOW() WHERE id = %s"
+
+MARK_DISPATCHED = f"""
+    UPDATE {SCHEMA}.sms_codes SET dispatched_at = NOW(), dispatch_attempts = dispatch_attempts + 1
+    WHERE id = %s
+"""
+
+# Коды, чья отправка не дошла до шлюза (экземпляр заморозили, очередь была полна,
+# шлюз не ответил); SKIP LOCKED и dispatched_at не дают двум экземплярам взять один код
+CLAIM_UNSENT = f"""
+    UPDATE {SCHEMA}.sms_codes SET dispatched_at = NOW(), dispatch_attempts = dispatch_attempts + 1
+    WHERE id IN (
+        SELECT id FROM {SCHEMA}.sms_codes
+        WHERE sent_at IS NULL AND verified = false AND expires_at > NOW()
+          AND COALESCE(dispatched_at, created_at) < NOW() - %s * INTERVAL '1 second'
+          AND dispatch_attempts < %s
+        ORDER BY created_at
+        LIMIT %s
+        FOR UPDATE SKIP LOCKED
+    )
+    RETURNING id, phone, code
+"""
+
+FIND_USER = f"SELECT id, full_name, avatar_url, status FROM {SCHEMA}.users WHERE phone = %s"
+
+INSERT_USER = f"INSERT INTO {SCHEMA}.users (phone, full_name) VALUES (%s, %s) RETURNING id, full_name, avatar_url, status"
+
+INSERT_SESSION = f"INSERT INTO {SCHEMA}.sessions (user_id, token, device_info, expires_at) VALUES (%s, %s, %s, %s)"
+
+# Набор обновляемых полей заранее не известен, поэтому SET подставляется при вызове
+UPDATE_PROFILE = f"UPDATE {SCHEMA}.users SET {{assignments}}, updated_at = NOW() WHERE id = %s"
+
+DELETE_SESSION = f"DELETE FROM {SCHEMA}.sessions WHERE token = %s"
+
+_REFILLED = "LEAST(%(capacity)s, rate_limits.tokens + EXTRACT(EPOCH FROM NOW() - rate_limits.updated_at) * %(refill)s)"
+
+TAKE_TOKEN = f"""
+    INSERT INTO {SCHEMA}.rate_limits AS rate_limits (bucket_key, tokens, updated_at)
+    VALUES (%(key)s, %(capacity)s - 1, NOW())
+    ON CONFLICT (bucket_key) DO UPDATE SET
+        tokens = {_REFILLED} - 1,
+        updated_at = NOW()
+    WHERE {_REFILLED} >= 1
+    RETURNING tokens
+"""
+
+BUCKET_TOKENS = f"""
+    SELECT {_REFILLED} FROM {SCHEMA}.rate_limits
+    WHERE bucket_key = %(key)s
+"""
@@ -0,0 +1,45 @@
+'''
+Token bucket в Postgres: состояние общее для всех экземпляров функции, проверка
+и списание токена — один атомарный upsert по ключу вида «phone:+7999...» или «ip:1.2.3.4»
+'''
+import os
+
+import queries
+
+PHONE_BUCKET_CAPACITY = float(os.environ.get('SMS_PHONE_BUCKET_CAPACITY', '3'))
+PHONE_BUCKET_REFILL = float(os.environ.get('SMS_PHONE_BUCKET_REFILL', str(1 / 120)))
+IP_BUCKET_CAPACITY = float(os.environ.get('SMS_IP_BUCKET_CAPACITY', '20'))
+IP_BUCKET_REFILL = float(os.environ.get('SMS_IP_BUCKET_REFILL', str(1 / 10)))
+
+
+class RateLimited(Exception):
+    def __init__(self, key: str, retry_after: float):
+        super().__init__(f'Too many requests for {key}')
+        self.key = key
+        self.retry_after = retry_after
+
+
+class Bucket:
+    def __init__(self, prefix: str, capacity: float, refill_per_second: float):
+        self.prefix = prefix
+        self.capacity = capacity
+        self.refill_per_second = refill_per_second
+
+
+PHONE = Bucket('phone', PHONE_BUCKET_CAPACITY, PHONE_BUCKET_REFILL)
+IP = Bucket('ip', IP_BUCKET_CAPACITY, IP_BUCKET_REFILL)
+
+
+def take(cur, bucket: Bucket, value: str):
+    '''
+    Списывает один токен или бросает RateLimited со временем до следующего токена
+    '''
+    key = f'{bucket.prefix}:{value}'
+    params = {'key': key, 'capacity': bucket.capacity, 'refill': bucket.refill_per_second}
+    cur.execute(queries.TAKE_TOKEN, params)
+    if cur.fetchone() is not None:
+        return
+
+    cur.execute(queries.BUCKET_TOKENS, params)
+    tokens = float(cur.fetchone()[0])
+    raise RateLimited(key, max(1.0, (1 - tokens) / bucket.refill_per_second))
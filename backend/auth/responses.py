@@ -0,0 +1,101 @@
+'''
+Общий слой HTTP-ответов функций: orjson, если установлен, иначе стандартный json;
+datetime сериализуется сам (ISO 8601), крупные тела сжимаются br/gzip по
+Accept-Encoding, для неизменившихся данных — ETag и 304 Not Modified
+'''
+import base64
+import gzip
+import hashlib
+import json
+from datetime import date, datetime
+
+from tracing import span
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+COMPRESS_MIN_BYTES = 1024
+GZIP_LEVEL = 5
+BROTLI_QUALITY = 5
+BASE_HEADERS = {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'}
+
+
+def dumps(data) -> bytes:
+    with span('serialize'):
+        if orjson is not None:
+            return orjson.dumps(data, option=orjson.OPT_NON_STR_KEYS)
+        return json.dumps(data, default=_default, ensure_ascii=False, separators=(',', ':')).encode()
+
+
+def _default(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    raise TypeError(f'{type(value).__name__} is not JSON serializable')
+
+
+def header(event: dict, name: str) -> str:
+    name = name.lower()
+    for key, value in (event.get('headers') or {}).items():
+        if key.lower() == name:
+            return value or ''
+    return ''
+
+
+def respond(event: dict, data, status_code: int = 200, etag: bool = False) -> dict:
+    '''
+    Ответ с учётом заголовков запроса: 304 при совпадении If-None-Match (etag=True)
+    и сжатие тела, если клиент его принимает
+    '''
+    body = dumps(data)
+    headers = dict(BASE_HEADERS)
+
+    if etag:
+        tag = '"' + hashlib.blake2b(body, digest_size=16).hexdigest() + '"'
+        headers['ETag'] = tag
+        if tag in [value.strip() for value in header(event, 'If-None-Match').split(',')]:
+            return {'statusCode': 304, 'headers': headers, 'body': ''}
+
+    if len(body) >= COMPRESS_MIN_BYTES:
+        accepted = header(event, 'Accept-Encoding')
+        headers['Vary'] = 'Accept-Encoding'
+        if brotli is not None and 'br' in accepted:
+            with span('compress'):
+                return _binary(status_code, headers, 'br', brotli.compress(body, quality=BROTLI_QUALITY))
+        if 'gzip' in accepted:
+            with span('compress'):
+                return _binary(status_code, headers, 'gzip', gzip.compress(body, compresslevel=GZIP_LEVEL))
+
+    return {'statusCode': status_code, 'headers': headers, 'body': body.decode()}
+
+
+def _binary(status_code: int, headers: dict, encoding: str, body: bytes) -> dict:
+    headers['Content-Encoding'] = encoding
+    return {
+        'statusCode': status_code,
+        'headers': headers,
+        'body': base64.b64encode(body).decode(),
+        'isBase64Encoded': True
+    }
+
+
+def success_response(data: dict):
+    return {
+        'statusCode': 200,
+        'headers': dict(BASE_HEADERS),
+        'body': dumps(data).decode()
+    }
+
+
+def error_response(message: str, status_code: int = 400):
+    return {
+        'statusCode': status_code,
+        'headers': dict(BASE_HEADERS),
+        'body': dumps({'error': message}).decode()
+    }
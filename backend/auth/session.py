@@ -0,0 +1,110 @@
+'''
+Проверка сессии: подпись JWT, затем кэш TTL/LRU «токен -> профиль», при промахе —
+один запрос sessions JOIN users
+'''
+import os
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+
+from db import get_pool
+from tracing import span
+
+SESSION_CACHE_TTL = float(os.environ.get('SESSION_CACHE_TTL', '60'))
+SESSION_CACHE_SIZE = int(os.environ.get('SESSION_CACHE_SIZE', '10000'))
+SESSION_SQL = f"""
+    SELECT u.id, u.phone, u.full_name, u.avatar_url, u.status, s.expires_at
+    FROM {os.environ['MAIN_DB_SCHEMA']}.sessions s
+    INNER JOIN {os.environ['MAIN_DB_SCHEMA']}.users u ON u.id = s.user_id
+    WHERE s.token = %s AND s.expires_at > NOW()
+"""
+
+
+class AuthError(Exception):
+    def __init__(self, message: str, status_code: int = 401):
+        super().__init__(message)
+        self.message = message
+        self.status_code = status_code
+
+
+class SessionCache:
+    def __init__(self, ttl: float = SESSION_CACHE_TTL, max_size: int = SESSION_CACHE_SIZE):
+        self.ttl = ttl
+        self.max_size = max_size
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats = {'hits': 0, 'misses': 0}
+
+    def get(self, token: str):
+        with self._lock:
+            item = self._items.get(token)
+            if item is None or item[0] <= time.monotonic():
+                if item is not None:
+                    del self._items[token]
+                self.stats['misses'] += 1
+                return None
+            self._items.move_to_end(token)
+            self.stats['hits'] += 1
+            return item[1]
+
+    def put(self, token: str, user: dict, ttl: float):
+        with self._lock:
+            self._items[token] = (time.monotonic() + min(ttl, self.ttl), user)
+            self._items.move_to_end(token)
+            while len(self._items) > self.max_size:
+                self._items.popitem(last=False)
+
+    def invalidate_token(self, token: str):
+        with self._lock:
+            self._items.pop(token, None)
+
+    def invalidate_user(self, user_id: int):
+        with self._lock:
+            for token in [t for t, (_, user) in self._items.items() if user['id'] == user_id]:
+                del self._items[token]
+
+
+cache = SessionCache()
+
+
+def authenticate(token: str) -> dict:
+    if not token:
+        raise AuthError('Authorization required')
+    # PyJWT тянет за собой cryptography, если она установлена; send_code в auth
+    # обходится без него, поэтому импорт — при первой проверке токена
+    import jwt
+    try:
+        with span('jwt'):
+            payload = jwt.decode(token, os.environ['JWT_SECRET'], algorithms=['HS256'])
+    except jwt.ExpiredSignatureError:
+        raise AuthError('Token expired')
+    except jwt.InvalidTokenError:
+        raise AuthError('Invalid token')
+
+    user = cache.get(token)
+    if user is not None:
+        return user
+
+    pool = get_pool()
+    conn = pool.getconn()
+    cur = conn.cursor()
+    try:
+        cur.execute(SESSION_SQL, (token,))
+        row = cur.fetchone()
+    finally:
+        cur.close()
+        pool.putconn(conn)
+
+    if not row or row[0] != payload.get('user_id'):
+        raise AuthError('Invalid or expired token')
+
+    user = {
+        'id': row[0],
+        'phone': row[1],
+        'full_name': row[2],
+        'avatar_url': row[3],
+        'status': row[4]
+    }
+    cache.put(token, user, (row[5] - datetime.now()).total_seconds())
+    return user
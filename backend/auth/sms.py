@@ -0,0 +1,125 @@
+'''
+Отправка SMS в фоне: send_code только ставит сообщение в очередь и сразу отвечает,
+рабочий поток ходит в шлюз через общую keep-alive сессию и отмечает sms_codes.sent_at.
+
+Платформа может заморозить экземпляр сразу после ответа, и поток не доработает —
+код останется с sent_at IS NULL. Поэтому каждый send_code сначала подбирает такие
+коды (sweep) и ставит в очередь заново, не больше SMS_DISPATCH_ATTEMPTS раз на код.
+Цена быстрого ответа: SMS может уйти с задержкой до следующего вызова функции,
+а оттаявший поток иногда отправляет код повторно. Синхронная отправка этого лишена,
+но держит ответ на время ответа шлюза (сотни миллисекунд, до SMS_TIMEOUT)
+'''
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import queries
+from db import get_pool
+
+SMS_GATEWAY_URL = os.environ.get('SMS_GATEWAY_URL', 'https://smsc.ru/sys/send.php')
+SMS_WORKERS = 2
+SMS_QUEUE = 100
+SMS_TIMEOUT = 10
+SMS_RETRIES = 2
+SMS_DISPATCH_ATTEMPTS = 3
+SMS_SWEEP_BATCH = 20
+MESSAGE = 'BizChat код: {code}'
+
+_executor = ThreadPoolExecutor(max_workers=SMS_WORKERS, thread_name_prefix='sms')
+_slots = threading.BoundedSemaphore(SMS_WORKERS + SMS_QUEUE)
+_session = None
+
+
+def enqueue(code_id: int, phone: str, message: str) -> bool:
+    '''
+    False, если очередь переполнена — код остаётся неотправленным
+    и будет переотправлен при следующем запросе send_code
+    '''
+    if not _slots.acquire(blocking=False):
+        return False
+    future = _executor.submit(deliver, code_id, phone, message)
+    future.add_done_callback(lambda _: _slots.release())
+    return True
+
+
+def sweep(cur, resend_after: int) -> int:
+    '''
+    Заново ставит в очередь коды, которые не отправились за resend_after секунд;
+    вызывающий коммитит транзакцию, чтобы отметка dispatched_at стала видна другим экземплярам
+    '''
+    cur.execute(queries.CLAIM_UNSENT, (resend_after, SMS_DISPATCH_ATTEMPTS, SMS_SWEEP_BATCH))
+    claimed = cur.fetchall()
+    for code_id, phone, code in claimed:
+        enqueue(code_id, phone, MESSAGE.format(code=code))
+    return len(claimed)
+
+
+def deliver(code_id: int, phone: str, message: str):
+    for attempt in range(SMS_RETRIES + 1):
+        try:
+            send_sms(phone, message)
+            break
+        except Exception as e:
+            print(f'SMS to {phone} failed (attempt {attempt + 1}): {str(e)}')
+            if attempt == SMS_RETRIES:
+                return
+            time.sleep(0.5 * (attempt + 1))
+
+    pool = get_pool()
+    conn = pool.getconn()
+    try:
+        with conn.cursor() as cur:
+            cur.execute(queries.MARK_SENT, (code_id,))
+        conn.commit()
+    finally:
+        pool.putconn(conn)
+
+
+def send_sms(phone: str, message: str):
+    sms_api_key = os.environ.get('SMS_API_KEY', '')
+    if not sms_api_key:
+        print(f'[DEV MODE] SMS to {phone}: {message}')
+        return
+
+    response = http_session().post(
+        SMS_GATEWAY_URL,
+        data={
+            'login': 'api',
+            'psw': sms_api_key,
+            'phones': phone,
+            'mes': message,
+            'fmt': 3
+        },
+        timeout=SMS_TIMEOUT
+    )
+    response.raise_for_status()
+    result = response.json()
+    if 'error' in result:
+        raise RuntimeError(result['error'])
+    print(f'SMS sent to {phone}: {result}')
+
+
+def http_session():
+    global _session
+    if _session is None:
+        import requests
+        _session = requests.Session()
+    return _session
+
+
+def wait_idle(timeout: float = 30.0):
+    '''
+    Ждёт, пока очередь опустеет; нужно бенчмаркам и локальным проверкам
+    '''
+    deadline = time.monotonic() + timeout
+    acquired = 0
+    try:
+        while acquired < SMS_WORKERS + SMS_QUEUE:
+            if not _slots.acquire(timeout=max(0.0, deadline - time.monotonic())):
+                return False
+            acquired += 1
+        return True
+    finally:
+        for _ in range(acquired):
+            _slots.release()
@@ -0,0 +1,133 @@
+'''
+Чтение истории, которую backend/archive выгрузил из старых секций messages в S3:
+сжатые JSONL-куски истории чата, список кусков с их first_at/last_at — в message_archives.
+Куски читаются потоком, в памяти остаётся только страница; небольшие сжатые куски
+кэшируются с ограничением по суммарному размеру
+'''
+import gzip
+import io
+import json
+import os
+from collections import OrderedDict, deque
+from datetime import date, datetime
+
+import queries
+
+S3_ENDPOINT_URL = os.environ.get('S3_ENDPOINT_URL', 'https://bucket.poehali.dev')
+BUCKET = 'files'
+CHUNK_CACHE_BYTES = int(os.environ.get('ARCHIVE_CACHE_BYTES', str(16 * 1024 * 1024)))
+# Старые объекты (до нарезки на куски) бывают огромными: они не кэшируются, а только читаются потоком
+CHUNK_CACHE_OBJECT_MAX = 2 * 1024 * 1024
+# Должно совпадать с настройкой функции archive: секции моложе этого срока в S3 не уходят
+ARCHIVE_AFTER_MONTHS = int(os.environ.get('MESSAGES_ARCHIVE_AFTER_MONTHS', '12'))
+
+_s3 = None
+_chunks = OrderedDict()
+_chunks_size = 0
+
+
+def archived_rows(cur, chat_id: int, limit: int, before: tuple = None, after: tuple = None) -> list:
+    '''
+    Строки в формате запроса get_messages: от новых к старым для before
+    (или без курсора), от старых к новым для after
+    '''
+    if after:
+        cur.execute(queries.ARCHIVE_KEYS['after'], (chat_id, after[0]))
+    elif before:
+        cur.execute(queries.ARCHIVE_KEYS['before'], (chat_id, before[0]))
+    else:
+        cur.execute(queries.ARCHIVE_KEYS[None], (chat_id,))
+    keys = [row[0] for row in cur.fetchall()]
+
+    picked = []
+    for key in keys:
+        if after:
+            for m in read_chunk(key):
+                if (m['created_at'], m['id']) > after:
+                    picked.append(m)
+                    if len(picked) >= limit:
+                        break
+        else:
+            # Кусок идёт от старых к новым, а нужны последние до before: хватает окна на остаток страницы
+            window = deque(maxlen=limit - len(picked))
+            window.extend(m for m in read_chunk(key) if before is None or (m['created_at'], m['id']) < before)
+            picked.extend(reversed(window))
+        if len(picked) >= limit:
+            break
+    if not picked:
+        return []
+
+    cur.execute(
+        queries.ARCHIVE_SENDERS,
+        (list({m['sender_id'] for m in picked}),)
+    )
+    senders = {row[0]: row[1:] for row in cur.fetchall()}
+
+    return [
+        (m['id'], m['sender_id'], m['msg_type'], m['content'], m['file_url'], m['file_name'], m['created_at'],
+         *senders.get(m['sender_id'], (None, None)), m['thumb_url'], m['preview'], m['media_width'], m['media_height'])
+        for m in picked
+    ]
+
+
+def archive_horizon() -> datetime:
+    '''
+    Граница, старше которой сообщения могут лежать в архиве; всё, что новее, — только в живой таблице
+    '''
+    today = date.today()
+    index = today.year * 12 + today.month - 1 - ARCHIVE_AFTER_MONTHS
+    return datetime(index // 12, index % 12 + 1, 1)
+
+
+def read_chunk(key: str):
+    '''
+    Сообщения куска по порядку; сжатые байты небольшого куска остаются в кэше
+    '''
+    global _chunks_size
+    data = _chunks.get(key)
+    if data is not None:
+        _chunks.move_to_end(key)
+        yield from parse_chunk(io.BytesIO(data))
+        return
+
+    obj = s3_client().get_object(Bucket=BUCKET, Key=key)
+    body = obj['Body']
+    try:
+        if obj['ContentLength'] > CHUNK_CACHE_OBJECT_MAX:
+            yield from parse_chunk(body)
+            return
+        data = body.read()
+    finally:
+        body.close()
+
+    _chunks[key] = data
+    _chunks_size += len(data)
+    while _chunks_size > CHUNK_CACHE_BYTES and len(_chunks) > 1:
+        _, evicted = _chunks.popitem(last=False)
+        _chunks_size -= len(evicted)
+    yield from parse_chunk(io.BytesIO(data))
+
+
+def parse_chunk(stream):
+    with gzip.GzipFile(fileobj=stream) as lines:
+        for line in lines:
+            message = json.loads(line)
+            message['created_at'] = datetime.fromisoformat(message['created_at'])
+            yield message
+
+
+def s3_client():
+    global _s3
+    if _s3 is None:
+        # boto3 грузится только при первом обращении к архиву: на холодный старт
+        # функции это сотни миллисекунд, а архив читается редко
+        import boto3
+        from botocore.config import Config
+        _s3 = boto3.client(
+            's3',
+            endpoint_url=S3_ENDPOINT_URL,
+            aws_access_key_id=os.environ['AWS_ACCESS_KEY_ID'],
+            aws_secret_access_key=os.environ['AWS_SECRET_ACCESS_KEY'],
+            config=Config(tcp_keepalive=True, retries={'max_attempts': 3, 'mode': 'standard'})
+        )
+    return _s3
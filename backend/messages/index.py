@@ -1,12 +1,41 @@
+import base64
 import json
-import os
-import psycopg2
 from datetime import datetime
-import jwt
 
+from psycopg2.extras import execute_values
+
+import membership
+import presence
+import queries
+from archive import archive_horizon, archived_rows
+from db import get_pool
+from responses import error_response, respond, success_response
+from session import AuthError, authenticate
+from tracing import tag, traced
+
+MESSAGES_PAGE_SIZE = 50
+MESSAGES_PAGE_MAX = 200
+SYNC_CHATS_MAX = 200
+SYNC_MESSAGES_MAX = 500
+SEARCH_MIN_LENGTH = 3
+SEARCH_PAGE_SIZE = 20
+SEARCH_PAGE_MAX = 50
+BATCH_MAX = 1000
+MEMBERS_PAGE_SIZE = 100
+MEMBERS_PAGE_MAX = 500
+GROUP_MEMBERS_MAX = 10000
+GROUP_TITLE_MAX = 255
+SEARCH_HEADLINE = 'StartSel=<mark>, StopSel=</mark>, MaxWords=20, MinWords=5, MaxFragments=2'
+EVENTS_CHANNEL = 'messenger_events'
+NOTIFY_PAYLOAD_MAX = 7900
+MEDIA_DIMENSION_MAX = 16384
+ID_MAX = 2 ** 31 - 1
+SEQ_LOCK_KEYS = 2 ** 31
+
+@traced('messages')
 def handler(event: dict, context) -> dict:
     '''
-    API для работы с сообщениями: отправка, получение истории чата, поиск пользователей
+    API для работы с сообщениями: отправка, получение истории чата, поиск пользователей и сообщений
     '''
     method = event.get('httpMethod', 'GET')
     
@@ -22,95 +51,158 @@ def handler(event: dict, context) -> dict:
         }
     
     token = event.get('headers', {}).get('X-Authorization', '').replace('Bearer ', '')
-    if not token:
-        return error_response('Authorization required', 401)
-    
     try:
-        payload = jwt.decode(token, os.environ['JWT_SECRET'], algorithms=['HS256'])
-        user_id = payload['user_id']
-    except:
-        return error_response('Invalid token', 401)
+        user_id = authenticate(token)['id']
+    except AuthError as e:
+        return error_response(e.message, e.status_code)
     
-    conn = psycopg2.connect(os.environ['DATABASE_URL'])
+    pool = get_pool()
+    conn = pool.getconn()
     cur = conn.cursor()
     
     try:
         if method == 'GET':
             action = event.get('queryStringParameters', {}).get('action', 'get_chats')
+            tag(action=action)
             
             if action == 'get_chats':
+                cursor = safe_seq(cur)
+                cur.execute(
+                    queries.GET_CHATS,
+                    (user_id,)
+                )
+                
+                rows = cur.fetchall()
+                chats = chats_with_presence(rows)
+                
+                return respond(event, {'chats': chats, 'cursor': str(cursor)}, etag=True)
+            
+            elif action == 'sync':
+                params = event.get('queryStringParameters', {})
+                try:
+                    since = int(params.get('cursor', '0'))
+                except ValueError:
+                    return error_response('Invalid cursor', 400)
+                
+                # Номера до safe_seq уже не появятся задним числом: дальше неё курсор не уходит
+                cursor = max(safe_seq(cur), since)
+                cur.execute(
+                    queries.SYNC_CHATS,
+                    (user_id, since, cursor, SYNC_CHATS_MAX + 1)
+                )
+                
+                chat_rows = cur.fetchall()
+                has_more = len(chat_rows) > SYNC_CHATS_MAX
+                chat_rows = chat_rows[:SYNC_CHATS_MAX]
+                if has_more:
+                    cursor = chat_rows[-1][7]
+                
+                cur.execute(
+                    queries.SYNC_MESSAGES,
+                    (user_id, since, cursor, SYNC_MESSAGES_MAX + 1)
+                )
+                message_rows = cur.fetchall()
+                if len(message_rows) > SYNC_MESSAGES_MAX:
+                    has_more = True
+                    message_rows = message_rows[:SYNC_MESSAGES_MAX]
+                    cursor = message_rows[-1][10]
+                
                 cur.execute(
-                    f"""
-                    SELECT DISTINCT c.id, c.chat_type, c.title, c.avatar_url,
-                           (SELECT content FROM {os.environ['MAIN_DB_SCHEMA']}.messages 
-                            WHERE chat_id = c.id ORDER BY created_at DESC LIMIT 1) as last_message,
-                           (SELECT created_at FROM {os.environ['MAIN_DB_SCHEMA']}.messages 
-                            WHERE chat_id = c.id ORDER BY created_at DESC LIMIT 1) as last_message_time,
-                           (SELECT COUNT(*) FROM {os.environ['MAIN_DB_SCHEMA']}.messages m
-                            WHERE m.chat_id = c.id AND m.sender_id != %s 
-                            AND NOT EXISTS (
-                                SELECT 1 FROM {os.environ['MAIN_DB_SCHEMA']}.message_reads mr 
-                                WHERE mr.message_id = m.id AND mr.user_id = %s
-                            )) as unread_count
-                    FROM {os.environ['MAIN_DB_SCHEMA']}.chats c
-                    INNER JOIN {os.environ['MAIN_DB_SCHEMA']}.chat_members cm ON c.id = cm.chat_id
-                    WHERE cm.user_id = %s
-                    ORDER BY last_message_time DESC NULLS LAST
-                    """,
-                    (user_id, user_id, user_id)
+                    queries.SYNC_REMOVALS,
+                    (user_id, since, cursor)
                 )
+                removed_chats = [row[0] for row in cur.fetchall()]
                 
-                chats = []
-                for row in cur.fetchall():
-                    chat_id, chat_type, title, avatar_url, last_message, last_message_time, unread_count = row
-                    
-                    if chat_type == 'private':
-                        cur.execute(
-                            f"""
-                            SELECT u.id, u.full_name, u.avatar_url, u.is_online
-                            FROM {os.environ['MAIN_DB_SCHEMA']}.users u
-                            INNER JOIN {os.environ['MAIN_DB_SCHEMA']}.chat_members cm ON u.id = cm.user_id
-                            WHERE cm.chat_id = %s AND u.id != %s
-                            """,
-                            (chat_id, user_id)
-                        )
-                        other_user = cur.fetchone()
-                        if other_user:
-                            title = other_user[1]
-                            avatar_url = other_user[2]
-                    
-                    chats.append({
-                        'id': chat_id,
-                        'type': chat_type,
-                        'title': title,
-                        'avatar_url': avatar_url,
-                        'last_message': last_message,
-                        'last_message_time': str(last_message_time) if last_message_time else None,
-                        'unread_count': unread_count
+                messages = []
+                for row in message_rows:
+                    msg_id, sender_id, msg_type, content, file_url, file_name, created_at, sender_name, sender_avatar, chat_id, _, thumb_url, preview, width, height = row
+                    messages.append({
+                        'id': msg_id,
+                        'chat_id': chat_id,
+                        'sender_id': sender_id,
+                        'sender_name': sender_name,
+                        'sender_avatar': sender_avatar,
+                        'type': msg_type,
+                        'content': content,
+                        'file_url': file_url,
+                        'file_name': file_name,
+                        'thumb_url': thumb_url,
+                        'preview': preview,
+                        'width': width,
+                        'height': height,
+                        'created_at': created_at,
+                        'is_mine': sender_id == user_id
                     })
                 
-                return success_response({'chats': chats})
+                return respond(event, {
+                    'cursor': str(cursor),
+                    'has_more': has_more,
+                    'chats': chats_with_presence(chat_rows),
+                    'removed_chats': removed_chats,
+                    'messages': messages
+                })
             
             elif action == 'get_messages':
-                chat_id = event.get('queryStringParameters', {}).get('chat_id')
+                params = event.get('queryStringParameters', {})
+                chat_id = params.get('chat_id')
                 if not chat_id:
                     return error_response('chat_id required', 400)
                 
+                try:
+                    chat_id = positive_id(chat_id, 'chat_id')
+                    limit = min(int(params.get('limit', MESSAGES_PAGE_SIZE)), MESSAGES_PAGE_MAX)
+                    before = decode_cursor(params['before']) if params.get('before') else None
+                    after = decode_cursor(params['after']) if params.get('after') else None
+                except ValueError:
+                    return error_response('Invalid chat_id, cursor or limit', 400)
+                if limit < 1 or (before and after):
+                    return error_response('Invalid cursor or limit', 400)
+                if not membership.is_member(cur, user_id, chat_id):
+                    return error_response('Not a member of this chat', 403)
+                
+                if after:
+                    direction = 'after'
+                    cursor_args = (after[0], after[0], after[1])
+                elif before:
+                    direction = 'before'
+                    cursor_args = (before[0], before[0], before[1])
+                else:
+                    direction = None
+                    cursor_args = ()
+                
                 cur.execute(
-                    f"""
-                    SELECT m.id, m.sender_id, m.msg_type, m.content, m.file_url, 
-                           m.file_name, m.created_at, u.full_name, u.avatar_url
-                    FROM {os.environ['MAIN_DB_SCHEMA']}.messages m
-                    INNER JOIN {os.environ['MAIN_DB_SCHEMA']}.users u ON m.sender_id = u.id
-                    WHERE m.chat_id = %s
-                    ORDER BY m.created_at ASC
-                    """,
-                    (chat_id,)
+                    queries.MESSAGES_PAGE[direction],
+                    (chat_id, *cursor_args, limit + 1)
                 )
                 
+                rows = cur.fetchall()
+                
+                # Секции старше MESSAGES_ARCHIVE_AFTER_MONTHS лежат в S3: история
+                # дочитывается оттуда, когда живые строки кончились, а вперёд — только
+                # если курсор старше границы архива
+                if after and after[0] < archive_horizon():
+                    rows = (archived_rows(cur, chat_id, limit + 1, after=after) + rows)[:limit + 1]
+                elif len(rows) <= limit:
+                    oldest = (rows[-1][6], rows[-1][0]) if rows else before
+                    rows += archived_rows(cur, chat_id, limit + 1 - len(rows), before=oldest)
+                
+                has_more = len(rows) > limit
+                rows = rows[:limit]
+                if direction != 'after':
+                    rows.reverse()
+                
+                seen_by = {}
+                my_ids = [row[0] for row in rows if row[1] == user_id]
+                if my_ids:
+                    cur.execute(
+                        queries.SEEN_BY,
+                        (my_ids, chat_id, user_id)
+                    )
+                    seen_by = dict(cur.fetchall())
+                
                 messages = []
-                for row in cur.fetchall():
-                    msg_id, sender_id, msg_type, content, file_url, file_name, created_at, sender_name, sender_avatar = row
+                for row in rows:
+                    msg_id, sender_id, msg_type, content, file_url, file_name, created_at, sender_name, sender_avatar, thumb_url, preview, width, height = row
                     messages.append({
                         'id': msg_id,
                         'sender_id': sender_id,
@@ -120,145 +212,645 @@ def handler(event: dict, context) -> dict:
                         'content': content,
                         'file_url': file_url,
                         'file_name': file_name,
-                        'created_at': str(created_at),
-                        'is_mine': sender_id == user_id
+                        'thumb_url': thumb_url,
+                        'preview': preview,
+                        'width': width,
+                        'height': height,
+                        'created_at': created_at,
+                        'is_mine': sender_id == user_id,
+                        'seen_by': seen_by.get(msg_id, 0)
                     })
                 
-                return success_response({'messages': messages})
+                return respond(event, {
+                    'messages': messages,
+                    'has_more': has_more,
+                    'before_cursor': encode_cursor(rows[0][6], rows[0][0]) if rows else params.get('before'),
+                    'after_cursor': encode_cursor(rows[-1][6], rows[-1][0]) if rows else params.get('after')
+                })
             
             elif action == 'search_users':
-                phone = event.get('queryStringParameters', {}).get('phone', '').strip()
-                if not phone:
-                    return error_response('phone required', 400)
+                params = event.get('queryStringParameters', {})
+                query = (params.get('q') or params.get('phone') or '').strip()
+                digits = normalize_phone(query, partial=True)
+                by_phone = len(digits) >= SEARCH_MIN_LENGTH and not any(ch.isalpha() for ch in query)
+                if not by_phone and len(query) < SEARCH_MIN_LENGTH:
+                    return error_response(f'q must be at least {SEARCH_MIN_LENGTH} characters', 400)
+                
+                try:
+                    limit = min(int(params.get('limit', SEARCH_PAGE_SIZE)), SEARCH_PAGE_MAX)
+                    after_rank, after_id, after_key = params.get('cursor', '-1:-1:').split(':', 2)
+                    after_rank, after_id = int(after_rank), int(after_id)
+                except ValueError:
+                    return error_response('Invalid cursor or limit', 400)
+                
+                if by_phone:
+                    # Суффикс ищется по цифрам как набраны: phone_digits_rev не нормализуется
+                    raw_digits = ''.join(ch for ch in query if ch.isdigit())
+                    search_args = {'term': digits, 'prefix': f'{digits}%', 'suffix': f'{raw_digits[::-1]}%'}
+                else:
+                    term = escape_like(query.lower())
+                    search_args = {'term': query.lower(), 'prefix': f'{term}%', 'contains': f'%{term}%'}
                 
                 cur.execute(
-                    f"""
-                    SELECT id, phone, full_name, avatar_url, status, is_online
-                    FROM {os.environ['MAIN_DB_SCHEMA']}.users
-                    WHERE phone LIKE %s AND id != %s
-                    LIMIT 20
-                    """,
-                    (f'%{phone}%', user_id)
+                    queries.SEARCH_USERS['phone' if by_phone else 'name'],
+                    dict(search_args, user_id=user_id, after_rank=after_rank, after_id=after_id, after_key=after_key,
+                         limit=limit + 1)
                 )
                 
+                rows = cur.fetchall()
+                has_more = len(rows) > limit
+                rows = rows[:limit]
+                
+                states = presence.lookup(row[0] for row in rows)
                 users = []
-                for row in cur.fetchall():
+                for row in rows:
                     users.append({
                         'id': row[0],
                         'phone': row[1],
                         'full_name': row[2],
                         'avatar_url': row[3],
                         'status': row[4],
-                        'is_online': row[5]
+                        'is_online': presence.is_online(states, row[0])
                     })
                 
-                return success_response({'users': users})
+                return respond(event, {
+                    'users': users,
+                    'has_more': has_more,
+                    'next_cursor': f'{rows[-1][5]}:{rows[-1][0]}:{rows[-1][6]}' if has_more else None
+                })
+        
+            elif action == 'search_messages':
+                params = event.get('queryStringParameters', {})
+                query = (params.get('q') or '').strip()
+                if len(query) < SEARCH_MIN_LENGTH:
+                    return error_response(f'q must be at least {SEARCH_MIN_LENGTH} characters', 400)
+                
+                try:
+                    limit = min(int(params.get('limit', SEARCH_PAGE_SIZE)), SEARCH_PAGE_MAX)
+                    chat_id = int(params['chat_id']) if params.get('chat_id') else None
+                    after = params.get('cursor')
+                    after_rank, after_id = (float(after.split(':')[0]), int(after.split(':')[1])) if after else (None, None)
+                except (ValueError, IndexError):
+                    return error_response('Invalid cursor, chat_id or limit', 400)
+                
+                cur.execute(
+                    queries.SEARCH_MESSAGES,
+                    {
+                        'q': query,
+                        'user_id': user_id,
+                        'chat_id': chat_id,
+                        'after_rank': after_rank,
+                        'after_id': after_id,
+                        'limit': limit + 1,
+                        'headline': SEARCH_HEADLINE
+                    }
+                )
+                
+                rows = cur.fetchall()
+                has_more = len(rows) > limit
+                rows = rows[:limit]
+                
+                results = []
+                for row in rows:
+                    results.append({
+                        'id': row[0],
+                        'chat_id': row[1],
+                        'sender_id': row[2],
+                        'sender_name': row[3],
+                        'type': row[4],
+                        'created_at': row[5],
+                        'snippet': row[6],
+                        'rank': row[7]
+                    })
+                
+                return respond(event, {
+                    'messages': results,
+                    'has_more': has_more,
+                    'next_cursor': f'{rows[-1][7]!r}:{rows[-1][0]}' if has_more else None
+                })
+            
+            elif action == 'list_members':
+                params = event.get('queryStringParameters', {})
+                try:
+                    chat_id = int(params['chat_id'])
+                    limit = min(int(params.get('limit', MEMBERS_PAGE_SIZE)), MEMBERS_PAGE_MAX)
+                    after_id = int(params.get('cursor', '0'))
+                except (KeyError, ValueError):
+                    return error_response('Invalid chat_id, cursor or limit', 400)
+                if limit < 1:
+                    return error_response('Invalid chat_id, cursor or limit', 400)
+                if not membership.is_member(cur, user_id, chat_id):
+                    return error_response('Not a member of this chat', 403)
+                
+                # Ключ страницы — user_id: идём по уникальному индексу (chat_id, user_id)
+                # без OFFSET, стоимость страницы не зависит от размера группы
+                cur.execute(queries.LIST_MEMBERS, (chat_id, after_id, limit + 1))
+                
+                rows = cur.fetchall()
+                has_more = len(rows) > limit
+                rows = rows[:limit]
+                
+                states = presence.lookup(row[0] for row in rows)
+                members = []
+                for row in rows:
+                    members.append({
+                        'id': row[0],
+                        'full_name': row[1],
+                        'avatar_url': row[2],
+                        'role': row[3],
+                        'joined_at': row[4],
+                        'is_online': presence.is_online(states, row[0])
+                    })
+                
+                return respond(event, {
+                    'members': members,
+                    'has_more': has_more,
+                    'next_cursor': str(rows[-1][0]) if has_more else None
+                })
         
         elif method == 'POST':
             body = json.loads(event.get('body', '{}'))
             action = body.get('action')
+            tag(action=action)
             
             if action == 'send_message':
                 chat_id = body.get('chat_id')
                 recipient_id = body.get('recipient_id')
-                msg_type = body.get('type', 'text')
-                content = body.get('content', '')
-                file_url = body.get('file_url')
-                file_name = body.get('file_name')
                 
                 if not chat_id and not recipient_id:
                     return error_response('chat_id or recipient_id required', 400)
-                
-                if not chat_id:
-                    cur.execute(
-                        f"""
-                        SELECT c.id FROM {os.environ['MAIN_DB_SCHEMA']}.chats c
-                        INNER JOIN {os.environ['MAIN_DB_SCHEMA']}.chat_members cm1 ON c.id = cm1.chat_id
-                        INNER JOIN {os.environ['MAIN_DB_SCHEMA']}.chat_members cm2 ON c.id = cm2.chat_id
-                        WHERE c.chat_type = 'private' AND cm1.user_id = %s AND cm2.user_id = %s
-                        LIMIT 1
-                        """,
-                        (user_id, recipient_id)
-                    )
-                    existing_chat = cur.fetchone()
-                    
-                    if existing_chat:
-                        chat_id = existing_chat[0]
+                try:
+                    fields = message_fields(body)
+                    if chat_id:
+                        chat_id = positive_id(chat_id, 'chat_id')
                     else:
-                        cur.execute(
-                            f"INSERT INTO {os.environ['MAIN_DB_SCHEMA']}.chats (chat_type, created_by) VALUES ('private', %s) RETURNING id",
-                            (user_id,)
-                        )
-                        chat_id = cur.fetchone()[0]
-                        
-                        cur.execute(
-                            f"INSERT INTO {os.environ['MAIN_DB_SCHEMA']}.chat_members (chat_id, user_id) VALUES (%s, %s), (%s, %s)",
-                            (chat_id, user_id, chat_id, recipient_id)
-                        )
+                        recipient_id = positive_id(recipient_id, 'recipient_id')
+                except ValueError as e:
+                    return error_response(str(e), 400)
                 
-                cur.execute(
-                    f"""
-                    INSERT INTO {os.environ['MAIN_DB_SCHEMA']}.messages 
-                    (chat_id, sender_id, msg_type, content, file_url, file_name)
-                    VALUES (%s, %s, %s, %s, %s, %s)
-                    RETURNING id, created_at
-                    """,
-                    (chat_id, user_id, msg_type, content, file_url, file_name)
-                )
+                if chat_id:
+                    if not membership.is_member(cur, user_id, chat_id):
+                        return error_response('Not a member of this chat', 403)
+                    item = dict(fields, chat_id=chat_id)
+                    msg_id, created_at, seq = insert_messages(cur, user_id, [item])[0]
+                else:
+                    chat_id, msg_id, created_at, seq = send_private_message(cur, user_id, recipient_id, fields)
                 
-                msg_id, created_at = cur.fetchone()
                 conn.commit()
                 
                 return success_response({
                     'message_id': msg_id,
                     'chat_id': chat_id,
-                    'created_at': str(created_at)
+                    'created_at': created_at
+                })
+            
+            elif action == 'mark_read':
+                reads = body.get('reads') or [{'chat_id': body.get('chat_id'), 'message_id': body.get('message_id')}]
+                try:
+                    watermarks = read_watermarks(reads)
+                except (KeyError, TypeError):
+                    return error_response('chat_id and message_id required', 400)
+                except ValueError as e:
+                    return error_response(str(e), 400)
+                
+                updated = apply_reads(cur, user_id, watermarks)
+                conn.commit()
+                
+                return success_response({
+                    'updated': [{'chat_id': chat_id, 'unread_count': unread_count} for chat_id, unread_count in updated]
                 })
             
             elif action == 'create_group':
                 title = body.get('title', '')
-                member_ids = body.get('member_ids', [])
                 
-                if not title or not member_ids:
+                if not title or not body.get('member_ids'):
                     return error_response('title and member_ids required', 400)
+                try:
+                    title = group_title(title)
+                    member_ids = group_member_ids(body['member_ids'])
+                except ValueError as e:
+                    return error_response(str(e), 400)
                 
-                cur.execute(
-                    f"INSERT INTO {os.environ['MAIN_DB_SCHEMA']}.chats (chat_type, title, created_by) VALUES ('group', %s, %s) RETURNING id",
-                    (title, user_id)
-                )
-                chat_id = cur.fetchone()[0]
+                chat_id = create_group_chat(cur, user_id, title, member_ids)
                 
-                members = [(chat_id, user_id, 'admin')]
-                for mid in member_ids:
-                    members.append((chat_id, mid, 'member'))
+                conn.commit()
                 
-                cur.executemany(
-                    f"INSERT INTO {os.environ['MAIN_DB_SCHEMA']}.chat_members (chat_id, user_id, member_role) VALUES (%s, %s, %s)",
-                    members
-                )
+                return success_response({'chat_id': chat_id})
+            
+            elif action == 'add_members':
+                chat_id = body.get('chat_id')
+                if not chat_id or not body.get('member_ids'):
+                    return error_response('chat_id and member_ids required', 400)
+                try:
+                    chat_id = positive_id(chat_id, 'chat_id')
+                    member_ids = group_member_ids(body['member_ids'])
+                except ValueError as e:
+                    return error_response(str(e), 400)
+                
+                cur.execute(queries.GROUP_ROLE, (user_id, chat_id))
+                role = cur.fetchone()
+                if not role or role[0] != 'group':
+                    return error_response('Group not found', 404)
+                if role[1] != 'admin':
+                    return error_response('Only group admins can add members', 403)
+                
+                added = add_group_members(cur, chat_id, member_ids)
+                if added:
+                    cur.execute(queries.BUMP_CHAT, (chat_id,))
+                cur.execute(queries.COUNT_MEMBERS, (chat_id,))
+                if cur.fetchone()[0] > GROUP_MEMBERS_MAX:
+                    conn.rollback()
+                    return error_response(f'At most {GROUP_MEMBERS_MAX} members per group', 400)
                 
                 conn.commit()
                 
-                return success_response({'chat_id': chat_id})
+                return success_response({'added': added})
+            
+            elif action == 'remove_member':
+                chat_id = body.get('chat_id')
+                if not chat_id:
+                    return error_response('chat_id required', 400)
+                try:
+                    chat_id = positive_id(chat_id, 'chat_id')
+                    member_id = positive_id(body.get('user_id', user_id), 'user_id')
+                except ValueError as e:
+                    return error_response(str(e), 400)
+                
+                cur.execute(queries.GROUP_ROLE, (user_id, chat_id))
+                role = cur.fetchone()
+                if not role or role[0] != 'group':
+                    return error_response('Group not found', 404)
+                if member_id != user_id and role[1] != 'admin':
+                    return error_response('Only group admins can remove other members', 403)
+                
+                hold_seq_floor(cur)
+                cur.execute(queries.DELETE_MEMBER, (chat_id, member_id))
+                deleted = cur.fetchone()
+                promoted = None
+                if deleted:
+                    if deleted[0] == 'admin':
+                        cur.execute(queries.PROMOTE_OLDEST_MEMBER, {'chat_id': chat_id})
+                        row = cur.fetchone()
+                        promoted = row[0] if row else None
+                    cur.execute(queries.RECORD_REMOVAL, (member_id, chat_id))
+                    cur.execute(queries.BUMP_CHAT, (chat_id,))
+                    publish_events(cur, [{'type': 'members', 'chat_id': chat_id, 'removed': [member_id]}])
+                
+                conn.commit()
+                membership.cache.invalidate(chat_id, member_id)
+                
+                return success_response({'removed': deleted is not None, 'promoted': promoted})
+            
+            elif action == 'batch':
+                operations = body.get('operations')
+                if not isinstance(operations, list) or not operations:
+                    return error_response('operations required', 400)
+                if len(operations) > BATCH_MAX:
+                    return error_response(f'At most {BATCH_MAX} operations per batch', 400)
+                
+                results = [None] * len(operations)
+                sends = []
+                reads = []
+                private_chats = {}
+                
+                # Каждая операция проверяется и приводится к типам до записи: ошибка
+                # одной операции — {'ok': False, 'error': ...} в её ячейке, остальные выполняются
+                for index, op in enumerate(operations):
+                    kind = op.get('op') if isinstance(op, dict) else None
+                    try:
+                        if kind == 'send_message':
+                            fields = message_fields(op)
+                            if op.get('chat_id'):
+                                chat_id = positive_id(op['chat_id'], 'chat_id')
+                            elif op.get('recipient_id'):
+                                recipient_id = positive_id(op['recipient_id'], 'recipient_id')
+                                if recipient_id not in private_chats:
+                                    private_chats[recipient_id] = resolve_private_chat(cur, user_id, recipient_id)
+                                chat_id = private_chats[recipient_id]
+                            else:
+                                raise ValueError('chat_id or recipient_id required')
+                            sends.append((index, dict(fields, chat_id=chat_id)))
+                        elif kind == 'create_group':
+                            if not op.get('title') or not op.get('member_ids'):
+                                raise ValueError('title and member_ids required')
+                            title = group_title(op['title'])
+                            member_ids = group_member_ids(op['member_ids'])
+                            results[index] = {'ok': True, 'chat_id': create_group_chat(cur, user_id, title, member_ids)}
+                        elif kind == 'mark_read':
+                            reads.append((index, {
+                                'chat_id': positive_id(op.get('chat_id'), 'chat_id'),
+                                'message_id': positive_id(op.get('message_id'), 'message_id')
+                            }))
+                        else:
+                            raise ValueError('Unknown op')
+                    except ValueError as e:
+                        results[index] = {'ok': False, 'error': str(e)}
+                
+                if sends:
+                    member_of = membership.member_chats(cur, user_id, {item['chat_id'] for _, item in sends})
+                    for index, item in sends:
+                        if item['chat_id'] not in member_of:
+                            results[index] = {'ok': False, 'error': 'Not a member of this chat'}
+                    sends = [(index, item) for index, item in sends if item['chat_id'] in member_of]
+                
+                if sends:
+                    inserted = insert_messages(cur, user_id, [item for _, item in sends])
+                    for (index, item), (msg_id, created_at, _) in zip(sends, inserted):
+                        results[index] = {'ok': True, 'message_id': msg_id, 'chat_id': item['chat_id'], 'created_at': created_at}
+                
+                if reads:
+                    apply_reads(cur, user_id, read_watermarks([read for _, read in reads]))
+                    for index, _ in reads:
+                        results[index] = {'ok': True}
+                
+                conn.commit()
+                
+                return success_response({'results': results})
         
         return error_response('Invalid request', 400)
     
     finally:
         cur.close()
-        conn.close()
+        pool.putconn(conn)
+
+
+def message_fields(data: dict) -> dict:
+    '''
+    Поля сообщения из запроса; ValueError, если поле не того типа — иначе ошибка
+    приведения в Postgres превращается в 500. Размеры превью прижимаются к
+    1..MEDIA_DIMENSION_MAX
+    '''
+    fields = {'type': data.get('type') or 'text', 'content': data.get('content') or ''}
+    for name in ('file_url', 'file_name', 'thumb_url', 'preview'):
+        fields[name] = data.get(name)
+    for name, value in fields.items():
+        if value is not None and not isinstance(value, str):
+            raise ValueError(f'{name} must be a string')
+    for name in ('width', 'height'):
+        value = data.get(name)
+        if value is not None:
+            if isinstance(value, bool) or not isinstance(value, int):
+                raise ValueError(f'{name} must be an integer')
+            value = min(max(value, 1), MEDIA_DIMENSION_MAX)
+        fields[name] = value
+    return fields
+
+
+def positive_id(value, name: str) -> int:
+    '''
+    id из тела запроса: целое больше нуля (строка с числом тоже подходит), иначе ValueError
+    '''
+    if isinstance(value, bool) or not isinstance(value, (int, str)):
+        raise ValueError(f'{name} must be a positive integer')
+    try:
+        number = int(value)
+    except ValueError:
+        raise ValueError(f'{name} must be a positive integer')
+    if not 0 < number <= ID_MAX:
+        raise ValueError(f'{name} must be a positive integer')
+    return number
 
 
-def success_response(data: dict):
+def private_pair(user_id: int, recipient_id) -> dict:
+    recipient_id = positive_id(recipient_id, 'recipient_id')
     return {
-        'statusCode': 200,
-        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-        'body': json.dumps(data)
+        'user_id': user_id,
+        'pair_low': min(user_id, recipient_id),
+        'pair_high': max(user_id, recipient_id)
     }
 
 
-def error_response(message: str, status_code: int = 400):
+def hold_seq_floor(cur):
+    '''
+    Отмечает транзакцию как пишущую change_seq (см. queries.HOLD_SEQ_FLOOR); вызывается
+    перед каждым запросом, который берёт номер, повторный вызов добавляет ещё одну отметку
+    '''
+    cur.execute(queries.HOLD_SEQ_FLOOR)
+
+
+def safe_seq(cur) -> int:
+    '''
+    Наибольший номер change_seq, до которого все записи уже закоммичены или откачены
+    '''
+    cur.execute(queries.LAST_SEQ)
+    last = cur.fetchone()[0]
+    cur.execute(queries.SEQ_FLOORS)
+    safe = last
+    for (key,) in cur.fetchall():
+        behind = (last - key) % SEQ_LOCK_KEYS
+        # Пол, взятый уже после чтения last_value, больше last и курсор не ограничивает
+        if behind < SEQ_LOCK_KEYS // 2:
+            safe = min(safe, last - behind)
+    return safe
+
+
+def resolve_private_chat(cur, user_id: int, recipient_id) -> int:
+    hold_seq_floor(cur)
+    cur.execute(queries.RESOLVE_PRIVATE_CHAT, private_pair(user_id, recipient_id))
+    return cur.fetchone()[0]
+
+
+def send_private_message(cur, user_id: int, recipient_id, fields: dict) -> tuple:
+    '''
+    Первое сообщение и создание чата — один запрос: чат находится или создаётся
+    в CTE, и сообщение вставляется прямо в него
+    '''
+    hold_seq_floor(cur)
+    cur.execute(
+        queries.SEND_PRIVATE_MESSAGE,
+        dict(fields, **private_pair(user_id, recipient_id))
+    )
+    chat_id, msg_id, created_at, seq = cur.fetchone()
+    record_messages(cur, user_id, [dict(fields, chat_id=chat_id)], [(msg_id, created_at, seq)])
+    return chat_id, msg_id, created_at, seq
+
+
+def insert_messages(cur, user_id: int, items: list) -> list:
+    '''
+    Вставляет сообщения одним INSERT; возвращает (id, created_at, seq) в порядке items
+    '''
+    hold_seq_floor(cur)
+    rows = execute_values(
+        cur,
+        queries.INSERT_MESSAGES,
+        [
+            (item['chat_id'], user_id, item['type'], item['content'], item['file_url'], item['file_name'],
+             item['thumb_url'], item['preview'], item['width'], item['height'])
+            for item in items
+        ],
+        page_size=len(items),
+        fetch=True
+    )
+    record_messages(cur, user_id, items, rows)
+    return rows
+
+
+def record_messages(cur, user_id: int, items: list, rows: list):
+    '''
+    Обновляет сводки и счётчики непрочитанного по одной строке на чат
+    и публикует события о новых сообщениях
+    '''
+    latest = {}
+    counts = {}
+    for item, (msg_id, created_at, seq) in zip(items, rows):
+        latest[item['chat_id']] = (msg_id, item['content'], created_at, seq)
+        counts[item['chat_id']] = counts.get(item['chat_id'], 0) + 1
+    chat_ids = list(latest)
+    
+    cur.execute(
+        queries.UPSERT_SUMMARIES,
+        (chat_ids, [latest[c][0] for c in chat_ids], [latest[c][1] for c in chat_ids], [latest[c][2] for c in chat_ids])
+    )
+    
+    cur.execute(
+        queries.BUMP_MEMBERS,
+        (user_id, chat_ids, [counts[c] for c in chat_ids], [latest[c][3] for c in chat_ids])
+    )
+    
+    publish_events(cur, [
+        {
+            'type': 'message',
+            'chat_id': item['chat_id'],
+            'seq': seq,
+            'message': dict(item, id=msg_id, sender_id=user_id, created_at=created_at.isoformat())
+        }
+        for item, (msg_id, created_at, seq) in zip(items, rows)
+    ])
+
+
+def read_watermarks(reads: list) -> dict:
+    watermarks = {}
+    for read in reads:
+        chat_id = positive_id(read['chat_id'], 'chat_id')
+        message_id = positive_id(read['message_id'], 'message_id')
+        watermarks[chat_id] = max(message_id, watermarks.get(chat_id, 0))
+    return watermarks
+
+
+def apply_reads(cur, user_id: int, watermarks: dict) -> list:
+    hold_seq_floor(cur)
+    cur.execute(
+        queries.APPLY_READS,
+        (list(watermarks), list(watermarks.values()), user_id)
+    )
+    return cur.fetchall()
+
+
+def group_title(title) -> str:
+    '''
+    Название группы: непустая строка не длиннее колонки chats.title, иначе ValueError
+    '''
+    if not isinstance(title, str) or not title.strip():
+        raise ValueError('title must be a non-empty string')
+    if len(title) > GROUP_TITLE_MAX:
+        raise ValueError(f'title must be at most {GROUP_TITLE_MAX} characters')
+    return title
+
+
+def group_member_ids(member_ids) -> list:
+    '''
+    Уникальные id участников; ValueError, если это не список id (см. positive_id) или их
+    больше, чем помещается в группу
+    '''
+    if not isinstance(member_ids, list):
+        raise ValueError('member_ids must be a list of user ids')
+    ids = list({positive_id(mid, 'member_ids item') for mid in member_ids})
+    if len(ids) >= GROUP_MEMBERS_MAX:
+        raise ValueError(f'At most {GROUP_MEMBERS_MAX} members per group')
+    return ids
+
+
+def create_group_chat(cur, user_id: int, title: str, member_ids: list) -> int:
+    cur.execute(queries.INSERT_GROUP, (title, user_id))
+    chat_id = cur.fetchone()[0]
+    add_group_members(cur, chat_id, [user_id, *member_ids], admin_id=user_id)
+    return chat_id
+
+
+def add_group_members(cur, chat_id: int, user_ids: list, admin_id: int = None) -> list:
+    '''
+    Добавляет участников одним запросом; возвращает id тех, кого действительно добавили
+    '''
+    hold_seq_floor(cur)
+    cur.execute(queries.INSERT_GROUP_MEMBERS, {'chat_id': chat_id, 'user_ids': user_ids, 'admin_id': admin_id})
+    added = [row[0] for row in cur.fetchall()]
+    if added:
+        publish_events(cur, [{'type': 'members', 'chat_id': chat_id}])
+    return added
+
+
+def publish_events(cur, events: list):
+    '''
+    События уходят в сервис доставки (services/realtime) при коммите транзакции;
+    слишком длинное сообщение отправляется без тела, клиент догрузит его через sync
+    '''
+    payloads = []
+    for event in events:
+        payload = json.dumps(event)
+        if len(payload.encode()) > NOTIFY_PAYLOAD_MAX:
+            payload = json.dumps({key: value for key, value in event.items() if key != 'message'})
+        payloads.append(payload)
+    cur.execute(queries.PUBLISH_EVENTS, (EVENTS_CHANNEL, payloads))
+
+
+def normalize_phone(phone: str, partial: bool = False) -> str:
+    '''
+    Цифры номера, ведущая 8 российского номера заменяется на 7, как в users.phone_digits;
+    partial — начало номера в местном формате (8900...) приводится так же, если нет «+»
+    '''
+    digits = ''.join(ch for ch in phone if ch.isdigit())
+    local = partial and len(digits) < 11 and not phone.lstrip().startswith('+')
+    if digits.startswith('8') and (len(digits) == 11 or local):
+        digits = '7' + digits[1:]
+    return digits
+
+
+def escape_like(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+
+def chats_with_presence(rows: list) -> list:
+    '''
+    Собеседник в личном чате помечается онлайн по одному пакетному запросу к сервису присутствия
+    '''
+    states = presence.lookup(row[8] for row in rows)
+    chats = []
+    for row in rows:
+        chat = chat_to_dict(row)
+        if row[8] is not None:
+            chat['peer_id'] = row[8]
+            chat['is_online'] = presence.is_online(states, row[8])
+            chat['last_seen'] = row[9]
+        chats.append(chat)
+    return chats
+
+
+def chat_to_dict(row: tuple) -> dict:
+    chat_id, chat_type, title, avatar_url, last_message, last_message_time, unread_count = row[:7]
     return {
-        'statusCode': status_code,
-        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-        'body': json.dumps({'error': message})
+        'id': chat_id,
+        'type': chat_type,
+        'title': title,
+        'avatar_url': avatar_url,
+        'last_message': last_message,
+        'last_message_time': last_message_time,
+        'unread_count': unread_count
     }
+
+
+def encode_cursor(created_at: datetime, msg_id: int) -> str:
+    raw = f'{created_at.isoformat()}|{msg_id}'.encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(cursor: str) -> tuple:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode()
+        created_at, msg_id = raw.rsplit('|', 1)
+        created_at = datetime.fromisoformat(created_at)
+        # created_at хранится без пояса; курсор с поясом не сравнить ни с архивом, ни с границей архива
+        if created_at.tzinfo is not None:
+            raise ValueError('cursor timestamp must be naive')
+        return created_at, int(msg_id)
+    except (ValueError, UnicodeDecodeError) as e:
+        raise ValueError(f'Invalid cursor: {cursor}') from e
@@ -0,0 +1,73 @@
+'''
+Кэш членства «пользователь состоит в чате» для get_messages и send_message.
+Кэшируются только положительные ответы: только что добавленный участник не ждёт
+истечения TTL, а исключённый теряет доступ на других экземплярах функции не позже
+чем через MEMBERSHIP_CACHE_TTL секунд (на этом экземпляре — сразу)
+'''
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import queries
+
+MEMBERSHIP_CACHE_TTL = float(os.environ.get('MEMBERSHIP_CACHE_TTL', '30'))
+MEMBERSHIP_CACHE_SIZE = int(os.environ.get('MEMBERSHIP_CACHE_SIZE', '100000'))
+
+
+class MembershipCache:
+    def __init__(self, ttl: float = MEMBERSHIP_CACHE_TTL, max_size: int = MEMBERSHIP_CACHE_SIZE):
+        self.ttl = ttl
+        self.max_size = max_size
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats = {'hits': 0, 'misses': 0}
+
+    def contains(self, user_id: int, chat_id: int) -> bool:
+        key = (user_id, chat_id)
+        with self._lock:
+            expires = self._items.get(key)
+            if expires is None or expires <= time.monotonic():
+                if expires is not None:
+                    del self._items[key]
+                self.stats['misses'] += 1
+                return False
+            self._items.move_to_end(key)
+            self.stats['hits'] += 1
+            return True
+
+    def add(self, user_id: int, chat_ids):
+        expires = time.monotonic() + self.ttl
+        with self._lock:
+            for chat_id in chat_ids:
+                self._items[(user_id, chat_id)] = expires
+                self._items.move_to_end((user_id, chat_id))
+            while len(self._items) > self.max_size:
+                self._items.popitem(last=False)
+
+    def invalidate(self, chat_id: int, user_id: int):
+        with self._lock:
+            self._items.pop((user_id, chat_id), None)
+
+
+cache = MembershipCache()
+
+
+def member_chats(cur, user_id: int, chat_ids) -> set:
+    '''
+    Подмножество chat_ids, в которых состоит пользователь; в базу идут
+    только чаты, которых нет в кэше, одним запросом
+    '''
+    chat_ids = set(chat_ids)
+    known = {chat_id for chat_id in chat_ids if cache.contains(user_id, chat_id)}
+    missing = chat_ids - known
+    if missing:
+        cur.execute(queries.MEMBER_CHATS, (user_id, list(missing)))
+        found = {row[0] for row in cur.fetchall()}
+        cache.add(user_id, found)
+        known |= found
+    return known
+
+
+def is_member(cur, user_id: int, chat_id: int) -> bool:
+    return chat_id in member_chats(cur, user_id, [chat_id])
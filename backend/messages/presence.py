@@ -0,0 +1,33 @@
+'''
+Клиент присутствия: статусы пачкой одним запросом к services/realtime
+(GET /presence?ids=...). Без PRESENCE_URL или при ошибке все считаются
+не в сети — колонку users.is_online больше не читаем
+'''
+import json
+import os
+import urllib.request
+
+PRESENCE_URL = os.environ.get('PRESENCE_URL', '')
+PRESENCE_TIMEOUT = float(os.environ.get('PRESENCE_TIMEOUT', '0.3'))
+
+
+def lookup(user_ids) -> dict:
+    ids = sorted({int(user_id) for user_id in user_ids if user_id is not None})
+    if not ids or not PRESENCE_URL:
+        return {}
+
+    request = urllib.request.Request(
+        f"{PRESENCE_URL.rstrip('/')}/presence?ids={','.join(map(str, ids))}",
+        headers={'X-Presence-Secret': os.environ.get('PRESENCE_SECRET', '')}
+    )
+    try:
+        with urllib.request.urlopen(request, timeout=PRESENCE_TIMEOUT) as response:
+            states = json.loads(response.read())
+    except (OSError, ValueError) as e:
+        print(f'Presence lookup failed: {str(e)}')
+        return {}
+    return {int(user_id): state for user_id, state in states.items()}
+
+
+def is_online(states: dict, user_id) -> bool:
+    return bool(states.get(user_id, {}).get('online'))
@@ -0,0 +1,352 @@
+'''
+Тексты SQL функции messages: схема подставляется один раз при импорте модуля,
+а не f-строкой на каждом запросе; варианты запросов (направление страницы,
+вид поиска) собраны заранее
+'''
+import os
+
+SCHEMA = os.environ['MAIN_DB_SCHEMA']
+SEARCH_CONFIG = 'russian'
+
+_CHAT_LIST = f"""
+    SELECT c.id, c.chat_type,
+           CASE WHEN pu.id IS NOT NULL THEN pu.full_name ELSE c.title END as title,
+           CASE WHEN pu.id IS NOT NULL THEN pu.avatar_url ELSE c.avatar_url END as avatar_url,
+           s.last_message_text, s.last_message_time, cm.unread_count, cm.changed_seq,
+           pu.id, pu.last_seen
+    FROM {SCHEMA}.chat_members cm
+    INNER JOIN {SCHEMA}.chats c ON c.id = cm.chat_id
+    LEFT JOIN {SCHEMA}.chat_summaries s ON s.chat_id = c.id
+    LEFT JOIN {SCHEMA}.chat_members pm
+           ON c.chat_type = 'private' AND pm.chat_id = c.id AND pm.user_id != cm.user_id
+    LEFT JOIN {SCHEMA}.users pu ON pu.id = pm.user_id
+"""
+
+GET_CHATS = _CHAT_LIST + """
+    WHERE cm.user_id = %s
+    ORDER BY s.last_message_time DESC NULLS LAST
+"""
+
+SYNC_CHATS = _CHAT_LIST + """
+    WHERE cm.user_id = %s AND cm.changed_seq > %s AND cm.changed_seq <= %s
+    ORDER BY cm.changed_seq ASC
+    LIMIT %s
+"""
+
+# Чаты, из которых пользователя исключили; если его уже вернули, чат придёт в SYNC_CHATS
+SYNC_REMOVALS = f"""
+    SELECT r.chat_id FROM {SCHEMA}.chat_removals r
+    WHERE r.user_id = %s AND r.seq > %s AND r.seq <= %s
+      AND NOT EXISTS (
+          SELECT 1 FROM {SCHEMA}.chat_members cm WHERE cm.chat_id = r.chat_id AND cm.user_id = r.user_id
+      )
+"""
+
+# Сообщения берутся по всем чатам пользователя, а не только попавшим на страницу
+# SYNC_CHATS: чат, который не вошёл в страницу из-за более позднего changed_seq,
+# может иметь сообщение с номером до курсора, и следующий sync его уже не увидит
+SYNC_MESSAGES = f"""
+    SELECT m.id, m.sender_id, m.msg_type, m.content, m.file_url,
+           m.file_name, m.created_at, u.full_name, u.avatar_url, m.chat_id, m.seq,
+           m.thumb_url, m.preview, m.media_width, m.media_height
+    FROM {SCHEMA}.messages m
+    INNER JOIN {SCHEMA}.users u ON m.sender_id = u.id
+    WHERE m.chat_id IN (SELECT chat_id FROM {SCHEMA}.chat_members WHERE user_id = %s)
+      AND m.seq > %s AND m.seq <= %s
+    ORDER BY m.seq ASC
+    LIMIT %s
+"""
+
+
+def _messages_page(page_filter: str, order: str) -> str:
+    return f"""
+        SELECT m.id, m.sender_id, m.msg_type, m.content, m.file_url,
+               m.file_name, m.created_at, u.full_name, u.avatar_url,
+               m.thumb_url, m.preview, m.media_width, m.media_height
+        FROM {SCHEMA}.messages m
+        INNER JOIN {SCHEMA}.users u ON m.sender_id = u.id
+        WHERE m.chat_id = %s {page_filter}
+        ORDER BY m.created_at {order}, m.id {order}
+        LIMIT %s
+    """
+
+
+# Ключ — направление курсора: after листает вперёд, before и первая страница — назад
+MESSAGES_PAGE = {
+    'after': _messages_page("AND m.created_at >= %s AND (m.created_at > %s OR m.id > %s)", 'ASC'),
+    'before': _messages_page("AND m.created_at <= %s AND (m.created_at < %s OR m.id < %s)", 'DESC'),
+    None: _messages_page('', 'DESC')
+}
+
+SEEN_BY = f"""
+    SELECT m.id, COUNT(cm.user_id)
+    FROM unnest(%s::int[]) AS m(id)
+    LEFT JOIN {SCHEMA}.chat_members cm
+        ON cm.chat_id = %s AND cm.last_read_message_id >= m.id AND cm.user_id != %s
+    GROUP BY m.id
+"""
+
+
+def _phone_tier(rank: int, match: str, key: str) -> str:
+    return f"""
+        (SELECT id, phone, full_name, avatar_url, status, {rank} AS rank, {key} AS sort_key
+         FROM {SCHEMA}.users
+         WHERE {match} AND id != %(user_id)s
+           AND (%(after_rank)s < {rank}
+                OR (%(after_rank)s = {rank} AND ({key}, id) > (%(after_key)s, %(after_id)s)))
+         ORDER BY {key}, id
+         LIMIT %(limit)s)
+    """
+
+
+_PHONE_KEY = 'phone_digits COLLATE "C"'
+_PHONE_REV_KEY = 'phone_digits_rev COLLATE "C"'
+
+# Ранги точное > префикс > суффикс — отдельные ветки, и каждая читает индекс
+# (ключ COLLATE "C", id) по порядку с keyset внутри ранга: страница берёт не больше
+# limit строк на ранг, а не сортирует все совпадения короткого префикса
+SEARCH_USERS = {
+    'phone': f"""
+        SELECT * FROM (
+            {_phone_tier(0, f"{_PHONE_KEY} = %(term)s", _PHONE_KEY)}
+            UNION ALL
+            {_phone_tier(1, f"{_PHONE_KEY} LIKE %(prefix)s AND {_PHONE_KEY} <> %(term)s", _PHONE_KEY)}
+            UNION ALL
+            {_phone_tier(2, f"{_PHONE_REV_KEY} LIKE %(suffix)s AND {_PHONE_KEY} NOT LIKE %(prefix)s", _PHONE_REV_KEY)}
+        ) tiers
+        ORDER BY rank, sort_key, id
+        LIMIT %(limit)s
+    """,
+    # Подстроку имени находит только GIN-индекс по триграммам, а он не отдаёт
+    # строки по порядку, поэтому здесь совпадения ранжируются и сортируются целиком
+    'name': f"""
+        SELECT id, phone, full_name, avatar_url, status, rank, '' AS sort_key
+        FROM (
+            SELECT id, phone, full_name, avatar_url, status,
+                   CASE WHEN lower(full_name) = %(term)s THEN 0
+                        WHEN lower(full_name) LIKE %(prefix)s THEN 1 ELSE 2 END AS rank
+            FROM {SCHEMA}.users
+            WHERE lower(full_name) LIKE %(contains)s AND id != %(user_id)s
+        ) matches
+        WHERE (rank, id) > (%(after_rank)s, %(after_id)s)
+        ORDER BY rank, id
+        LIMIT %(limit)s
+    """
+}
+
+# Конфигурация russian стеммит и кириллицу, и латиницу (asciiword -> english_stem),
+# а составной GIN (chat_id, search_vector) ограничивает поиск чатами пользователя
+SEARCH_MESSAGES = f"""
+    WITH q AS (
+        SELECT websearch_to_tsquery('{SEARCH_CONFIG}', %(q)s) AS query
+    ),
+    page AS (
+        SELECT * FROM (
+            SELECT m.id, m.chat_id, m.sender_id, m.msg_type, m.content, m.created_at,
+                   ts_rank_cd(m.search_vector, q.query) AS rank
+            FROM {SCHEMA}.messages m, q
+            WHERE m.search_vector @@ q.query
+              AND m.chat_id = ANY(ARRAY(
+                  SELECT chat_id FROM {SCHEMA}.chat_members WHERE user_id = %(user_id)s
+              ))
+              AND (%(chat_id)s::int IS NULL OR m.chat_id = %(chat_id)s::int)
+        ) matches
+        WHERE %(after_id)s::int IS NULL OR (rank, id) < (%(after_rank)s::real, %(after_id)s::int)
+        ORDER BY rank DESC, id DESC
+        LIMIT %(limit)s
+    )
+    SELECT page.id, page.chat_id, page.sender_id, u.full_name, page.msg_type, page.created_at,
+           ts_headline('{SEARCH_CONFIG}', page.content, q.query, %(headline)s), page.rank
+    FROM page
+    CROSS JOIN q
+    LEFT JOIN {SCHEMA}.users u ON u.id = page.sender_id
+    ORDER BY page.rank DESC, page.id DESC
+"""
+
+ARCHIVE_KEYS = {
+    'after': f"SELECT object_key FROM {SCHEMA}.message_archives WHERE chat_id = %s AND last_at >= %s ORDER BY last_at",
+    'before': f"SELECT object_key FROM {SCHEMA}.message_archives WHERE chat_id = %s AND first_at <= %s ORDER BY last_at DESC",
+    None: f"SELECT object_key FROM {SCHEMA}.message_archives WHERE chat_id = %s ORDER BY last_at DESC"
+}
+
+ARCHIVE_SENDERS = f"SELECT id, full_name, avatar_url FROM {SCHEMA}.users WHERE id = ANY(%s)"
+
+MEMBER_CHATS = f"SELECT chat_id FROM {SCHEMA}.chat_members WHERE user_id = %s AND chat_id = ANY(%s)"
+
+# Личный чат ищется по канонической паре (меньший id, больший id) одной пробой
+# в уникальном индексе; если его нет, он создаётся вместе с участниками, а гонка
+# двух первых сообщений решается ON CONFLICT — оба получат один и тот же чат
+_PRIVATE_CHAT_CTE = f"""
+    existing AS (
+        SELECT id FROM {SCHEMA}.chats
+        WHERE pair_low = %(pair_low)s AND pair_high = %(pair_high)s
+    ),
+    created AS (
+        INSERT INTO {SCHEMA}.chats (chat_type, created_by, pair_low, pair_high)
+        SELECT 'private', %(user_id)s, %(pair_low)s, %(pair_high)s
+        WHERE NOT EXISTS (SELECT 1 FROM existing)
+        ON CONFLICT (pair_low, pair_high) DO UPDATE SET pair_high = EXCLUDED.pair_high
+        RETURNING id, xmax = 0 AS inserted
+    ),
+    members AS (
+        INSERT INTO {SCHEMA}.chat_members (chat_id, user_id)
+        SELECT created.id, pair.user_id
+        FROM created, (SELECT DISTINCT unnest(ARRAY[%(pair_low)s, %(pair_high)s]::int[]) AS user_id) pair
+        WHERE created.inserted
+    ),
+    chat AS (
+        SELECT id FROM existing
+        UNION ALL
+        SELECT id FROM created
+    )
+"""
+
+RESOLVE_PRIVATE_CHAT = f"WITH {_PRIVATE_CHAT_CTE} SELECT id FROM chat"
+
+SEND_PRIVATE_MESSAGE = f"""
+    WITH {_PRIVATE_CHAT_CTE}
+    INSERT INTO {SCHEMA}.messages
+    (chat_id, sender_id, msg_type, content, file_url, file_name,
+     thumb_url, preview, media_width, media_height)
+    SELECT chat.id, %(user_id)s, %(type)s, %(content)s, %(file_url)s, %(file_name)s,
+           %(thumb_url)s, %(preview)s, %(width)s, %(height)s
+    FROM chat
+    RETURNING chat_id, id, created_at, seq
+"""
+
+INSERT_MESSAGES = f"""
+    INSERT INTO {SCHEMA}.messages
+    (chat_id, sender_id, msg_type, content, file_url, file_name,
+     thumb_url, preview, media_width, media_height)
+    VALUES %s
+    RETURNING id, created_at, seq
+"""
+
+UPSERT_SUMMARIES = f"""
+    INSERT INTO {SCHEMA}.chat_summaries
+    (chat_id, last_message_id, last_message_text, last_message_time)
+    SELECT * FROM unnest(%s::int[], %s::int[], %s::text[], %s::timestamp[])
+    ON CONFLICT (chat_id) DO UPDATE SET
+        last_message_id = EXCLUDED.last_message_id,
+        last_message_text = EXCLUDED.last_message_text,
+        last_message_time = EXCLUDED.last_message_time
+    WHERE chat_summaries.last_message_time IS NULL
+       OR chat_summaries.last_message_time <= EXCLUDED.last_message_time
+"""
+
+# Номера change_seq выдаются nextval при записи, а видны читателям при коммите:
+# транзакция с номером N может закоммититься после той, что взяла N+1, и sync,
+# вернувший курсор N+1, пропустил бы N навсегда. Поэтому пишущая транзакция до первой
+# записи берёт номер-«пол» и держит до коммита advisory-блокировку с ним (своя у каждой
+# транзакции, никто её не ждёт); все номера транзакции больше пола. sync читает сначала
+# последний выданный номер, потом полы незакоммиченных транзакций, и курсор не уходит
+# дальше меньшего из них. Ключ — младшие 31 бит номера, полный номер восстанавливается
+# по последнему выданному
+CHANGES_LOCK_SPACE = 7004
+HOLD_SEQ_FLOOR = f"""
+    SELECT pg_advisory_xact_lock({CHANGES_LOCK_SPACE}, (nextval('{SCHEMA}.change_seq') % 2147483648)::int)
+"""
+
+LAST_SEQ = f"SELECT last_value FROM {SCHEMA}.change_seq"
+
+SEQ_FLOORS = f"""
+    SELECT objid::bigint FROM pg_locks
+    WHERE locktype = 'advisory' AND classid = {CHANGES_LOCK_SPACE} AND objsubid = 2
+      AND database = (SELECT oid FROM pg_database WHERE datname = current_database())
+"""
+
+BUMP_MEMBERS = f"""
+    UPDATE {SCHEMA}.chat_members cm
+    SET unread_count = cm.unread_count + CASE WHEN cm.user_id != %s THEN v.n ELSE 0 END,
+        changed_seq = GREATEST(cm.changed_seq, v.seq)
+    FROM unnest(%s::int[], %s::int[], %s::bigint[]) AS v(chat_id, n, seq)
+    WHERE cm.chat_id = v.chat_id
+"""
+
+# Отметка прочтения прижимается к последнему сообщению чата: иначе message_id
+# из будущего сдвинул бы отметку дальше всех следующих сообщений, и счётчик
+# непрочитанного в чате навсегда остался бы нулём. Если живых сообщений не
+# осталось (всё в архиве), граница берётся из chat_summaries
+APPLY_READS = f"""
+    UPDATE {SCHEMA}.chat_members cm
+    SET last_read_message_id = r.message_id,
+        unread_count = (
+            SELECT COUNT(*) FROM {SCHEMA}.messages m
+            WHERE m.chat_id = cm.chat_id AND m.id > r.message_id AND m.sender_id != cm.user_id
+        ),
+        changed_seq = nextval('{SCHEMA}.change_seq')
+    FROM (
+        SELECT v.chat_id, LEAST(v.message_id, COALESCE(
+            (SELECT MAX(m.id) FROM {SCHEMA}.messages m WHERE m.chat_id = v.chat_id),
+            (SELECT s.last_message_id FROM {SCHEMA}.chat_summaries s WHERE s.chat_id = v.chat_id),
+            0
+        )) AS message_id
+        FROM unnest(%s::int[], %s::int[]) AS v(chat_id, message_id)
+    ) r
+    WHERE cm.chat_id = r.chat_id AND cm.user_id = %s AND cm.last_read_message_id < r.message_id
+    RETURNING cm.chat_id, cm.unread_count
+"""
+
+INSERT_GROUP = f"INSERT INTO {SCHEMA}.chats (chat_type, title, created_by) VALUES ('group', %s, %s) RETURNING id"
+
+# Участники добавляются одним INSERT ... SELECT: несуществующие id отсекает
+# соединение с users, повторы и уже состоящих — уникальный (chat_id, user_id)
+INSERT_GROUP_MEMBERS = f"""
+    INSERT INTO {SCHEMA}.chat_members (chat_id, user_id, member_role)
+    SELECT %(chat_id)s, u.id, CASE WHEN u.id = %(admin_id)s THEN 'admin' ELSE 'member' END
+    FROM {SCHEMA}.users u
+    WHERE u.id = ANY(%(user_ids)s::int[])
+    ON CONFLICT (chat_id, user_id) DO NOTHING
+    RETURNING user_id
+"""
+
+# Строка чата блокируется до конца транзакции: изменения состава одной группы
+# идут по очереди, поэтому проверки лимита участников и последнего админа не гонятся
+GROUP_ROLE = f"""
+    SELECT c.chat_type, cm.member_role
+    FROM {SCHEMA}.chats c
+    LEFT JOIN {SCHEMA}.chat_members cm ON cm.chat_id = c.id AND cm.user_id = %s
+    WHERE c.id = %s
+    FOR UPDATE OF c
+"""
+
+COUNT_MEMBERS = f"SELECT COUNT(*) FROM {SCHEMA}.chat_members WHERE chat_id = %s"
+
+DELETE_MEMBER = f"DELETE FROM {SCHEMA}.chat_members WHERE chat_id = %s AND user_id = %s RETURNING member_role"
+
+RECORD_REMOVAL = f"""
+    INSERT INTO {SCHEMA}.chat_removals (user_id, chat_id) VALUES (%s, %s)
+    ON CONFLICT (user_id, chat_id) DO UPDATE SET
+        seq = nextval('{SCHEMA}.change_seq'),
+        removed_at = CURRENT_TIMESTAMP
+"""
+
+# Состав группы изменился: чат попадает в sync каждого оставшегося участника
+BUMP_CHAT = f"UPDATE {SCHEMA}.chat_members SET changed_seq = nextval('{SCHEMA}.change_seq') WHERE chat_id = %s"
+
+# Группа не остаётся без админа: если ушёл последний, админом становится самый давний участник
+PROMOTE_OLDEST_MEMBER = f"""
+    UPDATE {SCHEMA}.chat_members SET member_role = 'admin'
+    WHERE chat_id = %(chat_id)s
+      AND user_id = (
+          SELECT user_id FROM {SCHEMA}.chat_members
+          WHERE chat_id = %(chat_id)s
+          ORDER BY joined_at, user_id
+          LIMIT 1
+      )
+      AND NOT EXISTS (
+          SELECT 1 FROM {SCHEMA}.chat_members WHERE chat_id = %(chat_id)s AND member_role = 'admin'
+      )
+    RETURNING user_id
+"""
+
+LIST_MEMBERS = f"""
+    SELECT cm.user_id, u.full_name, u.avatar_url, cm.member_role, cm.joined_at
+    FROM {SCHEMA}.chat_members cm
+    INNER JOIN {SCHEMA}.users u ON u.id = cm.user_id
+    WHERE cm.chat_id = %s AND cm.user_id > %s
+    ORDER BY cm.user_id
+    LIMIT %s
+"""
+
+PUBLISH_EVENTS = "SELECT pg_notify(%s, payload) FROM unnest(%s::text[]) AS payload"
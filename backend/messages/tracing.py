@@ -0,0 +1,197 @@
+'''
+Трассировка вызовов функции: спаны внутри запроса, время и число строк каждого SQL,
+одна JSON-строка в лог на вызов, медленные запросы с нормализованным текстом,
+признак холодного старта и накопленные по процессу агрегаты по action
+'''
+import contextvars
+import functools
+import json
+import os
+import re
+import threading
+import time
+from contextlib import contextmanager
+
+import psycopg2.extensions
+
+TRACING_ENABLED = os.environ.get('TRACING_ENABLED', '1') != '0'
+SLOW_QUERY_MS = float(os.environ.get('TRACING_SLOW_QUERY_MS', '100'))
+SLOW_QUERIES_MAX = 5
+AGGREGATE_EVERY = int(os.environ.get('TRACING_AGGREGATE_EVERY', '100'))
+
+_current = contextvars.ContextVar('trace', default=None)
+_cold = True
+_aggregates = {}
+_aggregates_lock = threading.Lock()
+_invocations = 0
+
+_SQL_STRINGS = re.compile(r"'(?:[^']|'')*'")
+_SQL_NUMBERS = re.compile(r'\b\d+(?:\.\d+)?\b')
+_SQL_LISTS = re.compile(r'([(\[])\s*\?(?:\s*,\s*\?)+\s*([)\]])')
+_SQL_TUPLES = re.compile(r'(\([^()]*\))(?:\s*,\s*\([^()]*\))+')
+_SQL_SPACES = re.compile(r'\s+')
+
+
+class Trace:
+    def __init__(self, function: str, action: str = None):
+        self.function = function
+        self.fields = {'action': action}
+        self.started = time.perf_counter()
+        self.spans = {}
+        self.queries = 0
+        self.rows = 0
+        self.db_ms = 0.0
+        self.slow = []
+
+    def add_span(self, name: str, ms: float):
+        self.spans[name] = self.spans.get(name, 0.0) + ms
+
+    def add_query(self, sql, ms: float, rows: int):
+        self.queries += 1
+        self.db_ms += ms
+        self.rows += max(rows, 0)
+        if ms >= SLOW_QUERY_MS:
+            self.slow.append({'sql': normalize_sql(sql), 'ms': round(ms, 2), 'rows': rows})
+            self.slow = sorted(self.slow, key=lambda item: -item['ms'])[:SLOW_QUERIES_MAX]
+
+
+class TracingCursor(psycopg2.extensions.cursor):
+    '''
+    Курсор, который сообщает текущей трассировке время и число строк каждого запроса;
+    подключается через cursor_factory в db.py, так что код функций не меняется
+    '''
+
+    def execute(self, query, vars=None):
+        trace = _current.get()
+        if trace is None:
+            return super().execute(query, vars)
+        start = time.perf_counter()
+        try:
+            return super().execute(query, vars)
+        finally:
+            trace.add_query(query, (time.perf_counter() - start) * 1000, self.rowcount)
+
+    def executemany(self, query, vars_list):
+        trace = _current.get()
+        if trace is None:
+            return super().executemany(query, vars_list)
+        start = time.perf_counter()
+        try:
+            return super().executemany(query, vars_list)
+        finally:
+            trace.add_query(query, (time.perf_counter() - start) * 1000, self.rowcount)
+
+
+def normalize_sql(sql) -> str:
+    '''
+    Текст без значений: литералы и числа заменены на ?, списки и строки VALUES свёрнуты,
+    чтобы одинаковые запросы группировались в логах
+    '''
+    if isinstance(sql, bytes):
+        sql = sql.decode(errors='replace')
+    sql = _SQL_STRINGS.sub('?', sql)
+    sql = _SQL_NUMBERS.sub('?', sql)
+    sql = _SQL_LISTS.sub(r'\1?\2', sql)
+    sql = _SQL_TUPLES.sub(r'\1, ...', sql)
+    return _SQL_SPACES.sub(' ', sql).strip()
+
+
+@contextmanager
+def span(name: str):
+    trace = _current.get()
+    if trace is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        trace.add_span(name, (time.perf_counter() - start) * 1000)
+
+
+def tag(**fields):
+    '''
+    Дополнительные поля для лог-строки текущего вызова, например action
+    '''
+    trace = _current.get()
+    if trace is not None:
+        trace.fields.update(fields)
+
+
+def traced(function: str):
+    '''
+    Декоратор handler: открывает трассировку на время вызова и пишет итог в лог
+    '''
+    def decorate(handler):
+        @functools.wraps(handler)
+        def wrapper(event: dict, context) -> dict:
+            if not TRACING_ENABLED:
+                return handler(event, context)
+            global _cold
+            cold, _cold = _cold, False
+            trace = Trace(function, (event.get('queryStringParameters') or {}).get('action'))
+            token = _current.set(trace)
+            status = 500
+            try:
+                response = handler(event, context)
+                status = response.get('statusCode', 200)
+                return response
+            finally:
+                _current.reset(token)
+                finish(trace, event.get('httpMethod', 'GET'), status, cold)
+        return wrapper
+    return decorate
+
+
+def finish(trace: Trace, method: str, status: int, cold: bool):
+    global _invocations
+    duration = (time.perf_counter() - trace.started) * 1000
+    record = {
+        'type': 'invocation',
+        'function': trace.function,
+        'method': method,
+        **trace.fields,
+        'status': status,
+        'duration_ms': round(duration, 2),
+        'db_ms': round(trace.db_ms, 2),
+        'queries': trace.queries,
+        'rows': trace.rows,
+        'spans': {name: round(ms, 2) for name, ms in trace.spans.items()},
+        'cold_start': cold
+    }
+    if trace.slow:
+        record['slow_queries'] = trace.slow
+    print(json.dumps(record, ensure_ascii=False, default=str))
+
+    key = f"{method} {trace.fields.get('action') or '-'}"
+    with _aggregates_lock:
+        item = _aggregates.setdefault(key, {'count': 0, 'errors': 0, 'total_ms': 0.0, 'max_ms': 0.0, 'db_ms': 0.0, 'queries': 0})
+        item['count'] += 1
+        item['errors'] += status >= 500
+        item['total_ms'] += duration
+        item['max_ms'] = max(item['max_ms'], duration)
+        item['db_ms'] += trace.db_ms
+        item['queries'] += trace.queries
+        _invocations += 1
+        flush = AGGREGATE_EVERY > 0 and _invocations % AGGREGATE_EVERY == 0
+    if flush:
+        print(json.dumps({'type': 'aggregate', 'function': trace.function, 'actions': aggregates()}))
+
+
+def aggregates() -> dict:
+    '''
+    Сводка по action за время жизни процесса: число вызовов, ошибки, среднее и
+    максимальное время, доля БД и запросов на вызов
+    '''
+    with _aggregates_lock:
+        return {
+            key: {
+                'count': item['count'],
+                'errors': item['errors'],
+                'avg_ms': round(item['total_ms'] / item['count'], 2),
+                'max_ms': round(item['max_ms'], 2),
+                'avg_db_ms': round(item['db_ms'] / item['count'], 2),
+                'avg_queries': round(item['queries'] / item['count'], 2)
+            }
+            for key, item in _aggregates.items()
+        }
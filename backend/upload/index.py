@@ -1,13 +1,41 @@
 import json
 import os
-import boto3
 import base64
+import hashlib
+import math
+from collections import OrderedDict
 from datetime import datetime
 import uuid
+from concurrent.futures import TimeoutError as FutureTimeoutError
 
+from previews import MAX_SOURCE_BYTES, is_previewable, submit_preview, thumb_format
+from responses import error_response, success_response
+from session import AuthError, authenticate
+from tracing import tag, traced
+
+S3_ENDPOINT_URL = os.environ.get('S3_ENDPOINT_URL', 'https://bucket.poehali.dev')
+BUCKET = 'files'
+PART_SIZE = 8 * 1024 * 1024
+MAX_PARTS = 10000
+# Верхняя граница файла для multipart: загрузка больше отклоняется при создании,
+# а собранный объект больше неё удаляется (размер частей клиент может подменить)
+MAX_FILE_SIZE = int(os.environ.get('UPLOAD_MAX_FILE_SIZE', str(2 * 1024 * 1024 * 1024)))
+MAX_FILE_PARTS = math.ceil(MAX_FILE_SIZE / PART_SIZE)
+PRESIGN_EXPIRES = 3600
+S3_POOL_SIZE = 10
+KNOWN_KEYS_MAX = 10000
+SHARED_PREFIX = 'messenger/sha256/'
+PREVIEW_WAIT = 5.0
+MISSING_CODES = ('404', 'NoSuchKey', 'NotFound', 'NoSuchUpload')
+
+_s3 = None
+_known_keys = OrderedDict()
+
+@traced('upload')
 def handler(event: dict, context) -> dict:
     '''
-    API для загрузки файлов, изображений и голосовых сообщений в S3
+    API для загрузки файлов, изображений и голосовых сообщений в S3:
+    base64 в JSON для мелких файлов, presigned URL и multipart-загрузка для крупных
     '''
     method = event.get('httpMethod', 'GET')
     
@@ -25,11 +53,19 @@ def handler(event: dict, context) -> dict:
     if method != 'POST':
         return error_response('Method not allowed', 405)
     
-    token = event.get('headers', {}).get('X-Authorization', '')
-    if not token:
-        return error_response('Authorization required', 401)
+    token = event.get('headers', {}).get('X-Authorization', '').replace('Bearer ', '')
+    try:
+        user = authenticate(token)
+    except AuthError as e:
+        return error_response(e.message, e.status_code)
     
     body = json.loads(event.get('body', '{}'))
+    action = body.get('action')
+    tag(action=action)
+    
+    if action:
+        return handle_presigned(action, body, user['id'])
+    
     file_data = body.get('file_data', '')
     file_name = body.get('file_name', f'file_{uuid.uuid4()}')
     file_type = body.get('file_type', 'application/octet-stream')
@@ -42,47 +78,343 @@ def handler(event: dict, context) -> dict:
     except:
         return error_response('Invalid base64 data', 400)
     
-    s3 = boto3.client(
-        's3',
-        endpoint_url='https://bucket.poehali.dev',
-        aws_access_key_id=os.environ['AWS_ACCESS_KEY_ID'],
-        aws_secret_access_key=os.environ['AWS_SECRET_ACCESS_KEY']
-    )
-    
-    timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-    key = f'messenger/{timestamp}_{file_name}'
+    s3 = s3_client()
+    key = content_key(hashlib.sha256(file_bytes).hexdigest(), file_name)
     
     try:
-        s3.put_object(
-            Bucket='files',
-            Key=key,
-            Body=file_bytes,
-            ContentType=file_type
-        )
+        deduplicated = object_exists(s3, key)
+        previewable = is_previewable(file_type)
+        preview = existing_preview(s3, key) if deduplicated and previewable else None
+        preview_job = submit_preview(file_bytes) if preview is None and previewable else None
         
-        cdn_url = f"https://cdn.poehali.dev/projects/{os.environ['AWS_ACCESS_KEY_ID']}/bucket/{key}"
+        if not deduplicated:
+            s3.put_object(
+                Bucket=BUCKET,
+                Key=key,
+                Body=file_bytes,
+                ContentType=file_type
+            )
+            remember_key(key)
+        
+        if preview_job is not None:
+            preview = store_preview(s3, key, preview_job)
         
         return success_response({
-            'file_url': cdn_url,
+            'file_url': cdn_url(key),
             'file_name': file_name,
-            'file_size': len(file_bytes)
+            'file_size': len(file_bytes),
+            'deduplicated': deduplicated,
+            **(preview or {})
         })
     
     except Exception as e:
         return error_response(f'Upload failed: {str(e)}', 500)
 
 
-def success_response(data: dict):
+def handle_presigned(action: str, body: dict, user_id: int) -> dict:
+    '''
+    Файл идёт от клиента прямо в S3 по подписанным ссылкам, функция только
+    выдаёт ссылки и собирает части — содержимое файла через неё не проходит.
+    Ключи загрузок лежат под префиксом пользователя, и действия над уже
+    начатой загрузкой принимают только ключи вызывающего
+    '''
+    s3 = s3_client()
+    
+    if action in ('presign_parts', 'list_parts', 'complete_multipart', 'abort_multipart'):
+        if not str(body.get('key') or '').startswith(user_prefix(user_id)):
+            return error_response('Upload not found', 404)
+    
+    try:
+        if action == 'presign':
+            file_name = body.get('file_name', f'file_{uuid.uuid4()}')
+            file_type = body.get('file_type') or 'application/octet-stream'
+            sha256 = body.get('sha256', '').lower()
+            params = {'Bucket': BUCKET, 'ContentType': file_type}
+            
+            if sha256:
+                digest = bytes.fromhex(sha256)
+                if len(digest) != 32:
+                    return error_response('sha256 must be a hex SHA-256 digest', 400)
+                key = content_key(sha256, file_name)
+                if object_exists(s3, key):
+                    return success_response({
+                        'exists': True,
+                        'key': key,
+                        'file_url': cdn_url(key),
+                        'file_name': file_name
+                    })
+                params['ChecksumSHA256'] = base64.b64encode(digest).decode()
+            else:
+                key = object_key(user_id, file_name)
+            
+            params['Key'] = key
+            upload_url = s3.generate_presigned_url('put_object', Params=params, ExpiresIn=PRESIGN_EXPIRES)
+            
+            return success_response({
+                'exists': False,
+                'upload_url': upload_url,
+                'checksum_sha256': params.get('ChecksumSHA256'),
+                'key': key,
+                'file_url': cdn_url(key),
+                'file_name': file_name
+            })
+        
+        elif action == 'create_multipart':
+            file_name = body.get('file_name', f'file_{uuid.uuid4()}')
+            file_type = body.get('file_type') or 'application/octet-stream'
+            try:
+                file_size = int(body.get('file_size', 0))
+            except (TypeError, ValueError):
+                return error_response('file_size must be an integer', 400)
+            if file_size <= 0:
+                return error_response('file_size required', 400)
+            if file_size > MAX_FILE_SIZE:
+                return error_response(f'File is larger than {MAX_FILE_SIZE} bytes', 400)
+            
+            part_size = max(PART_SIZE, math.ceil(file_size / MAX_PARTS))
+            part_count = math.ceil(file_size / part_size)
+            key = object_key(user_id, file_name)
+            
+            upload = s3.create_multipart_upload(Bucket=BUCKET, Key=key, ContentType=file_type)
+            
+            return success_response({
+                'upload_id': upload['UploadId'],
+                'key': key,
+                'part_size': part_size,
+                'parts': presign_parts(s3, key, upload['UploadId'], range(1, part_count + 1))
+            })
+        
+        elif action == 'presign_parts':
+            key = body.get('key')
+            upload_id = body.get('upload_id')
+            part_numbers = body.get('part_numbers', [])
+            if not key or not upload_id or not part_numbers:
+                return error_response('key, upload_id and part_numbers required', 400)
+            if not valid_part_numbers(part_numbers):
+                return error_response(f'part_numbers must be integers from 1 to {MAX_FILE_PARTS}', 400)
+            
+            return success_response({'parts': presign_parts(s3, key, upload_id, part_numbers)})
+        
+        elif action == 'list_parts':
+            key = body.get('key')
+            upload_id = body.get('upload_id')
+            if not key or not upload_id:
+                return error_response('key and upload_id required', 400)
+            
+            parts = []
+            paginator = s3.get_paginator('list_parts')
+            for page in paginator.paginate(Bucket=BUCKET, Key=key, UploadId=upload_id):
+                for part in page.get('Parts', []):
+                    parts.append({'part_number': part['PartNumber'], 'etag': part['ETag'], 'size': part['Size']})
+            
+            return success_response({'parts': parts})
+        
+        elif action == 'complete_multipart':
+            key = body.get('key')
+            upload_id = body.get('upload_id')
+            parts = body.get('parts', [])
+            file_name = body.get('file_name', key.rsplit('/', 1)[-1] if key else '')
+            if not key or not upload_id or not parts:
+                return error_response('key, upload_id and parts required', 400)
+            
+            s3.complete_multipart_upload(
+                Bucket=BUCKET,
+                Key=key,
+                UploadId=upload_id,
+                MultipartUpload={'Parts': sorted(
+                    [{'PartNumber': int(p['part_number']), 'ETag': p['etag']} for p in parts],
+                    key=lambda p: p['PartNumber']
+                )}
+            )
+            head = s3.head_object(Bucket=BUCKET, Key=key)
+            if head['ContentLength'] > MAX_FILE_SIZE:
+                s3.delete_object(Bucket=BUCKET, Key=key)
+                return error_response(f'File is larger than {MAX_FILE_SIZE} bytes', 400)
+            
+            return success_response({
+                'file_url': cdn_url(key),
+                'file_name': file_name,
+                'file_size': head['ContentLength']
+            })
+        
+        elif action == 'preview':
+            key = str(body.get('key') or '')
+            if not key:
+                return error_response('key required', 400)
+            # Превью строится для своих файлов и для файлов по содержимому (sha256):
+            # такой ключ знает только тот, у кого есть сам файл
+            if not key.startswith((user_prefix(user_id), SHARED_PREFIX)):
+                return error_response('File not found', 404)
+            
+            preview = existing_preview(s3, key)
+            if preview:
+                return success_response(preview)
+            
+            head = s3.head_object(Bucket=BUCKET, Key=key)
+            if not is_previewable(head.get('ContentType')) or head['ContentLength'] > MAX_SOURCE_BYTES:
+                return error_response('Preview is not available for this file', 400)
+            
+            data = s3.get_object(Bucket=BUCKET, Key=key)['Body'].read()
+            preview_job = submit_preview(data)
+            if preview_job is None:
+                return error_response('Preview queue is full, retry later', 503)
+            
+            preview = store_preview(s3, key, preview_job)
+            if preview is None:
+                return error_response('Preview failed', 500)
+            return success_response(preview)
+        
+        elif action == 'abort_multipart':
+            key = body.get('key')
+            upload_id = body.get('upload_id')
+            if not key or not upload_id:
+                return error_response('key and upload_id required', 400)
+            
+            s3.abort_multipart_upload(Bucket=BUCKET, Key=key, UploadId=upload_id)
+            return success_response({'aborted': True})
+        
+        return error_response('Invalid action', 400)
+    
+    except (KeyError, ValueError, TypeError) as e:
+        return error_response(f'Invalid request: {str(e)}', 400)
+    except Exception as e:
+        if is_missing(e):
+            return error_response('File or upload not found', 404)
+        return error_response(f'Upload failed: {str(e)}', 500)
+
+
+def is_missing(error: Exception) -> bool:
+    '''
+    ClientError от S3 об отсутствующем объекте или загрузке
+    '''
+    response = getattr(error, 'response', None) or {}
+    return response.get('Error', {}).get('Code') in MISSING_CODES
+
+
+def valid_part_numbers(part_numbers) -> bool:
+    if not isinstance(part_numbers, list) or len(part_numbers) > MAX_FILE_PARTS:
+        return False
+    return all(
+        isinstance(number, int) and not isinstance(number, bool) and 1 <= number <= MAX_FILE_PARTS
+        for number in part_numbers
+    )
+
+
+def presign_parts(s3, key: str, upload_id: str, part_numbers) -> list:
+    return [
+        {
+            'part_number': int(number),
+            'url': s3.generate_presigned_url(
+                'upload_part',
+                Params={'Bucket': BUCKET, 'Key': key, 'UploadId': upload_id, 'PartNumber': int(number)},
+                ExpiresIn=PRESIGN_EXPIRES
+            )
+        }
+        for number in part_numbers
+    ]
+
+
+def s3_client():
+    global _s3
+    if _s3 is None:
+        # boto3 импортируется при первом обращении к S3: OPTIONS и отказы
+        # авторизации обходятся без него, а холодный старт не платит за его загрузку
+        import boto3
+        from botocore.config import Config
+        _s3 = boto3.client(
+            's3',
+            endpoint_url=S3_ENDPOINT_URL,
+            aws_access_key_id=os.environ['AWS_ACCESS_KEY_ID'],
+            aws_secret_access_key=os.environ['AWS_SECRET_ACCESS_KEY'],
+            config=Config(
+                max_pool_connections=S3_POOL_SIZE,
+                tcp_keepalive=True,
+                retries={'max_attempts': 3, 'mode': 'standard'}
+            )
+        )
+    return _s3
+
+
+def thumb_key(key: str) -> str:
+    return f'{key}.thumb.{thumb_format()[2]}'
+
+
+def existing_preview(s3, key: str):
+    from botocore.exceptions import ClientError
+    try:
+        head = s3.head_object(Bucket=BUCKET, Key=thumb_key(key))
+    except ClientError:
+        return None
+    meta = head.get('Metadata', {})
+    if 'width' not in meta:
+        return None
     return {
-        'statusCode': 200,
-        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-        'body': json.dumps(data)
+        'thumb_url': cdn_url(thumb_key(key)),
+        'preview': meta.get('lqip'),
+        'width': int(meta['width']),
+        'height': int(meta['height'])
     }
 
 
-def error_response(message: str, status_code: int = 400):
+def store_preview(s3, key: str, preview_job):
+    try:
+        result = preview_job.result(timeout=PREVIEW_WAIT)
+    except FutureTimeoutError:
+        return None
+    except Exception as e:
+        print(f'Preview failed for {key}: {str(e)}')
+        return None
+    
+    s3.put_object(
+        Bucket=BUCKET,
+        Key=thumb_key(key),
+        Body=result['thumb_bytes'],
+        ContentType=result['thumb_type'],
+        Metadata={'width': str(result['width']), 'height': str(result['height']), 'lqip': result['lqip']}
+    )
     return {
-        'statusCode': status_code,
-        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-        'body': json.dumps({'error': message})
+        'thumb_url': cdn_url(thumb_key(key)),
+        'preview': result['lqip'],
+        'width': result['width'],
+        'height': result['height']
     }
+
+
+def content_key(sha256: str, file_name: str) -> str:
+    ext = os.path.splitext(file_name)[1].lower()[:16]
+    return f'{SHARED_PREFIX}{sha256[:2]}/{sha256}{ext}'
+
+
+def object_exists(s3, key: str) -> bool:
+    if key in _known_keys:
+        _known_keys.move_to_end(key)
+        return True
+    from botocore.exceptions import ClientError
+    try:
+        s3.head_object(Bucket=BUCKET, Key=key)
+    except ClientError as e:
+        if is_missing(e):
+            return False
+        raise
+    remember_key(key)
+    return True
+
+
+def remember_key(key: str):
+    _known_keys[key] = True
+    _known_keys.move_to_end(key)
+    while len(_known_keys) > KNOWN_KEYS_MAX:
+        _known_keys.popitem(last=False)
+
+
+def user_prefix(user_id: int) -> str:
+    return f'messenger/users/{user_id}/'
+
+
+def object_key(user_id: int, file_name: str) -> str:
+    timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+    return f'{user_prefix(user_id)}{timestamp}_{file_name}'
+
+
+def cdn_url(key: str) -> str:
+    return f"https://cdn.poehali.dev/projects/{os.environ['AWS_ACCESS_KEY_ID']}/bucket/{key}"
@@ -0,0 +1,91 @@
+'''
+Превью изображений: уменьшенная копия WebP (или JPEG, если Pillow собран без WebP),
+крошечная размытая заглушка LQIP в data URI и размеры оригинала
+'''
+import base64
+import functools
+import io
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+THUMB_SIZE = 320
+LQIP_SIZE = 16
+PREVIEW_WORKERS = 2
+PREVIEW_QUEUE = 4
+MAX_SOURCE_BYTES = 25 * 1024 * 1024
+MAX_PIXELS = 50_000_000
+EXIF_ORIENTATION = 0x0112
+
+_executor = ThreadPoolExecutor(max_workers=PREVIEW_WORKERS, thread_name_prefix='preview')
+_slots = threading.BoundedSemaphore(PREVIEW_WORKERS + PREVIEW_QUEUE)
+
+
+@functools.lru_cache(maxsize=None)
+def pillow() -> tuple:
+    '''
+    Pillow импортируется при первой картинке, а не на холодном старте функции
+    '''
+    from PIL import Image, ImageOps, features
+    Image.MAX_IMAGE_PIXELS = MAX_PIXELS
+    return Image, ImageOps, features
+
+
+@functools.lru_cache(maxsize=None)
+def thumb_format() -> tuple:
+    '''
+    (формат Pillow, MIME-тип, расширение) превью
+    '''
+    features = pillow()[2]
+    return ('WEBP', 'image/webp', 'webp') if features.check('webp') else ('JPEG', 'image/jpeg', 'jpg')
+
+
+def is_previewable(content_type: str) -> bool:
+    return (content_type or '').startswith('image/') and content_type != 'image/svg+xml'
+
+
+def make_preview(data: bytes) -> dict:
+    Image, ImageOps, _ = pillow()
+    thumb_format_name, thumb_type, thumb_ext = thumb_format()
+    with Image.open(io.BytesIO(data)) as image:
+        width, height = image.size
+        if image.getexif().get(EXIF_ORIENTATION) in (5, 6, 7, 8):
+            width, height = height, width
+        image.draft('RGB', (THUMB_SIZE, THUMB_SIZE))
+        image = ImageOps.exif_transpose(image)
+        if image.mode not in ('RGB', 'RGBA'):
+            image = image.convert('RGBA' if 'transparency' in image.info else 'RGB')
+        if thumb_format_name == 'JPEG' and image.mode == 'RGBA':
+            image = image.convert('RGB')
+
+        image.thumbnail((THUMB_SIZE, THUMB_SIZE), Image.LANCZOS)
+        thumb = io.BytesIO()
+        image.save(thumb, thumb_format_name, quality=75)
+
+        image.thumbnail((LQIP_SIZE, LQIP_SIZE), Image.BILINEAR)
+        lqip = io.BytesIO()
+        image.save(lqip, thumb_format_name, quality=30)
+
+    return {
+        'width': width,
+        'height': height,
+        'thumb_bytes': thumb.getvalue(),
+        'thumb_type': thumb_type,
+        'thumb_ext': thumb_ext,
+        'lqip': f'data:{thumb_type};base64,{base64.b64encode(lqip.getvalue()).decode()}'
+    }
+
+
+def submit_preview(data: bytes):
+    '''
+    Ставит картинку в ограниченный пул; при заполненной очереди возвращает None,
+    и превью строится позже по запросу action=preview
+    '''
+    if len(data) > MAX_SOURCE_BYTES or not _slots.acquire(blocking=False):
+        return None
+    try:
+        future = _executor.submit(make_preview, data)
+    except BaseException:
+        _slots.release()
+        raise
+    future.add_done_callback(lambda _: _slots.release())
+    return future
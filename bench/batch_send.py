@@ -0,0 +1,63 @@
+'''
+1000 сообщений по одному запросу send_message против одного запроса batch
+
+    BENCH_DATABASE_URL=postgresql://postgres@localhost/bench python bench/batch_send.py --count 1000
+'''
+import argparse
+import json
+
+import psycopg2
+
+from common import bench_dsn, configure_env, invoke, load_function, make_session, report, reset_database, timed
+
+
+def seed(conn, chats: int) -> list:
+    cur = conn.cursor()
+    cur.execute("INSERT INTO users (phone, full_name) VALUES ('+70000000001', 'A'), ('+70000000002', 'B')")
+    chat_ids = []
+    for _ in range(chats):
+        cur.execute("INSERT INTO chats (chat_type, created_by) VALUES ('group', 1) RETURNING id")
+        chat_id = cur.fetchone()[0]
+        cur.execute("INSERT INTO chat_members (chat_id, user_id) VALUES (%s, 1), (%s, 2)", (chat_id, chat_id))
+        chat_ids.append(chat_id)
+    conn.commit()
+    cur.close()
+    return chat_ids
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--count', type=int, default=1000)
+    parser.add_argument('--chats', type=int, default=10)
+    parser.add_argument('--iterations', type=int, default=5)
+    args = parser.parse_args()
+
+    dsn = bench_dsn()
+    configure_env(dsn)
+    conn = psycopg2.connect(dsn)
+    reset_database(conn)
+    chat_ids = seed(conn, args.chats)
+    token = make_session(conn, 1)
+    conn.close()
+
+    messages = load_function('messages')
+    sends = [
+        {'op': 'send_message', 'chat_id': chat_ids[i % len(chat_ids)], 'content': f'message {i}'}
+        for i in range(args.count)
+    ]
+
+    def one_by_one():
+        for op in sends:
+            invoke(messages, 'POST', body=dict(op, action='send_message'), token=token)
+
+    def batched():
+        response = invoke(messages, 'POST', body={'action': 'batch', 'operations': sends}, token=token)
+        results = json.loads(response['body'])['results']
+        assert all('message_id' in result for result in results), results[:3]
+
+    report(f'send_message x{args.count}', timed(one_by_one, args.iterations))
+    report(f'batch of {args.count}', timed(batched, args.iterations))
+
+
+if __name__ == '__main__':
+    main()
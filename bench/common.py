@@ -0,0 +1,155 @@
+'''
+Общие помощники для локальных бенчмарков облачных функций
+'''
+import base64
+import glob
+import gzip
+import importlib.util
+import json
+import os
+import statistics
+import sys
+import time
+from datetime import datetime, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BACKEND = os.path.join(ROOT, 'backend')
+MIGRATIONS = os.path.join(ROOT, 'db_migrations')
+
+
+def bench_dsn() -> str:
+    dsn = os.environ.get('BENCH_DATABASE_URL') or os.environ.get('DATABASE_URL')
+    if not dsn:
+        sys.exit('Set BENCH_DATABASE_URL to a disposable local Postgres, e.g. postgresql://postgres@localhost/bench')
+    return dsn
+
+
+def configure_env(dsn: str):
+    os.environ['DATABASE_URL'] = dsn
+    os.environ.setdefault('MAIN_DB_SCHEMA', 'public')
+    os.environ.setdefault('JWT_SECRET', 'bench-secret')
+    os.environ.setdefault('TRACING_ENABLED', '0')
+
+
+def reset_database(conn, until: str = None):
+    '''
+    Пересоздаёт схему и применяет миграции по порядку (до версии until включительно,
+    например 'V0012'); база должна быть одноразовой
+    '''
+    schema = os.environ.get('MAIN_DB_SCHEMA', 'public')
+    cur = conn.cursor()
+    cur.execute(f'DROP SCHEMA IF EXISTS {schema} CASCADE')
+    cur.execute(f'CREATE SCHEMA {schema}')
+    cur.execute(f'SET search_path TO {schema}')
+    for path in sorted(glob.glob(os.path.join(MIGRATIONS, 'V*.sql'))):
+        if until and os.path.basename(path).split('__')[0] > until:
+            break
+        with open(path) as f:
+            cur.execute(f.read())
+    conn.commit()
+    cur.close()
+
+
+def make_token(user_id: int) -> str:
+    import jwt
+    payload = {'user_id': user_id, 'exp': datetime.utcnow() + timedelta(days=1)}
+    return jwt.encode(payload, os.environ['JWT_SECRET'], algorithm='HS256')
+
+
+def make_session(conn, user_id: int) -> str:
+    '''
+    Токен с записью в sessions — функции проверяют сессию, а не только подпись
+    '''
+    token = make_token(user_id)
+    cur = conn.cursor()
+    cur.execute(
+        "INSERT INTO sessions (user_id, token, expires_at) VALUES (%s, %s, NOW() + INTERVAL '1 day')",
+        (user_id, token)
+    )
+    conn.commit()
+    cur.close()
+    return token
+
+
+def invoke(module, method: str = 'GET', params: dict = None, body: dict = None, token: str = None,
+           headers: dict = None, source_ip: str = '127.0.0.1') -> dict:
+    event = {
+        'httpMethod': method,
+        'headers': dict(headers or {}),
+        'queryStringParameters': params or {},
+        'requestContext': {'identity': {'sourceIp': source_ip}}
+    }
+    if token:
+        event['headers']['X-Authorization'] = f'Bearer {token}'
+    if body is not None:
+        event['body'] = json.dumps(body)
+    response = module.handler(event, None)
+    if response['statusCode'] >= 400:
+        raise RuntimeError(f"{method} {params or body}: {response['statusCode']} {response['body']}")
+    return response
+
+
+def response_json(response: dict):
+    '''
+    Тело ответа как JSON с учётом base64 и Content-Encoding (gzip/br из responses.py)
+    '''
+    body = response['body']
+    if not response.get('isBase64Encoded'):
+        return json.loads(body)
+    raw = base64.b64decode(body)
+    encoding = response['headers'].get('Content-Encoding')
+    if encoding == 'gzip':
+        raw = gzip.decompress(raw)
+    elif encoding == 'br':
+        import brotli
+        raw = brotli.decompress(raw)
+    return json.loads(raw)
+
+
+def load_function(name: str):
+    '''
+    Импортирует backend/<name>/index.py вместе с соседними модулями так,
+    чтобы одноимённые модули разных функций (db, index...) не пересекались
+    '''
+    func_dir = os.path.join(BACKEND, name)
+    siblings = [f[:-3] for f in os.listdir(func_dir) if f.endswith('.py')]
+    saved = {mod: sys.modules.pop(mod) for mod in siblings if mod in sys.modules}
+    sys.path.insert(0, func_dir)
+    try:
+        spec = importlib.util.spec_from_file_location(f'{name}_index', os.path.join(func_dir, 'index.py'))
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        return module
+    finally:
+        sys.path.remove(func_dir)
+        for mod in siblings:
+            sys.modules.pop(mod, None)
+        sys.modules.update(saved)
+
+
+def timed(fn, iterations: int) -> list:
+    samples = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - start) * 1000)
+    return samples
+
+
+def percentile(samples: list, pct: float) -> float:
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+def report(name: str, samples: list, **extra):
+    line = (
+        f'{name:<32} n={len(samples):<6} '
+        f'mean={statistics.fmean(samples):8.3f}ms '
+        f'p50={percentile(samples, 50):8.3f}ms '
+        f'p95={percentile(samples, 95):8.3f}ms '
+        f'p99={percentile(samples, 99):8.3f}ms'
+    )
+    for key, value in extra.items():
+        line += f' {key}={value}'
+    print(line)
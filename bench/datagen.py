@@ -0,0 +1,177 @@
+'''
+Синтетические данные для нагрузочных прогонов: пользователи, личные чаты по кругу,
+группы и история сообщений. Всё генерируется на стороне Postgres через generate_series
+и вставляется пачками чатов, так что миллионы сообщений заливаются за минуты
+
+    BENCH_DATABASE_URL=postgresql://postgres@localhost/bench python bench/datagen.py --users 10000 --messages 100
+'''
+import argparse
+import time
+from datetime import datetime, timedelta
+
+import psycopg2
+from psycopg2.extras import execute_values
+
+from common import bench_dsn, configure_env, make_token, reset_database
+
+PHRASES = [
+    'Привет! Как дела с отчётом?',
+    'Созвонимся завтра в десять, обсудим договор',
+    'Отправил счёт на оплату, проверь пожалуйста',
+    'Встреча переносится на пятницу',
+    'Can you review the pull request before lunch?',
+    'Клиент подтвердил заказ, готовим поставку',
+    'Фото с объекта во вложении',
+    'Ок, спасибо!'
+]
+CHATS_PER_BATCH = 2000
+
+
+def generate(conn, users: int, chats_per_user: int, messages_per_chat: int, groups: int = 0, group_size: int = 0):
+    '''
+    Каждый пользователь состоит примерно в chats_per_user личных чатах с соседями
+    по кругу и, если заданы groups, в группах из group_size подряд идущих пользователей
+    '''
+    neighbours = chats_per_user // 2
+    if neighbours * 2 >= users:
+        raise ValueError('chats_per_user must be less than users')
+    cur = conn.cursor()
+    started = time.perf_counter()
+
+    cur.execute(
+        "INSERT INTO users (phone, full_name) SELECT '+7' || lpad(g::text, 10, '0'), 'User ' || g FROM generate_series(1, %s) g",
+        (users,)
+    )
+    cur.execute(
+        """
+        INSERT INTO chats (chat_type, created_by, pair_low, pair_high)
+        SELECT 'private', u, LEAST(u, p), GREATEST(u, p)
+        FROM (
+            SELECT u, (u - 1 + d) %% %(users)s + 1 AS p
+            FROM generate_series(1, %(users)s) u, generate_series(1, %(neighbours)s) d
+        ) pairs
+        ON CONFLICT (pair_low, pair_high) DO NOTHING
+        """,
+        {'users': users, 'neighbours': neighbours}
+    )
+    cur.execute(
+        """
+        INSERT INTO chat_members (chat_id, user_id, member_role)
+        SELECT id, pair_low, 'member' FROM chats WHERE chat_type = 'private'
+        UNION ALL
+        SELECT id, pair_high, 'member' FROM chats WHERE chat_type = 'private'
+        """
+    )
+    if groups and group_size:
+        cur.execute(
+            """
+            INSERT INTO chats (chat_type, title, created_by)
+            SELECT 'group', 'Group ' || g, (g * 7919) %% %s + 1 FROM generate_series(1, %s) g
+            """,
+            (users, groups)
+        )
+        cur.execute(
+            """
+            INSERT INTO chat_members (chat_id, user_id, member_role)
+            SELECT c.id, (c.created_by - 1 + j) %% %s + 1, CASE WHEN j = 0 THEN 'admin' ELSE 'member' END
+            FROM chats c, generate_series(0, %s - 1) j
+            WHERE c.chat_type = 'group'
+            """,
+            (users, min(group_size, users))
+        )
+    conn.commit()
+
+    cur.execute('SELECT MIN(id), MAX(id) FROM chats')
+    first_chat, last_chat = cur.fetchone()
+    for low in range(first_chat, last_chat + 1, CHATS_PER_BATCH):
+        cur.execute(
+            """
+            INSERT INTO messages (chat_id, sender_id, msg_type, content, created_at)
+            SELECT c.id,
+                   CASE WHEN c.chat_type = 'private'
+                        THEN CASE WHEN m %% 2 = 0 THEN c.pair_low ELSE c.pair_high END
+                        ELSE (c.created_by - 1 + m %% %(group_size)s) %% %(users)s + 1 END,
+                   'text',
+                   (%(phrases)s::text[])[1 + (m * 31 + c.id) %% %(phrase_count)s] || ' #' || m,
+                   NOW() - make_interval(mins => (%(messages)s - m) * 7, secs => c.id %% 60)
+            FROM chats c, generate_series(1, %(messages)s) m
+            WHERE c.id BETWEEN %(low)s AND %(high)s
+            """,
+            {
+                'group_size': max(group_size, 1),
+                'users': users,
+                'phrases': PHRASES,
+                'phrase_count': len(PHRASES),
+                'messages': messages_per_chat,
+                'low': low,
+                'high': low + CHATS_PER_BATCH - 1
+            }
+        )
+        conn.commit()
+        print(f'  messages for chats {low}..{min(low + CHATS_PER_BATCH - 1, last_chat)} / {last_chat}')
+
+    cur.execute(
+        """
+        INSERT INTO chat_summaries (chat_id, last_message_id, last_message_text, last_message_time)
+        SELECT DISTINCT ON (chat_id) chat_id, id, content, created_at
+        FROM messages
+        ORDER BY chat_id, created_at DESC, id DESC
+        ON CONFLICT (chat_id) DO NOTHING
+        """
+    )
+    cur.execute(
+        """
+        UPDATE chat_members cm
+        SET last_read_message_id = last.id, changed_seq = last.seq, unread_count = 0
+        FROM (SELECT chat_id, MAX(id) AS id, MAX(seq) AS seq FROM messages GROUP BY chat_id) last
+        WHERE last.chat_id = cm.chat_id
+        """
+    )
+    conn.commit()
+    conn.autocommit = True
+    cur.execute('VACUUM ANALYZE')
+    conn.autocommit = False
+
+    cur.execute('SELECT (SELECT COUNT(*) FROM users), (SELECT COUNT(*) FROM chats), (SELECT COUNT(*) FROM messages)')
+    counts = cur.fetchone()
+    cur.close()
+    print(f'generated {counts[0]} users, {counts[1]} chats, {counts[2]} messages in {time.perf_counter() - started:.1f}s')
+
+
+def create_sessions(conn, user_ids) -> dict:
+    '''
+    По одной сессии на пользователя одной вставкой; возвращает {user_id: token}
+    '''
+    tokens = {user_id: make_token(user_id) for user_id in user_ids}
+    expires_at = datetime.now() + timedelta(days=1)
+    cur = conn.cursor()
+    execute_values(
+        cur,
+        'INSERT INTO sessions (user_id, token, expires_at) VALUES %s',
+        [(user_id, token, expires_at) for user_id, token in tokens.items()],
+        page_size=1000
+    )
+    conn.commit()
+    cur.close()
+    return tokens
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--users', type=int, default=10000)
+    parser.add_argument('--chats', type=int, default=20, help='личных чатов на пользователя')
+    parser.add_argument('--messages', type=int, default=100, help='сообщений в чате')
+    parser.add_argument('--groups', type=int, default=20)
+    parser.add_argument('--group-size', type=int, default=200)
+    args = parser.parse_args()
+
+    dsn = bench_dsn()
+    configure_env(dsn)
+    conn = psycopg2.connect(dsn)
+    reset_database(conn)
+    generate(conn, args.users, args.chats, args.messages, args.groups, args.group_size)
+    conn.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,78 @@
+'''
+Сравнение соединения на каждый запрос с пулом из backend/*/db.py
+
+    BENCH_DATABASE_URL=postgresql://postgres@localhost/bench python bench/db_pool.py
+'''
+import argparse
+import os
+import sys
+import threading
+
+import psycopg2
+
+from common import BACKEND, bench_dsn, report, timed
+
+sys.path.insert(0, os.path.join(BACKEND, 'messages'))
+from db import ConnectionPool  # noqa: E402
+
+
+def per_request(dsn: str):
+    conn = psycopg2.connect(dsn)
+    cur = conn.cursor()
+    try:
+        cur.execute('SELECT 1')
+        cur.fetchone()
+    finally:
+        cur.close()
+        conn.close()
+
+
+def pooled(pool: ConnectionPool):
+    conn = pool.getconn()
+    cur = conn.cursor()
+    try:
+        cur.execute('SELECT 1')
+        cur.fetchone()
+    finally:
+        cur.close()
+        pool.putconn(conn)
+
+
+def concurrent(fn, threads: int, iterations: int) -> list:
+    samples = []
+    lock = threading.Lock()
+
+    def worker():
+        local = timed(fn, iterations)
+        with lock:
+            samples.extend(local)
+
+    workers = [threading.Thread(target=worker) for _ in range(threads)]
+    for w in workers:
+        w.start()
+    for w in workers:
+        w.join()
+    return samples
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--iterations', type=int, default=500)
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--pool-size', type=int, default=4)
+    args = parser.parse_args()
+
+    dsn = bench_dsn()
+    pool = ConnectionPool(dsn, max_size=args.pool_size)
+
+    report('connect per request', timed(lambda: per_request(dsn), args.iterations))
+    report('pooled', timed(lambda: pooled(pool), args.iterations), **pool.stats())
+
+    per_thread = max(1, args.iterations // args.threads)
+    report(f'connect per request x{args.threads}', concurrent(lambda: per_request(dsn), args.threads, per_thread))
+    report(f'pooled x{args.threads}', concurrent(lambda: pooled(pool), args.threads, per_thread), **pool.stats())
+    pool.closeall()
+
+
+if __name__ == '__main__':
+    main()
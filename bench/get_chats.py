@@ -0,0 +1,120 @@
+'''
+Список чатов для пользователей с большим числом чатов: старые коррелированные
+подзапросы + N+1 против одного запроса по chat_summaries
+
+    BENCH_DATABASE_URL=postgresql://postgres@localhost/bench python bench/get_chats.py --chats 1000
+'''
+import argparse
+import os
+
+import psycopg2
+
+from common import MIGRATIONS, bench_dsn, configure_env, invoke, load_function, make_session, report, reset_database, timed
+
+LEGACY_CHATS_SQL = """
+SELECT DISTINCT c.id, c.chat_type, c.title, c.avatar_url,
+       (SELECT content FROM messages WHERE chat_id = c.id ORDER BY created_at DESC LIMIT 1) as last_message,
+       (SELECT created_at FROM messages WHERE chat_id = c.id ORDER BY created_at DESC LIMIT 1) as last_message_time,
+       (SELECT COUNT(*) FROM messages m
+        WHERE m.chat_id = c.id AND m.sender_id != %s
+        AND NOT EXISTS (SELECT 1 FROM message_reads mr WHERE mr.message_id = m.id AND mr.user_id = %s)) as unread_count
+FROM chats c
+INNER JOIN chat_members cm ON c.id = cm.chat_id
+WHERE cm.user_id = %s
+ORDER BY last_message_time DESC NULLS LAST
+"""
+
+LEGACY_PEER_SQL = """
+SELECT u.id, u.full_name, u.avatar_url, u.is_online
+FROM users u
+INNER JOIN chat_members cm ON u.id = cm.user_id
+WHERE cm.chat_id = %s AND u.id != %s
+"""
+
+
+def seed(conn, users: int, chats: int, messages: int):
+    total_chats = users * chats
+    cur = conn.cursor()
+    cur.execute(
+        "INSERT INTO users (phone, full_name) SELECT '+7' || lpad(g::text, 10, '0'), 'User ' || g FROM generate_series(1, %s) g",
+        (users + total_chats,)
+    )
+    cur.execute(
+        "INSERT INTO chats (chat_type, created_by) SELECT 'private', (g - 1) / %s + 1 FROM generate_series(1, %s) g",
+        (chats, total_chats)
+    )
+    cur.execute(
+        """
+        INSERT INTO chat_members (chat_id, user_id, member_role)
+        SELECT g, (g - 1) / %s + 1, 'member' FROM generate_series(1, %s) g
+        UNION ALL
+        SELECT g, %s + g, 'member' FROM generate_series(1, %s) g
+        """,
+        (chats, total_chats, users, total_chats)
+    )
+    cur.execute(
+        """
+        INSERT INTO messages (chat_id, sender_id, msg_type, content, created_at)
+        SELECT g, CASE WHEN m %% 2 = 0 THEN (g - 1) / %s + 1 ELSE %s + g END, 'text', 'message ' || m,
+               NOW() - make_interval(mins => m, secs => g)
+        FROM generate_series(1, %s) g, generate_series(1, %s) m
+        """,
+        (chats, users, total_chats, messages)
+    )
+    with open(os.path.join(MIGRATIONS, 'V0006__create_chat_summaries.sql')) as f:
+        cur.execute(f.read())
+    cur.execute(
+        """
+        UPDATE chat_members cm SET unread_count = sub.cnt
+        FROM (SELECT chat_id, sender_id, COUNT(*) as cnt FROM messages GROUP BY chat_id, sender_id) sub
+        WHERE sub.chat_id = cm.chat_id AND sub.sender_id != cm.user_id
+        """
+    )
+    cur.execute('CREATE TABLE IF NOT EXISTS message_reads (message_id INTEGER, user_id INTEGER)')
+    cur.execute('ANALYZE')
+    conn.commit()
+    cur.close()
+
+
+def legacy_get_chats(conn, user_id: int):
+    cur = conn.cursor()
+    cur.execute(LEGACY_CHATS_SQL, (user_id, user_id, user_id))
+    for row in cur.fetchall():
+        if row[1] == 'private':
+            cur.execute(LEGACY_PEER_SQL, (row[0], user_id))
+            cur.fetchone()
+    conn.rollback()
+    cur.close()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--users', type=int, default=5)
+    parser.add_argument('--chats', type=int, default=1000)
+    parser.add_argument('--messages', type=int, default=20)
+    parser.add_argument('--iterations', type=int, default=50)
+    args = parser.parse_args()
+
+    dsn = bench_dsn()
+    configure_env(dsn)
+    conn = psycopg2.connect(dsn)
+    reset_database(conn)
+    seed(conn, args.users, args.chats, args.messages)
+
+    messages = load_function('messages')
+    tokens = [make_session(conn, uid) for uid in range(1, args.users + 1)]
+    turn = iter(range(10 ** 9))
+
+    def legacy():
+        legacy_get_chats(conn, next(turn) % args.users + 1)
+
+    def summary():
+        invoke(messages, 'GET', {'action': 'get_chats'}, token=tokens[next(turn) % args.users])
+
+    report(f'legacy get_chats ({args.chats} chats)', timed(legacy, args.iterations))
+    report(f'summary get_chats ({args.chats} chats)', timed(summary, args.iterations))
+    conn.close()
+
+
+if __name__ == '__main__':
+    main()
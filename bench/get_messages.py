@@ -0,0 +1,81 @@
+'''
+Время получения страницы истории в зависимости от размера чата:
+первая страница, страница из середины и самая старая страница
+
+    BENCH_DATABASE_URL=postgresql://postgres@localhost/bench python bench/get_messages.py --sizes 1000 100000 1000000
+'''
+import argparse
+import json
+from datetime import datetime
+
+import psycopg2
+
+from common import bench_dsn, configure_env, invoke, load_function, make_session, report, reset_database, timed
+
+
+def seed(conn, sizes: list) -> list:
+    cur = conn.cursor()
+    cur.execute("INSERT INTO users (phone, full_name) VALUES ('+70000000001', 'A'), ('+70000000002', 'B')")
+    chat_ids = []
+    for size in sizes:
+        cur.execute("INSERT INTO chats (chat_type, created_by) VALUES ('private', 1) RETURNING id")
+        chat_id = cur.fetchone()[0]
+        cur.execute("INSERT INTO chat_members (chat_id, user_id) VALUES (%s, 1), (%s, 2)", (chat_id, chat_id))
+        cur.execute(
+            """
+            INSERT INTO messages (chat_id, sender_id, msg_type, content, created_at)
+            SELECT %s, 1 + g %% 2, 'text', 'message ' || g, TIMESTAMP '2024-01-01' + make_interval(secs => g)
+            FROM generate_series(1, %s) g
+            """,
+            (chat_id, size)
+        )
+        chat_ids.append(chat_id)
+    cur.execute('ANALYZE')
+    conn.commit()
+    cur.close()
+    return chat_ids
+
+
+def cursor_at(messages, token: str, chat_id: int, pages_back: int) -> str:
+    cursor = None
+    for _ in range(pages_back):
+        params = {'action': 'get_messages', 'chat_id': str(chat_id), 'limit': '200'}
+        if cursor:
+            params['before'] = cursor
+        body = json.loads(invoke(messages, 'GET', params, token=token)['body'])
+        if not body['has_more']:
+            break
+        cursor = body['before_cursor']
+    return cursor
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 100000, 1000000])
+    parser.add_argument('--iterations', type=int, default=200)
+    parser.add_argument('--limit', type=int, default=50)
+    args = parser.parse_args()
+
+    dsn = bench_dsn()
+    configure_env(dsn)
+    conn = psycopg2.connect(dsn)
+    reset_database(conn)
+    chat_ids = seed(conn, args.sizes)
+    token = make_session(conn, 1)
+    conn.close()
+
+    messages = load_function('messages')
+
+    for size, chat_id in zip(args.sizes, chat_ids):
+        base = {'action': 'get_messages', 'chat_id': str(chat_id), 'limit': str(args.limit)}
+        middle = cursor_at(messages, token, chat_id, min(50, size // 400))
+        report(f'newest page ({size})', timed(lambda: invoke(messages, 'GET', base, token=token), args.iterations))
+        if middle:
+            params = dict(base, before=middle)
+            report(f'older page ({size})', timed(lambda: invoke(messages, 'GET', params, token=token), args.iterations))
+        oldest = dict(base, after=messages.encode_cursor(datetime(1970, 1, 1), 0))
+        report(f'oldest page ({size})', timed(lambda: invoke(messages, 'GET', oldest, token=token), args.iterations))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,119 @@
+'''
+Группа на 10k участников: создание построчным executemany против одного
+INSERT ... SELECT из create_group, отправка сообщения в большую группу
+(рассылка непрочитанных O(участников)), постраничный список участников,
+добавление/удаление и проверка членства в get_messages с кэшем и без
+
+    BENCH_DATABASE_URL=postgresql://postgres@localhost/bench python bench/group_members.py --members 10000
+'''
+import argparse
+
+import psycopg2
+
+from common import bench_dsn, configure_env, invoke, load_function, make_session, report, reset_database, response_json, timed
+
+
+def seed(conn, users: int):
+    cur = conn.cursor()
+    cur.execute(
+        "INSERT INTO users (phone, full_name) "
+        "SELECT '+7' || lpad(n::text, 10, '0'), 'User ' || n FROM generate_series(1, %s) AS n",
+        (users,)
+    )
+    conn.commit()
+    cur.close()
+
+
+def legacy_create(conn, member_ids: list):
+    '''
+    Прежний create_group: участники по одной строке через executemany
+    '''
+    cur = conn.cursor()
+    cur.execute("INSERT INTO chats (chat_type, title, created_by) VALUES ('group', 'legacy', 1) RETURNING id")
+    chat_id = cur.fetchone()[0]
+    cur.execute("INSERT INTO chat_members (chat_id, user_id, member_role) VALUES (%s, 1, 'admin')", (chat_id,))
+    cur.executemany(
+        "INSERT INTO chat_members (chat_id, user_id, member_role) VALUES (%s, %s, 'member')",
+        [(chat_id, member_id) for member_id in member_ids]
+    )
+    conn.rollback()
+    cur.close()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--members', type=int, default=10000)
+    parser.add_argument('--iterations', type=int, default=5)
+    parser.add_argument('--sends', type=int, default=50)
+    parser.add_argument('--page', type=int, default=500)
+    args = parser.parse_args()
+
+    dsn = bench_dsn()
+    configure_env(dsn)
+    conn = psycopg2.connect(dsn)
+    reset_database(conn)
+    seed(conn, args.members + 100)
+    token = make_session(conn, 1)
+    member_token = make_session(conn, 2)
+
+    messages = load_function('messages')
+    member_ids = list(range(2, args.members + 1))
+
+    report(f'legacy executemany x{len(member_ids)}', timed(lambda: legacy_create(conn, member_ids), args.iterations))
+
+    chat_ids = []
+
+    def create():
+        body = {'action': 'create_group', 'title': 'bench', 'member_ids': member_ids}
+        chat_ids.append(response_json(invoke(messages, 'POST', body=body, token=token))['chat_id'])
+
+    report(f'create_group x{args.members}', timed(create, args.iterations))
+    chat_id = chat_ids[-1]
+
+    def send():
+        invoke(messages, 'POST', body={'action': 'send_message', 'chat_id': chat_id, 'content': 'hello'}, token=token)
+
+    report(f'send_message to {args.members}', timed(send, args.sends))
+
+    pages = []
+
+    def list_all():
+        cursor, count = None, 0
+        while True:
+            params = {'action': 'list_members', 'chat_id': str(chat_id), 'limit': str(args.page)}
+            if cursor:
+                params['cursor'] = cursor
+            page = response_json(invoke(messages, 'GET', params, token=token))
+            count += len(page['members'])
+            cursor = page['next_cursor']
+            if not page['has_more']:
+                break
+        pages.append(count)
+
+    report(f'list_members by {args.page}', timed(list_all, args.iterations), members=pages[-1])
+
+    extra = list(range(args.members + 1, args.members + 101))
+
+    def add_remove():
+        invoke(messages, 'POST', body={'action': 'add_members', 'chat_id': chat_id, 'member_ids': extra}, token=token)
+        for member_id in extra:
+            invoke(messages, 'POST', body={'action': 'remove_member', 'chat_id': chat_id, 'user_id': member_id}, token=token)
+
+    report(f'add {len(extra)} + remove one by one', timed(add_remove, args.iterations))
+
+    params = {'action': 'get_messages', 'chat_id': str(chat_id), 'limit': '1'}
+
+    def read_cold():
+        messages.membership.cache.invalidate(chat_id, 2)
+        invoke(messages, 'GET', params, token=member_token)
+
+    def read_cached():
+        invoke(messages, 'GET', params, token=member_token)
+
+    report('get_messages membership miss', timed(read_cold, args.sends))
+    report('get_messages membership hit', timed(read_cached, args.sends), **messages.membership.cache.stats)
+    conn.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,261 @@
+'''
+Нагрузочный прогон всех трёх функций в процессе: несколько потоков вызывают
+auth.handler, messages.handler и upload.handler по смеси сценариев (вход по SMS,
+список чатов, прокрутка истории, отправка, загрузка файла) в течение заданного
+времени и печатают пропускную способность и перцентили по каждому сценарию.
+
+Результат можно сохранить (--save) и сравнить с ним следующий прогон (--compare):
+скрипт завершится с ошибкой, если p95 какого-либо сценария вырос больше порога.
+Сценарий upload нужен локальный S3 (moto_server, MinIO), без S3_ENDPOINT_URL он пропускается
+
+    BENCH_DATABASE_URL=postgresql://postgres@localhost/bench python bench/load.py --users 10000 --messages 100
+    python bench/load.py --skip-seed --duration 60 --concurrency 16 --save baseline.json
+    python bench/load.py --skip-seed --compare baseline.json
+'''
+import argparse
+import hashlib
+import json
+import os
+import random
+import statistics
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import psycopg2
+
+from common import bench_dsn, configure_env, invoke, load_function, percentile, report, reset_database, response_json
+from datagen import create_sessions, generate
+from sms_gateway import Gateway
+
+WEIGHTS = {'login': 1, 'chats': 4, 'history': 4, 'send': 2, 'upload': 1}
+HISTORY_PAGES = 3
+UPLOAD_BYTES = 64 * 1024
+CLIENT_HEADERS = {'Accept-Encoding': 'gzip, br'}
+
+
+class Context:
+    def __init__(self, functions: dict, tokens: dict, user_chats: dict, phones: dict):
+        self.auth = functions['auth']
+        self.messages = functions['messages']
+        self.upload = functions.get('upload')
+        self.tokens = tokens
+        self.user_chats = user_chats
+        self.user_ids = list(user_chats)
+        self.phones = phones
+        self.payload = os.urandom(UPLOAD_BYTES)
+
+
+def login(ctx: Context, rng: random.Random):
+    phone = ctx.phones[rng.choice(ctx.user_ids)]
+    # Каждый вход — отдельный клиент со своим адресом, как у настоящих пользователей
+    ip = f'10.{rng.randrange(256)}.{rng.randrange(256)}.{rng.randrange(256)}'
+    sent = response_json(invoke(ctx.auth, 'POST', body={'action': 'send_code', 'phone': phone}, source_ip=ip))
+    invoke(ctx.auth, 'POST', body={'action': 'verify_code', 'phone': phone, 'code': sent['code'], 'device_info': 'load'})
+
+
+def chats(ctx: Context, rng: random.Random):
+    user_id = rng.choice(ctx.user_ids)
+    invoke(ctx.messages, 'GET', {'action': 'get_chats'}, token=ctx.tokens[user_id], headers=CLIENT_HEADERS)
+
+
+def history(ctx: Context, rng: random.Random):
+    user_id = rng.choice(ctx.user_ids)
+    params = {'action': 'get_messages', 'chat_id': str(rng.choice(ctx.user_chats[user_id]))}
+    for _ in range(HISTORY_PAGES):
+        page = response_json(invoke(ctx.messages, 'GET', params, token=ctx.tokens[user_id], headers=CLIENT_HEADERS))
+        if not page['has_more']:
+            break
+        params = dict(params, before=page['before_cursor'])
+
+
+def send(ctx: Context, rng: random.Random):
+    user_id = rng.choice(ctx.user_ids)
+    body = {
+        'action': 'send_message',
+        'chat_id': rng.choice(ctx.user_chats[user_id]),
+        'content': f'load test {rng.randrange(10 ** 9)}'
+    }
+    invoke(ctx.messages, 'POST', body=body, token=ctx.tokens[user_id])
+
+
+def upload(ctx: Context, rng: random.Random):
+    import requests
+    user_id = rng.choice(ctx.user_ids)
+    payload = rng.randbytes(16) + ctx.payload
+    body = {
+        'action': 'presign',
+        'file_name': 'load.bin',
+        'file_type': 'application/octet-stream',
+        'sha256': hashlib.sha256(payload).hexdigest()
+    }
+    signed = response_json(invoke(ctx.upload, 'POST', body=body, token=ctx.tokens[user_id]))
+    response = requests.put(signed['upload_url'], data=payload, headers={
+        'Content-Type': 'application/octet-stream',
+        'x-amz-checksum-sha256': signed['checksum_sha256']
+    })
+    response.raise_for_status()
+
+
+SCENARIOS = {'login': login, 'chats': chats, 'history': history, 'send': send, 'upload': upload}
+
+
+def run(ctx: Context, mix: dict, duration: float, concurrency: int, seed: int) -> dict:
+    names = list(mix)
+    weights = [mix[name] for name in names]
+    results = {name: {'samples': [], 'errors': 0, 'last_error': None} for name in names}
+    lock = threading.Lock()
+    deadline = time.monotonic() + duration
+
+    def worker(index: int):
+        rng = random.Random(seed + index)
+        local = {name: [] for name in names}
+        errors = {}
+        while time.monotonic() < deadline:
+            name = rng.choices(names, weights)[0]
+            start = time.perf_counter()
+            try:
+                SCENARIOS[name](ctx, rng)
+            except Exception as e:
+                errors[name] = (errors.get(name, (0, None))[0] + 1, str(e))
+                continue
+            local[name].append((time.perf_counter() - start) * 1000)
+        with lock:
+            for name in names:
+                results[name]['samples'].extend(local[name])
+            for name, (count, message) in errors.items():
+                results[name]['errors'] += count
+                results[name]['last_error'] = message
+
+    with ThreadPoolExecutor(concurrency) as executor:
+        list(executor.map(worker, range(concurrency)))
+    return results
+
+
+def summarize(results: dict, duration: float) -> dict:
+    summary = {}
+    for name, result in results.items():
+        samples = result['samples']
+        summary[name] = {
+            'ops': len(samples),
+            'errors': result['errors'],
+            'throughput': len(samples) / duration,
+            'mean': statistics.fmean(samples) if samples else None,
+            'p50': percentile(samples, 50) if samples else None,
+            'p95': percentile(samples, 95) if samples else None,
+            'p99': percentile(samples, 99) if samples else None
+        }
+    return summary
+
+
+def compare(summary: dict, baseline: dict, threshold: float) -> list:
+    regressions = []
+    for name, current in summary.items():
+        before = baseline.get(name)
+        if not before or not before['p95'] or not current['p95']:
+            continue
+        change = current['p95'] / before['p95'] - 1
+        print(f'{name:<10} p95 {before["p95"]:8.3f}ms -> {current["p95"]:8.3f}ms ({change:+.0%})')
+        if change > threshold:
+            regressions.append(name)
+    return regressions
+
+
+def prepare(conn, args) -> tuple:
+    cur = conn.cursor()
+    cur.execute(
+        """
+        SELECT cm.user_id, u.phone, array_agg(cm.chat_id)
+        FROM chat_members cm JOIN users u ON u.id = cm.user_id
+        WHERE cm.user_id IN (SELECT id FROM users ORDER BY id LIMIT %s)
+        GROUP BY cm.user_id, u.phone
+        """,
+        (args.active_users,)
+    )
+    rows = cur.fetchall()
+    cur.close()
+    if not rows:
+        sys.exit('No users with chats: run without --skip-seed or bench/datagen.py first')
+    user_chats = {row[0]: row[2] for row in rows}
+    phones = {row[0]: row[1] for row in rows}
+    return user_chats, phones, create_sessions(conn, user_chats)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--users', type=int, default=10000)
+    parser.add_argument('--chats', type=int, default=20, help='личных чатов на пользователя')
+    parser.add_argument('--messages', type=int, default=100, help='сообщений в чате')
+    parser.add_argument('--groups', type=int, default=20)
+    parser.add_argument('--group-size', type=int, default=200)
+    parser.add_argument('--skip-seed', action='store_true', help='использовать уже сгенерированную базу')
+    parser.add_argument('--active-users', type=int, default=1000, help='сколько пользователей участвует в прогоне')
+    parser.add_argument('--scenarios', nargs='+', choices=list(WEIGHTS), default=list(WEIGHTS))
+    parser.add_argument('--duration', type=float, default=30)
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--save')
+    parser.add_argument('--compare')
+    parser.add_argument('--threshold', type=float, default=0.2, help='допустимый рост p95 при --compare')
+    args = parser.parse_args()
+
+    mix = {name: WEIGHTS[name] for name in args.scenarios}
+    if 'upload' in mix and not os.environ.get('S3_ENDPOINT_URL'):
+        print('S3_ENDPOINT_URL is not set, skipping upload scenario')
+        del mix['upload']
+
+    gateway = Gateway(0, 0).start()
+    os.environ['SMS_API_KEY'] = 'bench'
+    os.environ['SMS_GATEWAY_URL'] = gateway.url
+    os.environ['SMS_CODE_COOLDOWN'] = '0'
+    os.environ['SMS_PHONE_BUCKET_CAPACITY'] = '1000000'
+    os.environ['SMS_IP_BUCKET_CAPACITY'] = '1000000'
+    os.environ['DB_POOL_MAX_SIZE'] = str(args.concurrency)
+
+    dsn = bench_dsn()
+    configure_env(dsn)
+    conn = psycopg2.connect(dsn)
+    if not args.skip_seed:
+        reset_database(conn)
+        generate(conn, args.users, args.chats, args.messages, args.groups, args.group_size)
+    user_chats, phones, tokens = prepare(conn, args)
+    conn.close()
+
+    functions = {name: load_function(name) for name in ('auth', 'messages')}
+    if 'upload' in mix:
+        from botocore.exceptions import ClientError
+        functions['upload'] = load_function('upload')
+        try:
+            functions['upload'].s3_client().create_bucket(Bucket=functions['upload'].BUCKET)
+        except ClientError:
+            pass
+
+    ctx = Context(functions, tokens, user_chats, phones)
+    print(f'running {", ".join(mix)} for {args.duration:.0f}s with {args.concurrency} workers')
+    results = run(ctx, mix, args.duration, args.concurrency, args.seed)
+    summary = summarize(results, args.duration)
+
+    for name, result in results.items():
+        if result['samples']:
+            report(name, result['samples'], ops_per_s=f"{summary[name]['throughput']:.1f}", errors=result['errors'])
+        else:
+            print(f'{name:<32} no successful calls, errors={result["errors"]}')
+        if result['last_error']:
+            print(f'    last error: {result["last_error"]}')
+    total = sum(item['ops'] for item in summary.values())
+    print(f'total {total} ops, {total / args.duration:.1f} ops/s')
+    functions['auth'].sms.wait_idle()
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(summary, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(summary, json.load(f), args.threshold)
+        if regressions:
+            sys.exit(f'p95 regression over {args.threshold:.0%}: {", ".join(regressions)}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,105 @@
+'''
+Вставка и чтение истории до и после секционирования messages по месяцам:
+одна таблица (миграции до V0012) против месячных секций (V0013). С --archive
+старые секции выгружаются в локальный S3 и измеряется дочитывание из архива
+
+    BENCH_DATABASE_URL=postgresql://postgres@localhost/bench python bench/partitions.py --messages 5000000 --months 24
+    S3_ENDPOINT_URL=http://127.0.0.1:5000 AWS_ACCESS_KEY_ID=test AWS_SECRET_ACCESS_KEY=test \
+    BENCH_DATABASE_URL=postgresql://postgres@localhost/bench python bench/partitions.py --archive 12
+'''
+import argparse
+import json
+from datetime import date, datetime
+
+import psycopg2
+
+from common import bench_dsn, configure_env, invoke, load_function, make_session, report, reset_database, timed
+
+CHATS = 1000
+
+
+def month_start(offset: int) -> date:
+    today = date.today()
+    index = today.year * 12 + today.month - 1 + offset
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def seed(conn, messages: int, months: int, partitioned: bool):
+    cur = conn.cursor()
+    if partitioned:
+        cur.execute('DROP TABLE messages_legacy')
+        for offset in range(-months, 1):
+            cur.execute(
+                f"CREATE TABLE IF NOT EXISTS messages_p{month_start(offset):%Y%m} PARTITION OF messages FOR VALUES FROM (%s) TO (%s)",
+                (month_start(offset), month_start(offset + 1))
+            )
+    cur.execute("INSERT INTO users (phone, full_name) VALUES ('+70000000001', 'A'), ('+70000000002', 'B')")
+    cur.execute("INSERT INTO chats (chat_type, created_by) SELECT 'group', 1 FROM generate_series(1, %s)", (CHATS,))
+    cur.execute("INSERT INTO chat_members (chat_id, user_id) SELECT g, u FROM generate_series(1, %s) g, (VALUES (1), (2)) m(u)", (CHATS,))
+    cur.execute(
+        """
+        INSERT INTO messages (chat_id, sender_id, msg_type, content, created_at)
+        SELECT 1 + g %% %(chats)s, 1 + g %% 2, 'text', 'message ' || g,
+               %(start)s::timestamp + (NOW() - %(start)s::timestamp) * g / %(messages)s
+        FROM generate_series(1, %(messages)s) g
+        """,
+        {'chats': CHATS, 'start': month_start(-months), 'messages': messages}
+    )
+    cur.execute('ANALYZE')
+    conn.commit()
+    cur.close()
+
+
+def archive(conn, months: int):
+    maintenance = load_function('archive')
+    s3 = maintenance.s3_client()
+    if maintenance.BUCKET not in [b['Name'] for b in s3.list_buckets().get('Buckets', [])]:
+        s3.create_bucket(Bucket=maintenance.BUCKET)
+    cutoff = month_start(-months)
+    for name in maintenance.expired_partitions(conn, cutoff):
+        result = maintenance.archive_partition(conn, name)
+        print(f"archived {result['partition']}: {result['messages']} messages in {result['chats']} chats")
+
+
+def run(layout: str, args):
+    dsn = bench_dsn()
+    configure_env(dsn)
+    conn = psycopg2.connect(dsn)
+    partitioned = layout == 'partitioned'
+    reset_database(conn, until=None if partitioned else 'V0012')
+    seed(conn, args.messages, args.months, partitioned)
+    token = make_session(conn, 1)
+    if partitioned and args.archive:
+        archive(conn, args.archive)
+
+    messages = load_function('messages')
+    counter = iter(range(10 ** 9))
+
+    def send():
+        invoke(messages, 'POST', body={'action': 'send_message', 'chat_id': 1 + next(counter) % CHATS, 'content': 'hello'}, token=token)
+
+    newest = {'action': 'get_messages', 'chat_id': '1', 'limit': '50'}
+    deep = dict(newest, before=messages.encode_cursor(datetime.combine(month_start(-args.months + 1), datetime.min.time()), 0))
+    report(f'{layout}: send_message', timed(send, args.iterations))
+    report(f'{layout}: newest page', timed(lambda: invoke(messages, 'GET', newest, token=token), args.iterations))
+    report(f'{layout}: oldest month page', timed(lambda: invoke(messages, 'GET', deep, token=token), args.iterations))
+
+    body = json.loads(invoke(messages, 'GET', deep, token=token)['body'])
+    print(f"{layout}: oldest month page returned {len(body['messages'])} messages")
+    conn.close()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--messages', type=int, default=5000000)
+    parser.add_argument('--months', type=int, default=24)
+    parser.add_argument('--iterations', type=int, default=300)
+    parser.add_argument('--archive', type=int, default=0, help='выгрузить секции старше N месяцев в S3')
+    args = parser.parse_args()
+
+    run('flat', args)
+    run('partitioned', args)
+
+
+if __name__ == '__main__':
+    main()
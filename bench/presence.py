@@ -0,0 +1,74 @@
+'''
+Присутствие на 100k клиентов: пропускная способность heartbeat, пакетный запрос
+статусов для списка чатов и сброс last_seen в Postgres пачками. Клиенты
+моделируются в процессе — сокеты меряет realtime_fanout.py
+
+    pip install -r services/realtime/requirements.txt
+    python bench/presence.py --clients 100000
+    BENCH_DATABASE_URL=postgresql://postgres@localhost/bench python bench/presence.py --clients 100000 --flush
+'''
+import argparse
+import asyncio
+import os
+import random
+import sys
+import time
+
+from common import ROOT, bench_dsn, configure_env, report, reset_database, timed
+
+sys.path.insert(0, os.path.join(ROOT, 'services', 'realtime'))
+from presence import Presence  # noqa: E402
+
+
+def seed_users(dsn: str, clients: int):
+    import psycopg2
+
+    conn = psycopg2.connect(dsn)
+    reset_database(conn)
+    cur = conn.cursor()
+    cur.execute("INSERT INTO users (phone, full_name) SELECT '+7' || (9000000000 + g)::text, 'User ' || g FROM generate_series(1, %s) g", (clients,))
+    conn.commit()
+    cur.close()
+    conn.close()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--clients', type=int, default=100000)
+    parser.add_argument('--rounds', type=int, default=10)
+    parser.add_argument('--lookup-size', type=int, default=50)
+    parser.add_argument('--flush', action='store_true', help='сбрасывать last_seen в BENCH_DATABASE_URL')
+    args = parser.parse_args()
+
+    writer = None
+    if args.flush:
+        dsn = bench_dsn()
+        configure_env(dsn)
+        seed_users(dsn, args.clients)
+        import server
+        writer = server.postgres_presence_writer(dsn)
+
+    presence = Presence(writer)
+    user_ids = list(range(1, args.clients + 1))
+
+    for round_number in range(args.rounds):
+        random.shuffle(user_ids)
+        start = time.perf_counter()
+        for user_id in user_ids:
+            presence.heartbeat(user_id)
+        elapsed = time.perf_counter() - start
+        print(f'round {round_number + 1}: {args.clients / elapsed:,.0f} heartbeats/s')
+
+    rnd = random.Random(1)
+    report(f'lookup of {args.lookup_size}', timed(lambda: presence.lookup(rnd.sample(user_ids, args.lookup_size)), 1000))
+    report('sweep', timed(presence.sweep, 20))
+
+    if writer is not None:
+        start = time.perf_counter()
+        asyncio.run(presence.flush())
+        print(f"flush: {presence.stats['flushed']} rows in {(time.perf_counter() - start) * 1000:.0f}ms "
+              f"({args.clients * args.rounds} heartbeats -> {presence.stats['flushed']} row updates)")
+
+
+if __name__ == '__main__':
+    main()
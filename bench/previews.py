@@ -0,0 +1,69 @@
+'''
+Пропускная способность и пиковая память пайплайна превью на пачке изображений.
+S3 не нужен: измеряется только backend/upload/previews.py
+
+    pip install Pillow
+    python bench/previews.py --images 1000 --workers 2
+'''
+import argparse
+import io
+import os
+import random
+import resource
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from PIL import Image
+
+from common import BACKEND, report
+
+sys.path.insert(0, os.path.join(BACKEND, 'upload'))
+from previews import make_preview  # noqa: E402
+
+SIZES = [(640, 480), (1280, 960), (1920, 1080), (3024, 4032), (4000, 3000)]
+
+
+def sample_images(count: int) -> list:
+    random.seed(1)
+    samples = []
+    for width, height in SIZES:
+        for fmt in ('JPEG', 'PNG'):
+            image = Image.effect_noise((width, height), 64).convert('RGB')
+            buf = io.BytesIO()
+            image.save(buf, fmt, quality=90)
+            samples.append((f'{fmt} {width}x{height}', buf.getvalue()))
+    return [random.choice(samples) for _ in range(count)]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--images', type=int, default=1000)
+    parser.add_argument('--workers', type=int, default=2)
+    args = parser.parse_args()
+
+    batch = sample_images(args.images)
+    baseline = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    latencies = []
+
+    def run(item):
+        start = time.perf_counter()
+        make_preview(item[1])
+        latencies.append((time.perf_counter() - start) * 1000)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(args.workers) as executor:
+        list(executor.map(run, batch))
+    elapsed = time.perf_counter() - start
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+    report(
+        f'preview x{args.workers} workers', latencies,
+        images_per_s=f'{args.images / elapsed:.1f}',
+        peak_rss_mb=f'{peak:.1f}',
+        over_inputs_mb=f'{peak - baseline:.1f}'
+    )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,102 @@
+'''
+Нагрузочный тест сервиса доставки: группа из 1000 участников, у каждого открыт
+сокет; измеряется задержка от публикации события до получения каждым участником.
+Postgres не нужен — состав группы отдаётся из памяти
+
+    pip install -r services/realtime/requirements.txt
+    python bench/realtime_fanout.py --members 1000 --events 200 --idle 10000
+'''
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+
+from common import ROOT, make_token, report
+
+sys.path.insert(0, os.path.join(ROOT, 'services', 'realtime'))
+from hub import Hub, MemberDirectory  # noqa: E402
+import server  # noqa: E402
+
+from websockets.asyncio.client import connect  # noqa: E402
+from websockets.asyncio.server import serve  # noqa: E402
+
+CHAT_ID = 1
+
+
+async def receiver(url: str, latencies: list, expected: int, ready: asyncio.Event, counter: list):
+    async with connect(url, compression=None, max_size=None) as websocket:
+        counter[0] += 1
+        if counter[0] == counter[1]:
+            ready.set()
+        received = 0
+        while received < expected:
+            event = json.loads(await websocket.recv())
+            if event.get('type') != 'message':
+                continue
+            latencies.append((time.perf_counter() - event['sent_at']) * 1000)
+            received += 1
+
+
+async def idle_client(url: str, stop: asyncio.Event):
+    async with connect(url, compression=None):
+        await stop.wait()
+
+
+async def run(args):
+    os.environ.setdefault('JWT_SECRET', 'bench-secret')
+    server.raise_fd_limit()
+    member_ids = list(range(1, args.members + 1))
+
+    async def loader(chat_id: int) -> list:
+        return member_ids if chat_id == CHAT_ID else []
+
+    hub = Hub(MemberDirectory(loader))
+    latencies = []
+    stop = asyncio.Event()
+
+    async with serve(lambda ws: server.handle(hub, ws), '127.0.0.1', args.port, compression=None):
+        url = f'ws://127.0.0.1:{args.port}/'
+        idle = [
+            asyncio.create_task(idle_client(f'{url}?token={make_token(args.members + i + 1)}', stop))
+            for i in range(args.idle)
+        ]
+        ready = asyncio.Event()
+        counter = [0, args.members]
+        receivers = [
+            asyncio.create_task(receiver(f'{url}?token={make_token(uid)}', latencies, args.events, ready, counter))
+            for uid in member_ids
+        ]
+        await ready.wait()
+        while hub.stats['connections'] < args.members + args.idle:
+            await asyncio.sleep(0.05)
+
+        fanout = []
+        for i in range(args.events):
+            start = time.perf_counter()
+            await hub.publish({'type': 'message', 'chat_id': CHAT_ID, 'seq': i, 'sent_at': start})
+            fanout.append((time.perf_counter() - start) * 1000)
+            await asyncio.sleep(args.interval)
+
+        await asyncio.gather(*receivers)
+        stop.set()
+        await asyncio.gather(*idle)
+
+    report(f'publish fan-out ({args.members} members)', fanout)
+    report('delivery latency per member', latencies, connections=args.members + args.idle)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--members', type=int, default=1000)
+    parser.add_argument('--events', type=int, default=200)
+    parser.add_argument('--idle', type=int, default=0)
+    parser.add_argument('--interval', type=float, default=0.01)
+    parser.add_argument('--port', type=int, default=8799)
+    args = parser.parse_args()
+    asyncio.run(run(args))
+
+
+if __name__ == '__main__':
+    main()
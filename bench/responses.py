@@ -0,0 +1,82 @@
+'''
+Сериализация и байты на проводе для страницы из 5000 сообщений: прежний
+json.dumps со str(created_at) против backend/*/responses.py (orjson, если
+установлен) без сжатия, с gzip и brotli, плюс повторный запрос с ETag (304).
+База не нужна — строки синтетические
+
+    pip install orjson brotli   # необязательно: без них меряется запасной путь
+    python bench/responses.py --messages 5000
+'''
+import argparse
+import json
+import os
+import sys
+from datetime import datetime, timedelta
+
+from common import BACKEND, report, timed
+
+sys.path.insert(0, os.path.join(BACKEND, 'messages'))
+import responses  # noqa: E402
+
+
+def make_messages(count: int) -> list:
+    start = datetime(2024, 1, 1, 9, 0, 0)
+    return [
+        {
+            'id': 1000000 + i,
+            'sender_id': 1 + i % 2,
+            'sender_name': 'Анна Смирнова' if i % 2 else 'Ivan Petrov',
+            'sender_avatar': None,
+            'type': 'text',
+            'content': f'Сообщение номер {i}: договорились встретиться завтра в офисе, see you there',
+            'file_url': None,
+            'file_name': None,
+            'thumb_url': None,
+            'preview': None,
+            'width': None,
+            'height': None,
+            'created_at': start + timedelta(seconds=37 * i, microseconds=i),
+            'is_mine': i % 2 == 1,
+            'seen_by': i % 3
+        }
+        for i in range(count)
+    ]
+
+
+def legacy_response(data: dict) -> dict:
+    messages = [dict(m, created_at=str(m['created_at'])) for m in data['messages']]
+    return {
+        'statusCode': 200,
+        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+        'body': json.dumps(dict(data, messages=messages))
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--messages', type=int, default=5000)
+    parser.add_argument('--iterations', type=int, default=100)
+    args = parser.parse_args()
+
+    data = {'messages': make_messages(args.messages), 'has_more': True, 'before_cursor': 'x', 'after_cursor': 'y'}
+    print(f"serializer: {'orjson' if responses.orjson else 'json'}, brotli: {'yes' if responses.brotli else 'no'}")
+
+    cases = [
+        ('legacy json.dumps', lambda: legacy_response(data)),
+        ('respond, identity', lambda: responses.respond({'headers': {}}, data)),
+        ('respond, gzip', lambda: responses.respond({'headers': {'Accept-Encoding': 'gzip'}}, data)),
+    ]
+    if responses.brotli:
+        cases.append(('respond, br', lambda: responses.respond({'headers': {'Accept-Encoding': 'br, gzip'}}, data)))
+    etag = responses.respond({'headers': {}}, data, etag=True)['headers']['ETag']
+    cases.append(('respond, 304', lambda: responses.respond({'headers': {'If-None-Match': etag}}, data, etag=True)))
+
+    for name, make in cases:
+        response = make()
+        body = response['body']
+        wire = len(body) * 3 // 4 if response.get('isBase64Encoded') else len(body.encode())
+        report(name, timed(make, args.iterations), status=response['statusCode'], bytes=wire)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,91 @@
+'''
+Полнотекстовый поиск по сообщениям при росте общей истории до 10M сообщений:
+история пользователя фиксирована, растут чужие чаты — задержка должна оставаться ровной
+
+    BENCH_DATABASE_URL=postgresql://postgres@localhost/bench python bench/search_messages.py --sizes 100000 1000000 10000000
+'''
+import argparse
+import random
+
+import psycopg2
+
+from common import bench_dsn, configure_env, invoke, load_function, make_session, report, reset_database, timed
+
+WORDS = [
+    'встреча', 'проект', 'отчёт', 'договор', 'звонок', 'завтра', 'офис', 'клиент', 'оплата', 'доставка',
+    'meeting', 'project', 'report', 'invoice', 'deadline', 'release', 'review', 'budget', 'server', 'design'
+]
+OWN_CHATS = 20
+OWN_MESSAGES = 50000
+OTHER_CHATS = 10000
+
+
+def seed_users(conn):
+    cur = conn.cursor()
+    cur.execute("INSERT INTO users (phone, full_name) SELECT '+7' || (9000000000 + g)::text, 'User ' || g FROM generate_series(1, 100) g")
+    cur.execute(
+        "INSERT INTO chats (chat_type, title, created_by) SELECT 'group', 'Chat ' || g, 1 FROM generate_series(1, %s) g",
+        (OWN_CHATS + OTHER_CHATS,)
+    )
+    cur.execute("INSERT INTO chat_members (chat_id, user_id) SELECT g, 1 FROM generate_series(1, %s) g", (OWN_CHATS,))
+    cur.execute(
+        "INSERT INTO chat_members (chat_id, user_id) SELECT g, 2 + g %% 99 FROM generate_series(1, %s) g",
+        (OWN_CHATS + OTHER_CHATS,)
+    )
+    conn.commit()
+    cur.close()
+
+
+def add_messages(conn, first_chat: int, chats: int, start: int, count: int):
+    cur = conn.cursor()
+    cur.execute(
+        """
+        INSERT INTO messages (chat_id, sender_id, msg_type, content, created_at)
+        SELECT %(first)s + g %% %(chats)s, 2 + g %% 99, 'text',
+               (%(words)s::text[])[1 + g %% 20] || ' ' ||
+               (%(words)s::text[])[1 + (g * 7) %% 20] || ' ' ||
+               (%(words)s::text[])[1 + (g * 13) %% 20] || ' ' || g,
+               TIMESTAMP '2024-01-01' + make_interval(secs => g)
+        FROM generate_series(%(start)s, %(end)s) g
+        """,
+        {'first': first_chat, 'chats': chats, 'words': WORDS, 'start': start, 'end': start + count - 1}
+    )
+    cur.execute('ANALYZE messages')
+    conn.commit()
+    cur.close()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sizes', type=int, nargs='+', default=[100000, 1000000, 10000000])
+    parser.add_argument('--iterations', type=int, default=200)
+    args = parser.parse_args()
+
+    dsn = bench_dsn()
+    configure_env(dsn)
+    conn = psycopg2.connect(dsn)
+    reset_database(conn)
+    seed_users(conn)
+    add_messages(conn, 1, OWN_CHATS, 1, OWN_MESSAGES)
+    token = make_session(conn, 1)
+
+    messages = load_function('messages')
+    rnd = random.Random(1)
+
+    def search(make_query):
+        return lambda: invoke(messages, 'GET', {'action': 'search_messages', 'q': make_query()}, token=token)
+
+    total = OWN_MESSAGES
+    for size in sorted(args.sizes):
+        if size > total:
+            add_messages(conn, OWN_CHATS + 1, OTHER_CHATS, total + 1, size - total)
+            total = size
+        report(f'one word ({total})', timed(search(lambda: rnd.choice(WORDS)), args.iterations))
+        report(f'two words ({total})', timed(search(lambda: ' '.join(rnd.sample(WORDS, 2))), args.iterations))
+        report(f'stemmed form ({total})', timed(search(lambda: rnd.choice(['встречи', 'проекты', 'reports', 'invoices'])), args.iterations))
+        report(f'no match ({total})', timed(search(lambda: 'несуществующее'), args.iterations))
+    conn.close()
+
+
+if __name__ == '__main__':
+    main()
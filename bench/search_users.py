@@ -0,0 +1,84 @@
+'''
+Поиск пользователей на 1M синтетических пользователей: префикс и суффикс номера,
+подстрока имени; --explain печатает план поиска по короткому префиксу
+
+    BENCH_DATABASE_URL=postgresql://postgres@localhost/bench python bench/search_users.py --users 1000000
+'''
+import argparse
+import random
+
+import psycopg2
+
+from common import bench_dsn, configure_env, invoke, load_function, make_session, report, reset_database, timed
+
+FIRST_NAMES = ['Анна', 'Иван', 'Мария', 'Пётр', 'Ольга', 'Сергей', 'Елена', 'Дмитрий', 'Alex', 'Kate']
+LAST_NAMES = ['Иванов', 'Петрова', 'Смирнов', 'Кузнецова', 'Попов', 'Соколова', 'Lee', 'Smith']
+
+
+def seed(conn, users: int):
+    cur = conn.cursor()
+    cur.execute(
+        """
+        INSERT INTO users (phone, full_name)
+        SELECT '+7' || (9000000000 + g)::text,
+               (%s::text[])[1 + g %% array_length(%s::text[], 1)] || ' ' ||
+               (%s::text[])[1 + (g / 7) %% array_length(%s::text[], 1)] || ' ' || g
+        FROM generate_series(1, %s) g
+        """,
+        (FIRST_NAMES, FIRST_NAMES, LAST_NAMES, LAST_NAMES, users)
+    )
+    cur.execute('ANALYZE users')
+    conn.commit()
+    cur.close()
+
+
+def explain(conn, messages):
+    '''
+    Планы для префиксов из 4 и 5 цифр: у каждого ранга должен быть Index Scan по
+    (ключ, id) с Limit, без Sort по всем совпадениям
+    '''
+    cur = conn.cursor()
+    for digits in ('7900', '79001'):
+        cur.execute(
+            'EXPLAIN (ANALYZE, BUFFERS) ' + messages.queries.SEARCH_USERS['phone'],
+            {'term': digits, 'prefix': f'{digits}%', 'suffix': f'{digits[::-1]}%', 'user_id': 1,
+             'after_rank': -1, 'after_id': -1, 'after_key': '', 'limit': 21}
+        )
+        print(f'--- prefix {digits}')
+        print('\n'.join(row[0] for row in cur.fetchall()))
+    cur.close()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--users', type=int, default=1000000)
+    parser.add_argument('--iterations', type=int, default=300)
+    parser.add_argument('--explain', action='store_true')
+    args = parser.parse_args()
+
+    dsn = bench_dsn()
+    configure_env(dsn)
+    conn = psycopg2.connect(dsn)
+    reset_database(conn)
+    seed(conn, args.users)
+    token = make_session(conn, 1)
+
+    messages = load_function('messages')
+    if args.explain:
+        explain(conn, messages)
+    conn.close()
+    rnd = random.Random(1)
+
+    def search(make_query):
+        return lambda: invoke(messages, 'GET', {'action': 'search_users', 'q': make_query()}, token=token)
+
+    report('phone prefix', timed(search(lambda: f'+7900{rnd.randint(0, 99):02d}'), args.iterations))
+    report('local prefix (8...)', timed(search(lambda: f'890{rnd.randint(0, 9)}'), args.iterations))
+    report('phone suffix', timed(search(lambda: f'{rnd.randint(0, 9999):04d}'), args.iterations))
+    report('full phone', timed(search(lambda: f'8900{rnd.randint(1, args.users):07d}'), args.iterations))
+    report('name substring', timed(search(lambda: rnd.choice(LAST_NAMES)[:4].lower()), args.iterations))
+    report('name + number', timed(search(lambda: f'{rnd.choice(FIRST_NAMES)} {rnd.choice(LAST_NAMES)}'), args.iterations))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,68 @@
+'''
+send_code под нагрузкой с медленным SMS-шлюзом (локальная заглушка bench/sms_gateway.py):
+время ответа, повторы в окне cooldown и шторм запросов с одного IP
+
+    BENCH_DATABASE_URL=postgresql://postgres@localhost/bench python bench/send_code.py --gateway-delay-ms 300
+'''
+import argparse
+import json
+import os
+
+import psycopg2
+
+from common import bench_dsn, configure_env, load_function, report, reset_database, timed
+from sms_gateway import Gateway
+
+
+def send_code(auth, phone: str, ip: str, headers: dict = None) -> dict:
+    event = {
+        'httpMethod': 'POST',
+        'headers': headers or {},
+        'requestContext': {'identity': {'sourceIp': ip}},
+        'body': json.dumps({'action': 'send_code', 'phone': phone})
+    }
+    return auth.handler(event, None)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--gateway-delay-ms', type=float, default=300)
+    parser.add_argument('--iterations', type=int, default=300)
+    parser.add_argument('--storm', type=int, default=1000)
+    args = parser.parse_args()
+
+    gateway = Gateway(0, args.gateway_delay_ms / 1000).start()
+    os.environ['SMS_API_KEY'] = 'bench'
+    os.environ['SMS_GATEWAY_URL'] = gateway.url
+    os.environ['SMS_IP_BUCKET_CAPACITY'] = str(args.iterations * 2)
+
+    dsn = bench_dsn()
+    configure_env(dsn)
+    conn = psycopg2.connect(dsn)
+    reset_database(conn)
+    conn.close()
+
+    auth = load_function('auth')
+    sms = auth.sms
+    phones = iter(f'+7900{n:07d}' for n in range(10 ** 7))
+
+    report('new code, unique phones', timed(lambda: send_code(auth, next(phones), '10.0.0.1'), args.iterations))
+    report('repeat within cooldown', timed(lambda: send_code(auth, '+79000000000', '10.0.0.1'), args.iterations))
+
+    statuses = {}
+    storm_phones = iter(f'+7911{n:07d}' for n in range(10 ** 7))
+
+    # Клиент подставляет каждый раз новый X-Forwarded-For — лимит по IP всё равно должен сработать
+    def storm():
+        spoofed = {'X-Forwarded-For': f'10.1.{len(statuses)}.{sum(statuses.values()) % 256}'}
+        status = send_code(auth, next(storm_phones), '10.0.0.2', spoofed)['statusCode']
+        statuses[status] = statuses.get(status, 0) + 1
+
+    report('storm from one IP', timed(storm, args.storm), **{f'http_{code}': count for code, count in sorted(statuses.items())})
+
+    sms.wait_idle()
+    print(f'requests={args.iterations * 2 + args.storm} sms_sent={len(gateway.sent)}')
+
+
+if __name__ == '__main__':
+    main()
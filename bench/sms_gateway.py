@@ -0,0 +1,64 @@
+'''
+Локальная заглушка SMS-шлюза с API как у smsc.ru/sys/send.php: отвечает после
+заданной задержки и считает запросы. Используется бенчмарками и для ручных проверок
+
+    python bench/sms_gateway.py --port 8025 --delay-ms 300
+    SMS_API_KEY=test SMS_GATEWAY_URL=http://127.0.0.1:8025/sys/send.php ...
+'''
+import argparse
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs
+
+
+class Gateway(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, port: int, delay: float):
+        super().__init__(('127.0.0.1', port), GatewayHandler)
+        self.delay = delay
+        self.sent = []
+        self.lock = threading.Lock()
+
+    @property
+    def url(self) -> str:
+        return f'http://127.0.0.1:{self.server_address[1]}/sys/send.php'
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+
+class GatewayHandler(BaseHTTPRequestHandler):
+    def do_POST(self):
+        form = parse_qs(self.rfile.read(int(self.headers.get('Content-Length', 0))).decode())
+        time.sleep(self.server.delay)
+        with self.server.lock:
+            self.server.sent.append((form.get('phones', [''])[0], form.get('mes', [''])[0]))
+            message_id = len(self.server.sent)
+        body = json.dumps({'id': message_id, 'cnt': 1}).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--port', type=int, default=8025)
+    parser.add_argument('--delay-ms', type=float, default=300)
+    args = parser.parse_args()
+
+    gateway = Gateway(args.port, args.delay_ms / 1000)
+    print(f'SMS gateway stand-in on {gateway.url}')
+    gateway.serve_forever()
+
+
+if __name__ == '__main__':
+    main()
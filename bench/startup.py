@@ -0,0 +1,116 @@
+'''
+Холодный старт функций: каждый прогон — новый интерпретатор, в котором замеряется
+импорт backend/<name>/index.py, первый запрос и следующий тёплый запрос; по
+-X importtime печатаются самые тяжёлые модули, загруженные при импорте.
+upload выдаёт presigned URL без обращения к S3, так что S3 не нужен
+
+    BENCH_DATABASE_URL=postgresql://postgres@localhost/bench python bench/startup.py --runs 10
+'''
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+
+from common import bench_dsn, configure_env, invoke, load_function, make_session, report, reset_database
+
+FUNCTIONS = ['auth', 'messages', 'upload']
+TOP_MODULES = 8
+
+
+def first_request(name: str, module, token: str, run: int):
+    if name == 'auth':
+        body = {'action': 'send_code', 'phone': f'+7955{run:07d}'}
+        return invoke(module, 'POST', body=body, source_ip=f'10.9.{run // 256 % 256}.{run % 256}')
+    if name == 'messages':
+        return invoke(module, 'GET', {'action': 'get_chats'}, token=token)
+    return invoke(module, 'POST', body={'action': 'presign', 'file_name': 'a.txt'}, token=token)
+
+
+def child(name: str, token: str, run: int):
+    start = time.perf_counter()
+    module = load_function(name)
+    imported = time.perf_counter()
+    first_request(name, module, token, run * 2)
+    first = time.perf_counter()
+    first_request(name, module, token, run * 2 + 1)
+    second = time.perf_counter()
+    if name == 'auth':
+        module.sms.wait_idle()
+    print(json.dumps({
+        'import_ms': (imported - start) * 1000,
+        'first_ms': (first - imported) * 1000,
+        'warm_ms': (second - first) * 1000
+    }))
+
+
+def heaviest_imports(stderr: str) -> list:
+    '''
+    Модули верхнего уровня из вывода -X importtime по суммарному времени
+    '''
+    modules = []
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or '|' not in line:
+            continue
+        _, cumulative, package = line[len('import time:'):].split('|')
+        if package.startswith('  ') or not cumulative.strip().isdigit():
+            continue
+        modules.append((int(cumulative) / 1000, package.strip()))
+    return sorted(modules, reverse=True)[:TOP_MODULES]
+
+
+def run_child(name: str, token: str, run: int, importtime: bool = False) -> tuple:
+    command = [sys.executable]
+    if importtime:
+        command += ['-X', 'importtime']
+    command += [os.path.abspath(__file__), '--child', name, '--token', token, '--run', str(run)]
+    result = subprocess.run(command, capture_output=True, text=True, cwd=os.path.dirname(os.path.abspath(__file__)))
+    if result.returncode != 0:
+        raise RuntimeError(f'{name} child failed: {result.stderr[-2000:]}')
+    return json.loads(result.stdout.strip().splitlines()[-1]), result.stderr
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--runs', type=int, default=10)
+    parser.add_argument('--functions', nargs='+', choices=FUNCTIONS, default=FUNCTIONS)
+    parser.add_argument('--child')
+    parser.add_argument('--token')
+    parser.add_argument('--run', type=int, default=0)
+    args = parser.parse_args()
+
+    dsn = bench_dsn()
+    configure_env(dsn)
+    os.environ.setdefault('AWS_ACCESS_KEY_ID', 'bench')
+    os.environ.setdefault('AWS_SECRET_ACCESS_KEY', 'bench')
+    if args.child:
+        child(args.child, args.token, args.run)
+        return
+
+    # psycopg2 импортируется только в родительском процессе, чтобы в дочернем
+    # его загрузка попала в замер импорта функции
+    import psycopg2
+    conn = psycopg2.connect(dsn)
+    reset_database(conn)
+    cur = conn.cursor()
+    cur.execute("INSERT INTO users (phone, full_name) VALUES ('+70000000001', 'Bench')")
+    conn.commit()
+    cur.close()
+    token = make_session(conn, 1)
+    conn.close()
+
+    for name in args.functions:
+        samples = {'import_ms': [], 'first_ms': [], 'warm_ms': []}
+        for run in range(args.runs):
+            result, _ = run_child(name, token, run + 1)
+            for key in samples:
+                samples[key].append(result[key])
+        for key, values in samples.items():
+            report(f'{name} {key[:-3]}', values)
+        _, stderr = run_child(name, token, args.runs + 1, importtime=True)
+        print('    heaviest imports: ' + ', '.join(f'{package} {ms:.1f}ms' for ms, package in heaviest_imports(stderr)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,140 @@
+'''
+Проверка порядка change_seq и коммитов (не замер).
+
+1. Транзакция A берёт номер раньше B, а коммитится позже; B не ждёт A, а sync
+   между двумя коммитами не должен сдвинуть курсор за номер A.
+2. Изменено больше чатов, чем помещается в страницу sync: сообщение в чате, который
+   не попал на первую страницу из-за более позднего changed_seq, не теряется.
+
+Завершается ошибкой, если клиент не получил какое-то сообщение или получил его дважды
+
+    BENCH_DATABASE_URL=postgresql://postgres@localhost/bench python bench/sync_order.py
+'''
+import sys
+import threading
+
+import psycopg2
+
+from common import bench_dsn, configure_env, invoke, load_function, make_session, reset_database, response_json
+
+WRITER_WAIT = 1.0
+
+
+def seed(conn, chats: int) -> list:
+    '''
+    Пользователи 1 и 2 пишут, 3 читает; все трое в каждой из групп
+    '''
+    cur = conn.cursor()
+    cur.execute(
+        "INSERT INTO users (phone, full_name) "
+        "VALUES ('+70000000001', 'A'), ('+70000000002', 'B'), ('+70000000003', 'Reader')"
+    )
+    cur.execute(
+        "INSERT INTO chats (chat_type, title, created_by) "
+        "SELECT 'group', 'order ' || n, 1 FROM generate_series(1, %s) n RETURNING id",
+        (chats,)
+    )
+    chat_ids = sorted(row[0] for row in cur.fetchall())
+    cur.execute(
+        "INSERT INTO chat_members (chat_id, user_id) SELECT c, u FROM unnest(%s::int[]) c, unnest(ARRAY[1, 2, 3]) u",
+        (chat_ids,)
+    )
+    conn.commit()
+    cur.close()
+    return chat_ids
+
+
+def sync(messages, token: str, cursor: str) -> tuple:
+    '''
+    Листает sync до конца; возвращает новый курсор и тексты полученных сообщений
+    '''
+    delivered = []
+    while True:
+        body = response_json(invoke(messages, 'GET', {'action': 'sync', 'cursor': cursor}, token=token))
+        cursor = body['cursor']
+        delivered += [message['content'] for message in body['messages']]
+        if not body['has_more']:
+            return cursor, delivered
+
+
+def check(name: str, delivered: list, expected: list):
+    print(f'{name}: {len(delivered)} delivered')
+    if sorted(delivered) != sorted(expected):
+        missing = sorted(set(expected) - set(delivered))
+        sys.exit(f'{name}: lost or duplicated messages, missing {missing[:10]}, got {len(delivered)}/{len(expected)}')
+
+
+def out_of_order_commits(dsn: str, messages, token: str, chat_id: int):
+    cursor, _ = sync(messages, token, '0')
+
+    def item(text: str) -> dict:
+        return dict(messages.message_fields({'content': text}), chat_id=chat_id)
+
+    writer_a = psycopg2.connect(dsn)
+    writer_b = psycopg2.connect(dsn)
+
+    def send_b():
+        messages.insert_messages(writer_b.cursor(), 2, [item('from B')])
+        writer_b.commit()
+
+    # A взяла номер и ещё не закоммитилась; B пишет следом и коммитится раньше A
+    messages.insert_messages(writer_a.cursor(), 1, [item('from A')])
+    thread = threading.Thread(target=send_b)
+    thread.start()
+    thread.join(WRITER_WAIT)
+    b_blocked = thread.is_alive()
+
+    cursor, first = sync(messages, token, cursor)
+    writer_a.commit()
+    thread.join()
+    cursor, second = sync(messages, token, cursor)
+    writer_a.close()
+    writer_b.close()
+
+    print(f'B waited for A: {b_blocked}; first sync: {first}; second sync: {second}')
+    if b_blocked:
+        sys.exit('writers are serialized again: B waited for A')
+    check('out-of-order commits', first + second, ['from A', 'from B'])
+
+
+def more_chats_than_page(dsn: str, messages, token: str, chat_ids: list):
+    '''
+    Сообщение в первом чате, затем по сообщению в каждом из остальных, затем ещё одно
+    в первом: его changed_seq больше всех, и первая страница sync его не содержит
+    '''
+    cursor, _ = sync(messages, token, '0')
+    first, others = chat_ids[0], chat_ids[1:]
+    conn = psycopg2.connect(dsn)
+    cur = conn.cursor()
+
+    def send(chat_id: int, text: str):
+        messages.insert_messages(cur, 1, [dict(messages.message_fields({'content': text}), chat_id=chat_id)])
+        conn.commit()
+
+    send(first, 'early')
+    for chat_id in others:
+        send(chat_id, f'chat {chat_id}')
+    send(first, 'late')
+    conn.close()
+
+    _, delivered = sync(messages, token, cursor)
+    check(f'{len(chat_ids)} changed chats', delivered, ['early', 'late', *(f'chat {c}' for c in others)])
+
+
+def main():
+    dsn = bench_dsn()
+    configure_env(dsn)
+    messages = load_function('messages')
+    conn = psycopg2.connect(dsn)
+    reset_database(conn)
+    chat_ids = seed(conn, messages.SYNC_CHATS_MAX + 50)
+    token = make_session(conn, 3)
+    conn.close()
+
+    out_of_order_commits(dsn, messages, token, chat_ids[0])
+    more_chats_than_page(dsn, messages, token, chat_ids)
+    print('ok')
+
+
+if __name__ == '__main__':
+    main()
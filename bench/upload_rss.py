@@ -0,0 +1,116 @@
+'''
+Пиковый RSS при загрузке большого файла: base64 в JSON через функцию
+против multipart-загрузки частями по presigned URL. Нужен локальный S3,
+например `moto_server -p 5000` или MinIO, и база для проверки сессии
+
+    S3_ENDPOINT_URL=http://127.0.0.1:5000 AWS_ACCESS_KEY_ID=test AWS_SECRET_ACCESS_KEY=test \
+    BENCH_DATABASE_URL=postgresql://postgres@localhost/bench python bench/upload_rss.py --size-mb 100
+'''
+import argparse
+import base64
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import psycopg2
+
+from common import bench_dsn, configure_env, load_function, make_session, reset_database
+
+CONCURRENCY = 4
+
+
+def peak_rss_mb() -> float:
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def run_legacy(upload, path: str):
+    with open(path, 'rb') as f:
+        body = json.dumps({'file_data': base64.b64encode(f.read()).decode(), 'file_name': 'legacy.bin'})
+    event = {'httpMethod': 'POST', 'headers': {'X-Authorization': f"Bearer {os.environ['BENCH_TOKEN']}"}, 'body': body}
+    response = upload.handler(event, None)
+    assert response['statusCode'] == 200, response['body']
+
+
+def run_multipart(upload, path: str):
+    import requests
+
+    def call(body: dict) -> dict:
+        event = {'httpMethod': 'POST', 'headers': {'X-Authorization': f"Bearer {os.environ['BENCH_TOKEN']}"}, 'body': json.dumps(body)}
+        response = upload.handler(event, None)
+        assert response['statusCode'] == 200, response['body']
+        return json.loads(response['body'])
+
+    size = os.path.getsize(path)
+    created = call({'action': 'create_multipart', 'file_name': 'multipart.bin', 'file_size': size})
+    part_size = created['part_size']
+
+    def put_part(part: dict) -> dict:
+        with open(path, 'rb') as f:
+            f.seek((part['part_number'] - 1) * part_size)
+            chunk = f.read(part_size)
+        response = requests.put(part['url'], data=chunk)
+        response.raise_for_status()
+        return {'part_number': part['part_number'], 'etag': response.headers['ETag']}
+
+    with ThreadPoolExecutor(CONCURRENCY) as executor:
+        parts = list(executor.map(put_part, created['parts']))
+    call({'action': 'complete_multipart', 'key': created['key'], 'upload_id': created['upload_id'], 'parts': parts})
+
+
+def child(mode: str, path: str):
+    from botocore.exceptions import ClientError
+    upload = load_function('upload')
+    try:
+        upload.s3_client().create_bucket(Bucket=upload.BUCKET)
+    except ClientError:
+        pass
+    baseline = peak_rss_mb()
+    start = time.perf_counter()
+    (run_legacy if mode == 'legacy' else run_multipart)(upload, path)
+    elapsed = time.perf_counter() - start
+    print(json.dumps({'mode': mode, 'seconds': elapsed, 'baseline_mb': baseline, 'peak_mb': peak_rss_mb()}))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--size-mb', type=int, default=100)
+    parser.add_argument('--child', choices=['legacy', 'multipart'])
+    parser.add_argument('--path')
+    args = parser.parse_args()
+
+    if args.child:
+        child(args.child, args.path)
+        return
+
+    dsn = bench_dsn()
+    configure_env(dsn)
+    conn = psycopg2.connect(dsn)
+    reset_database(conn)
+    cur = conn.cursor()
+    cur.execute("INSERT INTO users (phone, full_name) VALUES ('+70000000001', 'Bench') RETURNING id")
+    os.environ['BENCH_TOKEN'] = make_session(conn, cur.fetchone()[0])
+    conn.close()
+
+    with tempfile.NamedTemporaryFile(suffix='.bin') as f:
+        for _ in range(args.size_mb):
+            f.write(os.urandom(1024 * 1024))
+        f.flush()
+        for mode in ('legacy', 'multipart'):
+            output = subprocess.run(
+                [sys.executable, os.path.abspath(__file__), '--child', mode, '--path', f.name],
+                check=True, capture_output=True, text=True
+            ).stdout
+            result = json.loads(output.strip().splitlines()[-1])
+            print(
+                f"{mode:<10} {args.size_mb}MB  time={result['seconds']:.2f}s  "
+                f"peak_rss={result['peak_mb']:.1f}MB  (+{result['peak_mb'] - result['baseline_mb']:.1f}MB over import baseline)"
+            )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,17 @@
+CREATE TABLE IF NOT EXISTS chat_summaries (
+    chat_id INTEGER PRIMARY KEY,
+    last_message_id INTEGER,
+    last_message_text TEXT,
+    last_message_time TIMESTAMP
+);
+
+ALTER TABLE chat_members ADD COLUMN IF NOT EXISTS unread_count INTEGER NOT NULL DEFAULT 0;
+
+CREATE INDEX IF NOT EXISTS idx_chat_members_user_chat ON chat_members(user_id, chat_id);
+CREATE INDEX IF NOT EXISTS idx_chat_members_chat_user ON chat_members(chat_id, user_id);
+
+INSERT INTO chat_summaries (chat_id, last_message_id, last_message_text, last_message_time)
+SELECT DISTINCT ON (chat_id) chat_id, id, content, created_at
+FROM messages
+ORDER BY chat_id, created_at DESC, id DESC
+ON CONFLICT (chat_id) DO NOTHING;
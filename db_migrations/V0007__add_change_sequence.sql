@@ -0,0 +1,21 @@
+CREATE SEQUENCE IF NOT EXISTS change_seq;
+
+ALTER TABLE messages ADD COLUMN IF NOT EXISTS seq BIGINT;
+ALTER TABLE chat_members ADD COLUMN IF NOT EXISTS changed_seq BIGINT;
+
+UPDATE messages m SET seq = ordered.rn
+FROM (SELECT id, ROW_NUMBER() OVER (ORDER BY created_at, id) as rn FROM messages) ordered
+WHERE ordered.id = m.id AND m.seq IS NULL;
+
+SELECT setval('change_seq', GREATEST((SELECT COALESCE(MAX(seq), 0) FROM messages), 1));
+
+UPDATE chat_members cm SET changed_seq = COALESCE(
+    (SELECT MAX(m.seq) FROM messages m WHERE m.chat_id = cm.chat_id), 0
+)
+WHERE cm.changed_seq IS NULL;
+
+ALTER TABLE messages ALTER COLUMN seq SET DEFAULT nextval('change_seq');
+ALTER TABLE chat_members ALTER COLUMN changed_seq SET DEFAULT nextval('change_seq');
+
+CREATE INDEX IF NOT EXISTS idx_messages_chat_seq ON messages(chat_id, seq);
+CREATE INDEX IF NOT EXISTS idx_chat_members_user_changed ON chat_members(user_id, changed_seq);
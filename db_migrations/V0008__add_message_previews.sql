@@ -0,0 +1,4 @@
+ALTER TABLE messages ADD COLUMN IF NOT EXISTS thumb_url TEXT;
+ALTER TABLE messages ADD COLUMN IF NOT EXISTS preview TEXT;
+ALTER TABLE messages ADD COLUMN IF NOT EXISTS media_width INTEGER;
+ALTER TABLE messages ADD COLUMN IF NOT EXISTS media_height INTEGER;
@@ -0,0 +1,17 @@
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
+ALTER TABLE users ADD COLUMN IF NOT EXISTS phone_digits VARCHAR(20) GENERATED ALWAYS AS (
+    CASE
+        WHEN regexp_replace(phone, '\D', '', 'g') ~ '^8\d{10}$'
+            THEN '7' || substr(regexp_replace(phone, '\D', '', 'g'), 2)
+        ELSE regexp_replace(phone, '\D', '', 'g')
+    END
+) STORED;
+
+ALTER TABLE users ADD COLUMN IF NOT EXISTS phone_digits_rev VARCHAR(20) GENERATED ALWAYS AS (
+    reverse(regexp_replace(phone, '\D', '', 'g'))
+) STORED;
+
+CREATE INDEX IF NOT EXISTS idx_users_phone_digits ON users(phone_digits text_pattern_ops);
+CREATE INDEX IF NOT EXISTS idx_users_phone_digits_rev ON users(phone_digits_rev text_pattern_ops);
+CREATE INDEX IF NOT EXISTS idx_users_full_name_trgm ON users USING GIN (lower(full_name) gin_trgm_ops);
@@ -0,0 +1,11 @@
+ALTER TABLE chat_members ADD COLUMN IF NOT EXISTS last_read_message_id INTEGER NOT NULL DEFAULT 0;
+
+UPDATE chat_members cm SET last_read_message_id = COALESCE((
+    SELECT m.id FROM messages m
+    WHERE m.chat_id = cm.chat_id AND m.sender_id != cm.user_id
+    ORDER BY m.id DESC
+    OFFSET cm.unread_count LIMIT 1
+), 0);
+
+CREATE INDEX IF NOT EXISTS idx_messages_chat_id ON messages(chat_id, id);
+CREATE INDEX IF NOT EXISTS idx_chat_members_chat_read ON chat_members(chat_id, last_read_message_id);
@@ -0,0 +1,19 @@
+ALTER TABLE chats ADD COLUMN IF NOT EXISTS pair_low INTEGER;
+ALTER TABLE chats ADD COLUMN IF NOT EXISTS pair_high INTEGER;
+
+UPDATE chats c SET pair_low = p.pair_low, pair_high = p.pair_high
+FROM (
+    SELECT DISTINCT ON (m.pair_low, m.pair_high) m.chat_id, m.pair_low, m.pair_high
+    FROM (
+        SELECT chat_id, MIN(user_id) AS pair_low, MAX(user_id) AS pair_high
+        FROM chat_members
+        GROUP BY chat_id
+        HAVING COUNT(DISTINCT user_id) <= 2
+    ) m
+    JOIN chats ch ON ch.id = m.chat_id AND ch.chat_type = 'private'
+    LEFT JOIN chat_summaries s ON s.chat_id = m.chat_id
+    ORDER BY m.pair_low, m.pair_high, s.last_message_time DESC NULLS LAST, m.chat_id
+) p
+WHERE c.id = p.chat_id AND c.pair_low IS NULL;
+
+CREATE UNIQUE INDEX IF NOT EXISTS idx_chats_private_pair ON chats(pair_low, pair_high);
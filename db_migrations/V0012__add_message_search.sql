@@ -0,0 +1,6 @@
+CREATE EXTENSION IF NOT EXISTS btree_gin;
+
+ALTER TABLE messages ADD COLUMN IF NOT EXISTS search_vector tsvector
+    GENERATED ALWAYS AS (to_tsvector('russian', coalesce(content, ''))) STORED;
+
+CREATE INDEX IF NOT EXISTS idx_messages_search ON messages USING GIN (chat_id, search_vector);
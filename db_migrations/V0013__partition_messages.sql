@@ -0,0 +1,72 @@
+CREATE TABLE IF NOT EXISTS message_archives (
+    chat_id INTEGER NOT NULL,
+    first_at TIMESTAMP NOT NULL,
+    last_at TIMESTAMP NOT NULL,
+    partition_name TEXT NOT NULL,
+    object_key TEXT NOT NULL,
+    message_count INTEGER NOT NULL,
+    archived_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (chat_id, last_at)
+);
+
+-- Существующая таблица без копирования данных становится первой секцией
+-- messages_legacy (всё до начала следующего месяца), дальше идут месячные секции
+DO $$
+DECLARE
+    boundary DATE := date_trunc('month', CURRENT_DATE) + INTERVAL '1 month';
+    month_start DATE;
+BEGIN
+    IF EXISTS (SELECT 1 FROM pg_partitioned_table WHERE partrelid = 'messages'::regclass) THEN
+        RETURN;
+    END IF;
+
+    ALTER TABLE messages RENAME TO messages_legacy;
+    ALTER INDEX idx_messages_chat RENAME TO idx_messages_legacy_chat;
+    ALTER INDEX idx_messages_chat_seq RENAME TO idx_messages_legacy_chat_seq;
+    ALTER INDEX idx_messages_chat_id RENAME TO idx_messages_legacy_chat_id;
+    ALTER INDEX idx_messages_search RENAME TO idx_messages_legacy_search;
+
+    UPDATE messages_legacy SET created_at = CURRENT_TIMESTAMP WHERE created_at IS NULL;
+    ALTER TABLE messages_legacy ALTER COLUMN created_at SET NOT NULL;
+    ALTER TABLE messages_legacy DROP CONSTRAINT messages_pkey;
+    ALTER TABLE messages_legacy ADD CONSTRAINT messages_legacy_pkey PRIMARY KEY (id, created_at);
+    EXECUTE format('ALTER TABLE messages_legacy ADD CONSTRAINT messages_legacy_range CHECK (created_at < %L)', boundary);
+
+    CREATE TABLE messages (
+        id INTEGER NOT NULL DEFAULT nextval('messages_id_seq'),
+        chat_id INTEGER,
+        sender_id INTEGER,
+        msg_type VARCHAR(20),
+        content TEXT,
+        file_url TEXT,
+        file_name TEXT,
+        file_size BIGINT,
+        created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+        seq BIGINT DEFAULT nextval('change_seq'),
+        thumb_url TEXT,
+        preview TEXT,
+        media_width INTEGER,
+        media_height INTEGER,
+        search_vector tsvector GENERATED ALWAYS AS (to_tsvector('russian', coalesce(content, ''))) STORED,
+        PRIMARY KEY (id, created_at)
+    ) PARTITION BY RANGE (created_at);
+
+    ALTER SEQUENCE messages_id_seq OWNED BY messages.id;
+
+    CREATE INDEX idx_messages_chat ON messages(chat_id, created_at);
+    CREATE INDEX idx_messages_chat_seq ON messages(chat_id, seq);
+    CREATE INDEX idx_messages_chat_id ON messages(chat_id, id);
+    CREATE INDEX idx_messages_search ON messages USING GIN (chat_id, search_vector);
+
+    EXECUTE format('ALTER TABLE messages ATTACH PARTITION messages_legacy FOR VALUES FROM (MINVALUE) TO (%L)', boundary);
+
+    FOR i IN 0..2 LOOP
+        month_start := boundary + make_interval(months => i);
+        EXECUTE format(
+            'CREATE TABLE IF NOT EXISTS %I PARTITION OF messages FOR VALUES FROM (%L) TO (%L)',
+            'messages_p' || to_char(month_start, 'YYYYMM'), month_start, month_start + INTERVAL '1 month'
+        );
+    END LOOP;
+
+    CREATE TABLE IF NOT EXISTS messages_default PARTITION OF messages DEFAULT;
+END $$;
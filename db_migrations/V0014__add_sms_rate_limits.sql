@@ -0,0 +1,7 @@
+CREATE TABLE IF NOT EXISTS rate_limits (
+    bucket_key TEXT PRIMARY KEY,
+    tokens REAL NOT NULL,
+    updated_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+
+ALTER TABLE sms_codes ADD COLUMN IF NOT EXISTS sent_at TIMESTAMP;
@@ -0,0 +1,25 @@
+-- create_group не отбрасывал повторяющиеся member_ids: у дубликатов сохраняется
+-- одна строка (администратор, затем самая ранняя) с самой свежей отметкой прочтения
+UPDATE chat_members cm
+SET last_read_message_id = d.last_read_message_id,
+    unread_count = d.unread_count
+FROM (
+    SELECT chat_id, user_id, MAX(last_read_message_id) AS last_read_message_id, MIN(unread_count) AS unread_count
+    FROM chat_members
+    GROUP BY chat_id, user_id
+    HAVING COUNT(*) > 1
+) d
+WHERE cm.chat_id = d.chat_id AND cm.user_id = d.user_id;
+
+DELETE FROM chat_members cm
+USING (
+    SELECT id, ROW_NUMBER() OVER (
+        PARTITION BY chat_id, user_id
+        ORDER BY COALESCE(member_role = 'admin', false) DESC, id
+    ) AS rn
+    FROM chat_members
+) d
+WHERE cm.id = d.id AND d.rn > 1;
+
+CREATE UNIQUE INDEX IF NOT EXISTS idx_chat_members_chat_user_unique ON chat_members(chat_id, user_id);
+DROP INDEX IF EXISTS idx_chat_members_chat_user;
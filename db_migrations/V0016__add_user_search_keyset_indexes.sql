@@ -0,0 +1,8 @@
+-- Поиск по номеру идёт по рангам, и внутри ранга страница читается по порядку
+-- (ключ, id) прямо из индекса; COLLATE "C" даёт и LIKE 'префикс%', и этот порядок,
+-- поэтому индексы text_pattern_ops из V0009 больше не нужны
+CREATE INDEX IF NOT EXISTS idx_users_phone_digits_keyset ON users ((phone_digits COLLATE "C"), id);
+CREATE INDEX IF NOT EXISTS idx_users_phone_digits_rev_keyset ON users ((phone_digits_rev COLLATE "C"), id);
+
+DROP INDEX IF EXISTS idx_users_phone_digits;
+DROP INDEX IF EXISTS idx_users_phone_digits_rev;
@@ -0,0 +1,4 @@
+ALTER TABLE sms_codes ADD COLUMN IF NOT EXISTS dispatched_at TIMESTAMP;
+ALTER TABLE sms_codes ADD COLUMN IF NOT EXISTS dispatch_attempts INTEGER NOT NULL DEFAULT 0;
+
+CREATE INDEX IF NOT EXISTS idx_sms_codes_unsent ON sms_codes(created_at) WHERE sent_at IS NULL AND verified = false;
@@ -0,0 +1,11 @@
+-- Исключение из чата удаляет строку chat_members, и sync исключённого больше не видит
+-- этот чат; здесь остаётся отметка с номером change_seq, по которой sync сообщает об уходе
+CREATE TABLE IF NOT EXISTS chat_removals (
+    user_id INTEGER NOT NULL,
+    chat_id INTEGER NOT NULL,
+    seq BIGINT NOT NULL DEFAULT nextval('change_seq'),
+    removed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (user_id, chat_id)
+);
+
+CREATE INDEX IF NOT EXISTS idx_chat_removals_user_seq ON chat_removals(user_id, seq);
@@ -0,0 +1,115 @@
+'''
+Внутрипроцессная шина событий: раздаёт события чата подключённым сокетам его участников
+'''
+import asyncio
+import json
+import time
+from collections import defaultdict
+
+SEND_BUFFER_SIZE = 64
+MEMBERS_TTL = 30.0
+RESYNC = json.dumps({'type': 'resync'})
+
+
+class Connection:
+    '''
+    Сокет пользователя с ограниченным буфером отправки. Если клиент не успевает
+    читать, буфер сбрасывается и клиенту уходит одно событие resync — он
+    догоняет пропущенное через action=sync
+    '''
+
+    def __init__(self, websocket, user_id: int, buffer_size: int = SEND_BUFFER_SIZE, token: str = None):
+        self.websocket = websocket
+        self.user_id = user_id
+        self.token = token
+        self.queue = asyncio.Queue(maxsize=buffer_size)
+        self.overflows = 0
+
+    def offer(self, data: str):
+        try:
+            self.queue.put_nowait(data)
+        except asyncio.QueueFull:
+            self.overflows += 1
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            self.queue.put_nowait(RESYNC)
+
+    async def pump(self):
+        while True:
+            data = await self.queue.get()
+            await self.websocket.send(data)
+
+
+class MemberDirectory:
+    '''
+    Кэш состава чатов с TTL; loader(chat_id) — корутина, возвращающая id участников
+    '''
+
+    def __init__(self, loader, ttl: float = MEMBERS_TTL):
+        self._loader = loader
+        self._ttl = ttl
+        self._cache = {}
+        self._pending = {}
+
+    async def get(self, chat_id: int) -> list:
+        cached = self._cache.get(chat_id)
+        if cached and cached[0] > time.monotonic():
+            return cached[1]
+        if chat_id not in self._pending:
+            self._pending[chat_id] = asyncio.ensure_future(self._load(chat_id))
+        return await asyncio.shield(self._pending[chat_id])
+
+    def invalidate(self, chat_id: int):
+        self._cache.pop(chat_id, None)
+
+    async def _load(self, chat_id: int) -> list:
+        try:
+            member_ids = await self._loader(chat_id)
+            self._cache[chat_id] = (time.monotonic() + self._ttl, member_ids)
+            return member_ids
+        finally:
+            self._pending.pop(chat_id, None)
+
+
+class Hub:
+    def __init__(self, members: MemberDirectory):
+        self.members = members
+        self._by_user = defaultdict(set)
+        self.stats = {'connections': 0, 'events': 0, 'deliveries': 0}
+
+    def register(self, conn: Connection):
+        self._by_user[conn.user_id].add(conn)
+        self.stats['connections'] += 1
+
+    def unregister(self, conn: Connection):
+        conns = self._by_user.get(conn.user_id)
+        if conns is not None:
+            conns.discard(conn)
+            if not conns:
+                del self._by_user[conn.user_id]
+        self.stats['connections'] -= 1
+
+    def connections(self) -> list:
+        return [conn for conns in self._by_user.values() for conn in conns]
+
+    def resync_all(self):
+        '''
+        После обрыва LISTEN события за время простоя потеряны: каждый сокет
+        получает resync и догоняет через action=sync
+        '''
+        for conn in self.connections():
+            conn.offer(RESYNC)
+
+    async def publish(self, event: dict):
+        chat_id = event['chat_id']
+        if event.get('type') == 'members':
+            self.members.invalidate(chat_id)
+        member_ids = await self.members.get(chat_id)
+        # Исключённый уже не в chat_members, но о своём исключении узнаёт тем же событием
+        removed = [user_id for user_id in event.get('removed', ()) if user_id not in member_ids]
+        data = json.dumps(event)
+        self.stats['events'] += 1
+        for member_id in [*member_ids, *removed]:
+            for conn in self._by_user.get(member_id, ()):
+                conn.offer(data)
+                self.stats['deliveries'] += 1
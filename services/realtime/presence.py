@@ -0,0 +1,94 @@
+'''
+Присутствие в памяти: heartbeat продлевает срок пользователя на TTL, истёкшие
+записи вычищаются периодически, last_seen пишется в Postgres пачками раз в
+flush_interval, а не на каждый heartbeat
+'''
+import asyncio
+import time
+
+PRESENCE_TTL = 60.0
+FLUSH_INTERVAL = 30.0
+FLUSH_BATCH = 5000
+
+
+class Presence:
+    '''
+    writer(items) — корутина, получающая список (user_id, last_seen_epoch) для записи
+    '''
+
+    def __init__(self, writer=None, ttl: float = PRESENCE_TTL, flush_interval: float = FLUSH_INTERVAL):
+        self._writer = writer
+        self.ttl = ttl
+        self.flush_interval = flush_interval
+        self._expires = {}
+        self._connections = {}
+        self._last_seen = {}
+        self._dirty = set()
+        self.stats = {'heartbeats': 0, 'flushed': 0, 'expired': 0}
+
+    def heartbeat(self, user_id: int):
+        self._expires[user_id] = time.monotonic() + self.ttl
+        self._last_seen[user_id] = time.time()
+        self._dirty.add(user_id)
+        self.stats['heartbeats'] += 1
+
+    def connected(self, user_id: int):
+        self._connections[user_id] = self._connections.get(user_id, 0) + 1
+        self.heartbeat(user_id)
+
+    def disconnected(self, user_id: int):
+        left = self._connections.get(user_id, 0) - 1
+        if left > 0:
+            self._connections[user_id] = left
+            return
+        self._connections.pop(user_id, None)
+        self._expires.pop(user_id, None)
+        self._last_seen[user_id] = time.time()
+        self._dirty.add(user_id)
+
+    def is_online(self, user_id: int) -> bool:
+        expires = self._expires.get(user_id)
+        return expires is not None and expires > time.monotonic()
+
+    def lookup(self, user_ids) -> dict:
+        now = time.monotonic()
+        result = {}
+        for user_id in user_ids:
+            expires = self._expires.get(user_id)
+            result[user_id] = {
+                'online': expires is not None and expires > now,
+                'last_seen': self._last_seen.get(user_id)
+            }
+        return result
+
+    def sweep(self) -> int:
+        now = time.monotonic()
+        expired = [user_id for user_id, expires in self._expires.items() if expires <= now]
+        for user_id in expired:
+            del self._expires[user_id]
+        self.stats['expired'] += len(expired)
+        return len(expired)
+
+    def take_dirty(self) -> list:
+        dirty, self._dirty = self._dirty, set()
+        return [(user_id, self._last_seen[user_id]) for user_id in dirty]
+
+    async def flush(self):
+        items = self.take_dirty()
+        if not items or self._writer is None:
+            return
+        for start in range(0, len(items), FLUSH_BATCH):
+            batch = items[start:start + FLUSH_BATCH]
+            try:
+                await self._writer(batch)
+            except Exception as e:
+                print(f'Presence flush failed: {str(e)}')
+                self._dirty.update(user_id for user_id, _ in items[start:])
+                return
+            self.stats['flushed'] += len(batch)
+
+    async def run(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            self.sweep()
+            await self.flush()
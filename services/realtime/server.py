@@ -0,0 +1,305 @@
+'''
+Сервис доставки новых сообщений по WebSocket. Функция messages публикует
+события через pg_notify('messenger_events', ...), сервис слушает канал и
+раздаёт события подключённым участникам чата. Он же ведёт присутствие:
+сокет и его heartbeat'ы держат пользователя онлайн, а функции спрашивают
+статус пачкой через GET /presence?ids=1,2,3
+
+    DATABASE_URL=... JWT_SECRET=... MAIN_DB_SCHEMA=... python server.py --port 8765
+'''
+import argparse
+import asyncio
+import json
+import os
+import resource
+import threading
+import time
+from http import HTTPStatus
+from urllib.parse import parse_qs, urlparse
+
+import jwt
+import psycopg2
+import psycopg2.extensions
+from websockets.asyncio.server import serve
+from websockets.exceptions import ConnectionClosed
+
+from hub import Connection, Hub, MemberDirectory
+from presence import Presence
+
+CHANNEL = 'messenger_events'
+PRESENCE_LOOKUP_MAX = 1000
+RECONNECT_MIN = 1.0
+RECONNECT_MAX = 30.0
+QUERY_ATTEMPTS = 3
+SESSION_RECHECK_INTERVAL = 60.0
+SESSION_CHECK_BATCH = 5000
+# TCP keepalive libpq: молча оборванное соединение (без FIN) обнаруживается
+# примерно за 25 с, а не через системный таймаут в часы
+KEEPALIVES = {'keepalives': 1, 'keepalives_idle': 10, 'keepalives_interval': 5, 'keepalives_count': 3}
+
+
+async def handle(hub: Hub, websocket, presence: Presence = None, sessions=None):
+    '''
+    sessions(tokens) — корутина, возвращающая действующие токены из sessions;
+    без неё (бенчмарки без Postgres) проверяется только подпись JWT
+    '''
+    query = parse_qs(urlparse(websocket.request.path).query)
+    token = query.get('token', [''])[0]
+    try:
+        user_id = jwt.decode(token, os.environ['JWT_SECRET'], algorithms=['HS256'])['user_id']
+    except jwt.InvalidTokenError:
+        await websocket.close(code=4401, reason='Invalid token')
+        return
+    if sessions is not None:
+        try:
+            active = await sessions([token])
+        except psycopg2.Error as e:
+            print(f'Session check failed: {str(e)}')
+            await websocket.close(code=1013, reason='Try again later')
+            return
+        if token not in active:
+            await websocket.close(code=4401, reason='Session expired')
+            return
+
+    conn = Connection(websocket, user_id, token=token)
+    hub.register(conn)
+    if presence is not None:
+        presence.connected(user_id)
+    pump = asyncio.create_task(pump_until_closed(conn))
+    try:
+        async for _ in websocket:
+            if presence is not None:
+                presence.heartbeat(user_id)
+    except ConnectionClosed:
+        pass
+    finally:
+        pump.cancel()
+        hub.unregister(conn)
+        if presence is not None:
+            presence.disconnected(user_id)
+
+
+def presence_endpoint(presence: Presence, secret: str):
+    '''
+    process_request для websockets: GET /presence?ids=... отвечает JSON
+    {"<id>": {"online": bool, "last_seen": epoch | null}}, остальные пути — рукопожатие
+    '''
+
+    def process_request(connection, request):
+        url = urlparse(request.path)
+        if url.path != '/presence':
+            return None
+        if not secret or request.headers.get('X-Presence-Secret') != secret:
+            return connection.respond(HTTPStatus.FORBIDDEN, 'Forbidden\n')
+        try:
+            ids = [int(part) for part in parse_qs(url.query).get('ids', [''])[0].split(',') if part]
+        except ValueError:
+            return connection.respond(HTTPStatus.BAD_REQUEST, 'Invalid ids\n')
+        body = json.dumps({str(user_id): state for user_id, state in presence.lookup(ids[:PRESENCE_LOOKUP_MAX]).items()})
+        response = connection.respond(HTTPStatus.OK, body)
+        response.headers['Content-Type'] = 'application/json'
+        return response
+
+    return process_request
+
+
+async def pump_until_closed(conn: Connection):
+    try:
+        await conn.pump()
+    except ConnectionClosed:
+        pass
+
+
+def connect(dsn: str):
+    conn = psycopg2.connect(dsn, **KEEPALIVES)
+    conn.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+    return conn
+
+
+class Database:
+    '''
+    Autocommit-соединение для загрузки участников, записи last_seen и проверки сессий.
+    После обрыва (рестарт базы, сетевой сбой) соединение пересоздаётся, а упавший
+    запрос повторяется с растущей паузой; вызывается из asyncio.to_thread
+    '''
+
+    def __init__(self, dsn: str, attempts: int = QUERY_ATTEMPTS):
+        self.dsn = dsn
+        self.attempts = attempts
+        self._conn = None
+        self._lock = threading.Lock()
+
+    def run(self, sql: str, params=None) -> list:
+        delay = RECONNECT_MIN
+        for attempt in range(self.attempts):
+            with self._lock:
+                try:
+                    if self._conn is None or self._conn.closed:
+                        self._conn = connect(self.dsn)
+                    with self._conn.cursor() as cur:
+                        cur.execute(sql, params)
+                        return cur.fetchall() if cur.description else []
+                except (psycopg2.OperationalError, psycopg2.InterfaceError):
+                    self._close()
+                    if attempt == self.attempts - 1:
+                        raise
+            time.sleep(delay)
+            delay = min(delay * 2, RECONNECT_MAX)
+
+    def _close(self):
+        if self._conn is not None:
+            try:
+                self._conn.close()
+            except psycopg2.Error:
+                pass
+            self._conn = None
+
+
+def postgres_member_loader(dsn: str):
+    db = Database(dsn)
+    sql = f"SELECT user_id FROM {os.environ['MAIN_DB_SCHEMA']}.chat_members WHERE chat_id = %s"
+
+    async def loader(chat_id: int) -> list:
+        rows = await asyncio.to_thread(db.run, sql, (chat_id,))
+        return [row[0] for row in rows]
+
+    return loader
+
+
+def postgres_presence_writer(dsn: str):
+    db = Database(dsn)
+    sql = f"""
+        UPDATE {os.environ['MAIN_DB_SCHEMA']}.users u
+        SET last_seen = to_timestamp(v.seen)::timestamp
+        FROM unnest(%s::int[], %s::float8[]) AS v(id, seen)
+        WHERE u.id = v.id AND (u.last_seen IS NULL OR u.last_seen < to_timestamp(v.seen)::timestamp)
+    """
+
+    async def writer(items: list):
+        await asyncio.to_thread(db.run, sql, ([user_id for user_id, _ in items], [seen for _, seen in items]))
+
+    return writer
+
+
+def postgres_sessions(dsn: str):
+    db = Database(dsn)
+    sql = f"SELECT token FROM {os.environ['MAIN_DB_SCHEMA']}.sessions WHERE token = ANY(%s) AND expires_at > NOW()"
+
+    async def sessions(tokens: list) -> set:
+        active = set()
+        for start in range(0, len(tokens), SESSION_CHECK_BATCH):
+            rows = await asyncio.to_thread(db.run, sql, (tokens[start:start + SESSION_CHECK_BATCH],))
+            active.update(row[0] for row in rows)
+        return active
+
+    return sessions
+
+
+async def revalidate_sessions(hub: Hub, sessions, interval: float = SESSION_RECHECK_INTERVAL):
+    '''
+    Раз в interval закрывает сокеты, чьи сессии удалены (logout) или истекли:
+    проверка при подключении не видит logout, сделанный позже
+    '''
+    while True:
+        await asyncio.sleep(interval)
+        conns = hub.connections()
+        if not conns:
+            continue
+        try:
+            active = await sessions(list({conn.token for conn in conns}))
+        except psycopg2.Error as e:
+            print(f'Session recheck failed: {str(e)}')
+            continue
+        for conn in conns:
+            if conn.token not in active:
+                asyncio.ensure_future(conn.websocket.close(code=4401, reason='Session expired'))
+
+
+async def listen_postgres(hub: Hub, dsn: str):
+    '''
+    LISTEN с переподключением: при обрыве соединение пересоздаётся с паузой от
+    RECONNECT_MIN до RECONNECT_MAX, LISTEN выполняется заново, а всем сокетам
+    уходит resync — уведомления за время простоя потеряны
+    '''
+    loop = asyncio.get_running_loop()
+    delay = RECONNECT_MIN
+    reconnecting = False
+    while True:
+        try:
+            conn = connect(dsn)
+            with conn.cursor() as cur:
+                cur.execute(f'LISTEN {CHANNEL}')
+        except psycopg2.Error as e:
+            print(f'LISTEN connect failed, retry in {delay:.0f}s: {str(e)}')
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, RECONNECT_MAX)
+            continue
+        delay = RECONNECT_MIN
+        if reconnecting:
+            hub.resync_all()
+        reconnecting = True
+
+        fd = conn.fileno()
+        lost = loop.create_future()
+
+        def on_readable():
+            try:
+                conn.poll()
+            except psycopg2.Error as e:
+                loop.remove_reader(fd)
+                if not lost.done():
+                    lost.set_result(e)
+                return
+            while conn.notifies:
+                notify = conn.notifies.pop(0)
+                try:
+                    event = json.loads(notify.payload)
+                except ValueError:
+                    continue
+                asyncio.ensure_future(hub.publish(event))
+
+        loop.add_reader(fd, on_readable)
+        try:
+            error = await lost
+        finally:
+            loop.remove_reader(fd)
+            conn.close()
+        print(f'LISTEN connection lost, reconnecting: {str(error)}')
+
+
+def raise_fd_limit():
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft < hard:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--host', default='0.0.0.0')
+    parser.add_argument('--port', type=int, default=8765)
+    args = parser.parse_args()
+
+    raise_fd_limit()
+    dsn = os.environ['DATABASE_URL']
+    hub = Hub(MemberDirectory(postgres_member_loader(dsn)))
+    presence = Presence(postgres_presence_writer(dsn))
+    sessions = postgres_sessions(dsn)
+    asyncio.create_task(listen_postgres(hub, dsn))
+    asyncio.create_task(presence.run())
+    asyncio.create_task(revalidate_sessions(hub, sessions))
+
+    async with serve(
+        lambda websocket: handle(hub, websocket, presence, sessions),
+        args.host,
+        args.port,
+        process_request=presence_endpoint(presence, os.environ.get('PRESENCE_SECRET', '')),
+        compression=None,
+        max_size=4096,
+        ping_interval=30,
+        ping_timeout=30,
+    ) as server:
+        await server.serve_forever()
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -4,6 +4,61 @@ const API_URLS = {
   upload: 'https://functions.poehali.dev/71d88d48-ed84-4a03-8998-33bafa023f1e',
 };
 
+const REALTIME_URL: string | undefined = import.meta.env.VITE_REALTIME_URL;
+
+export type MediaPreview = {
+  thumb_url: string;
+  preview: string;
+  width: number;
+  height: number;
+};
+
+type UploadedFile = { file_url: string; file_name: string; file_size: number } & Partial<MediaPreview>;
+
+const MULTIPART_THRESHOLD = 8 * 1024 * 1024;
+const UPLOAD_CONCURRENCY = 4;
+const UPLOAD_RETRIES = 3;
+// Ссылки на части подписываются на час (PRESIGN_EXPIRES в upload), обновляем с запасом
+const PART_URL_MAX_AGE_MS = 50 * 60 * 1000;
+const HEARTBEAT_INTERVAL_MS = 25000;
+
+export const realtime = {
+  isEnabled(): boolean {
+    return !!REALTIME_URL;
+  },
+
+  connect(token: string, onEvent: (event: { type: string; chat_id?: number }) => void): () => void {
+    let socket: WebSocket | null = null;
+    let closed = false;
+    let retryDelay = 1000;
+
+    const heartbeat = setInterval(() => {
+      if (socket?.readyState === WebSocket.OPEN) socket.send(JSON.stringify({ type: 'heartbeat' }));
+    }, HEARTBEAT_INTERVAL_MS);
+
+    const open = () => {
+      socket = new WebSocket(`${REALTIME_URL}?token=${encodeURIComponent(token)}`);
+      socket.onopen = () => {
+        retryDelay = 1000;
+      };
+      socket.onmessage = (message) => onEvent(JSON.parse(message.data));
+      socket.onclose = (event) => {
+        // 4401 — токен недействителен или сессия завершена: переподключаться бессмысленно
+        if (closed || event.code === 4401) return;
+        setTimeout(open, retryDelay);
+        retryDelay = Math.min(retryDelay * 2, 30000);
+      };
+    };
+
+    open();
+    return () => {
+      closed = true;
+      clearInterval(heartbeat);
+      socket?.close();
+    };
+  },
+};
+
 export const api = {
   async sendSmsCode(phone: string) {
     const response = await fetch(API_URLS.auth, {
@@ -32,6 +87,24 @@ export const api = {
     return response.json();
   },
 
+  async updateProfile(token: string, profile: { full_name?: string; avatar_url?: string; status?: string }) {
+    const response = await fetch(API_URLS.auth, {
+      method: 'POST',
+      headers: { 'Content-Type': 'application/json' },
+      body: JSON.stringify({ action: 'update_profile', token, ...profile }),
+    });
+    return response.json();
+  },
+
+  async logout(token: string) {
+    const response = await fetch(API_URLS.auth, {
+      method: 'POST',
+      headers: { 'Content-Type': 'application/json' },
+      body: JSON.stringify({ action: 'logout', token }),
+    });
+    return response.json();
+  },
+
   async getChats(token: string) {
     const response = await fetch(`${API_URLS.messages}?action=get_chats`, {
       headers: { 'Authorization': `Bearer ${token}` },
@@ -39,14 +112,25 @@ export const api = {
     return response.json();
   },
 
-  async getMessages(token: string, chatId: number) {
-    const response = await fetch(`${API_URLS.messages}?action=get_messages&chat_id=${chatId}`, {
+  async getMessages(token: string, chatId: number, page: { before?: string; after?: string; limit?: number } = {}) {
+    const params = new URLSearchParams({ action: 'get_messages', chat_id: String(chatId) });
+    if (page.before) params.set('before', page.before);
+    if (page.after) params.set('after', page.after);
+    if (page.limit) params.set('limit', String(page.limit));
+    const response = await fetch(`${API_URLS.messages}?${params}`, {
+      headers: { 'Authorization': `Bearer ${token}` },
+    });
+    return response.json();
+  },
+
+  async sync(token: string, cursor: string) {
+    const response = await fetch(`${API_URLS.messages}?action=sync&cursor=${encodeURIComponent(cursor)}`, {
       headers: { 'Authorization': `Bearer ${token}` },
     });
     return response.json();
   },
 
-  async sendMessage(token: string, data: { chat_id?: number; recipient_id?: number; type?: string; content: string; file_url?: string; file_name?: string }) {
+  async sendMessage(token: string, data: { chat_id?: number; recipient_id?: number; type?: string; content: string; file_url?: string; file_name?: string } & Partial<MediaPreview>) {
     const response = await fetch(API_URLS.messages, {
       method: 'POST',
       headers: {
@@ -58,8 +142,64 @@ export const api = {
     return response.json();
   },
 
+  async markRead(token: string, reads: { chat_id: number; message_id: number }[]) {
+    const response = await fetch(API_URLS.messages, {
+      method: 'POST',
+      headers: {
+        'Content-Type': 'application/json',
+        'Authorization': `Bearer ${token}`,
+      },
+      body: JSON.stringify({ action: 'mark_read', reads }),
+    });
+    return response.json();
+  },
+
+  async addGroupMembers(token: string, chatId: number, memberIds: number[]) {
+    const response = await fetch(API_URLS.messages, {
+      method: 'POST',
+      headers: {
+        'Content-Type': 'application/json',
+        'Authorization': `Bearer ${token}`,
+      },
+      body: JSON.stringify({ action: 'add_members', chat_id: chatId, member_ids: memberIds }),
+    });
+    return response.json();
+  },
+
+  async removeGroupMember(token: string, chatId: number, userId?: number) {
+    const response = await fetch(API_URLS.messages, {
+      method: 'POST',
+      headers: {
+        'Content-Type': 'application/json',
+        'Authorization': `Bearer ${token}`,
+      },
+      body: JSON.stringify({ action: 'remove_member', chat_id: chatId, user_id: userId }),
+    });
+    return response.json();
+  },
+
+  async listGroupMembers(token: string, chatId: number, cursor?: string | null, limit?: number) {
+    const params = new URLSearchParams({ action: 'list_members', chat_id: String(chatId) });
+    if (cursor) params.set('cursor', cursor);
+    if (limit) params.set('limit', String(limit));
+    const response = await fetch(`${API_URLS.messages}?${params}`, {
+      headers: { 'Authorization': `Bearer ${token}` },
+    });
+    return response.json();
+  },
+
   async searchUsers(token: string, phone: string) {
-    const response = await fetch(`${API_URLS.messages}?action=search_users&phone=${encodeURIComponent(phone)}`, {
+    const response = await fetch(`${API_URLS.messages}?action=search_users&q=${encodeURIComponent(phone)}`, {
+      headers: { 'Authorization': `Bearer ${token}` },
+    });
+    return response.json();
+  },
+
+  async searchMessages(token: string, query: string, cursor?: string | null, chatId?: number) {
+    const params = new URLSearchParams({ action: 'search_messages', q: query });
+    if (cursor) params.set('cursor', cursor);
+    if (chatId) params.set('chat_id', String(chatId));
+    const response = await fetch(`${API_URLS.messages}?${params}`, {
       headers: { 'Authorization': `Bearer ${token}` },
     });
     return response.json();
@@ -76,4 +216,142 @@ export const api = {
     });
     return response.json();
   },
+
+  async uploadAction(token: string, action: string, data: Record<string, unknown>) {
+    const response = await fetch(API_URLS.upload, {
+      method: 'POST',
+      headers: {
+        'Content-Type': 'application/json',
+        'Authorization': `Bearer ${token}`,
+      },
+      body: JSON.stringify({ action, ...data }),
+    });
+    const result = await response.json();
+    if (result.error) throw new Error(result.error);
+    return result;
+  },
+
+  async uploadFileDirect(token: string, file: File): Promise<UploadedFile> {
+    if (file.size <= MULTIPART_THRESHOLD) {
+      const sha256 = await sha256Hex(file);
+      const signed = await this.uploadAction(token, 'presign', { file_name: file.name, file_type: file.type, sha256 });
+      if (!signed.exists) {
+        await putWithRetry(signed.upload_url, file, {
+          'Content-Type': file.type || 'application/octet-stream',
+          'x-amz-checksum-sha256': signed.checksum_sha256,
+        });
+      }
+      return this.withPreview(token, file, signed.key, { file_url: signed.file_url, file_name: file.name, file_size: file.size });
+    }
+
+    const resumeKey = `upload:${file.name}:${file.size}:${file.lastModified}`;
+    const saved = localStorage.getItem(resumeKey);
+    let upload: { key: string; upload_id: string; part_size: number } | null = null;
+    let pending: { part_number: number; url: string }[] = [];
+    const done = new Map<number, string>();
+
+    if (saved) {
+      try {
+        upload = JSON.parse(saved) as { key: string; upload_id: string; part_size: number };
+        const listed = await this.uploadAction(token, 'list_parts', { key: upload.key, upload_id: upload.upload_id });
+        listed.parts.forEach((part: { part_number: number; etag: string }) => done.set(part.part_number, part.etag));
+        const partCount = Math.ceil(file.size / upload.part_size);
+        const missing = Array.from({ length: partCount }, (_, i) => i + 1).filter((n) => !done.has(n));
+        pending = missing.length
+          ? (await this.uploadAction(token, 'presign_parts', { key: upload.key, upload_id: upload.upload_id, part_numbers: missing })).parts
+          : [];
+      } catch (error) {
+        // Загрузка истекла, отменена или чужая — иначе каждая попытка падала бы так же
+        console.warn('Cannot resume upload, starting over:', error);
+        localStorage.removeItem(resumeKey);
+        upload = null;
+        done.clear();
+      }
+    }
+    if (!upload) {
+      const created = await this.uploadAction(token, 'create_multipart', {
+        file_name: file.name,
+        file_type: file.type,
+        file_size: file.size,
+      });
+      upload = { key: created.key, upload_id: created.upload_id, part_size: created.part_size };
+      localStorage.setItem(resumeKey, JSON.stringify(upload));
+      pending = created.parts;
+    }
+
+    const target = upload;
+    const urls = new Map(pending.map((part) => [part.part_number, part.url]));
+    const queue = pending.map((part) => part.part_number);
+    let signedAt = Date.now();
+    let refreshing: Promise<void> | null = null;
+
+    // Долгая загрузка переживает срок подписи: оставшиеся части переподписываются
+    // одним запросом, который ждут все воркеры
+    const freshUrl = async (partNumber: number) => {
+      if (Date.now() - signedAt > PART_URL_MAX_AGE_MS) {
+        if (!refreshing) {
+          refreshing = (async () => {
+            const signed = await this.uploadAction(token, 'presign_parts', {
+              key: target.key,
+              upload_id: target.upload_id,
+              part_numbers: [...urls.keys()].filter((n) => !done.has(n)),
+            });
+            signed.parts.forEach((part: { part_number: number; url: string }) => urls.set(part.part_number, part.url));
+            signedAt = Date.now();
+          })().finally(() => {
+            refreshing = null;
+          });
+        }
+        await refreshing;
+      }
+      return urls.get(partNumber) as string;
+    };
+
+    const worker = async () => {
+      for (let partNumber = queue.shift(); partNumber; partNumber = queue.shift()) {
+        const start = (partNumber - 1) * target.part_size;
+        const etag = await putWithRetry(await freshUrl(partNumber), file.slice(start, start + target.part_size));
+        done.set(partNumber, etag);
+      }
+    };
+    await Promise.all(Array.from({ length: UPLOAD_CONCURRENCY }, worker));
+
+    const result = await this.uploadAction(token, 'complete_multipart', {
+      key: target.key,
+      upload_id: target.upload_id,
+      file_name: file.name,
+      parts: [...done.entries()].map(([part_number, etag]) => ({ part_number, etag })),
+    });
+    localStorage.removeItem(resumeKey);
+    return this.withPreview(token, file, target.key, result);
+  },
+
+  async withPreview(token: string, file: File, key: string, uploaded: UploadedFile): Promise<UploadedFile> {
+    if (!file.type.startsWith('image/')) return uploaded;
+    try {
+      const preview: MediaPreview = await this.uploadAction(token, 'preview', { key });
+      return { ...uploaded, ...preview };
+    } catch (error) {
+      console.warn('Preview is not available:', error);
+      return uploaded;
+    }
+  },
 };
+
+async function sha256Hex(file: Blob): Promise<string> {
+  const digest = await crypto.subtle.digest('SHA-256', await file.arrayBuffer());
+  return Array.from(new Uint8Array(digest), (byte) => byte.toString(16).padStart(2, '0')).join('');
+}
+
+async function putWithRetry(url: string, body: Blob, headers: Record<string, string> = {}): Promise<string> {
+  for (let attempt = 0; ; attempt++) {
+    try {
+      const response = await fetch(url, { method: 'PUT', body, headers });
+      if (!response.ok) throw new Error(`Upload part failed: ${response.status}`);
+      return response.headers.get('ETag') ?? '';
+    } catch (error) {
+      if (attempt >= UPLOAD_RETRIES) throw error;
+      await new Promise((resolve) => setTimeout(resolve, 500 * 2 ** attempt));
+    }
+  }
+}
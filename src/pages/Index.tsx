@@ -8,12 +8,13 @@ import { Separator } from '@/components/ui/separator';
 import { Dialog, DialogContent, DialogHeader, DialogTitle } from '@/components/ui/dialog';
 import { Textarea } from '@/components/ui/textarea';
 import Icon from '@/components/ui/icon';
-import { api } from '@/lib/api';
+import { api, realtime } from '@/lib/api';
 import { auth, User } from '@/lib/auth';
 import { useToast } from '@/hooks/use-toast';
 
 type Message = {
   id: number;
+  chat_id?: number;
   sender_id: number;
   sender_name: string;
   sender_avatar: string | null;
@@ -21,8 +22,13 @@ type Message = {
   content: string;
   file_url?: string;
   file_name?: string;
+  thumb_url?: string | null;
+  preview?: string | null;
+  width?: number | null;
+  height?: number | null;
   created_at: string;
   is_mine: boolean;
+  seen_by?: number;
 };
 
 type Chat = {
@@ -33,8 +39,15 @@ type Chat = {
   last_message: string | null;
   last_message_time: string | null;
   unread_count: number;
+  peer_id?: number;
+  is_online?: boolean;
+  last_seen?: string | null;
 };
 
+const SYNC_INTERVAL_MS = 5000;
+const SYNC_FALLBACK_INTERVAL_MS = 30000;
+const READ_FLUSH_DELAY_MS = 1000;
+
 export default function Index() {
   const [isAuthenticated, setIsAuthenticated] = useState(false);
   const [user, setUser] = useState<User | null>(null);
@@ -47,6 +60,9 @@ export default function Index() {
   const [chats, setChats] = useState<Chat[]>([]);
   const [selectedChat, setSelectedChat] = useState<Chat | null>(null);
   const [messages, setMessages] = useState<Message[]>([]);
+  const [olderCursor, setOlderCursor] = useState<string | null>(null);
+  const [hasOlder, setHasOlder] = useState(false);
+  const [loadingOlder, setLoadingOlder] = useState(false);
   const [newMessage, setNewMessage] = useState('');
   
   const [searchPhone, setSearchPhone] = useState('');
@@ -57,6 +73,11 @@ export default function Index() {
   const [editName, setEditName] = useState('');
   
   const fileInputRef = useRef<HTMLInputElement>(null);
+  const syncCursorRef = useRef<string | null>(null);
+  const syncingRef = useRef(false);
+  const selectedChatIdRef = useRef<number | null>(null);
+  const pendingReadsRef = useRef(new Map<number, number>());
+  const readTimerRef = useRef<ReturnType<typeof setTimeout> | null>(null);
   const { toast } = useToast();
 
   useEffect(() => {
@@ -69,6 +90,17 @@ export default function Index() {
     }
   }, []);
 
+  useEffect(() => {
+    const token = auth.getToken();
+    if (!isAuthenticated || !token) return;
+    const disconnect = realtime.isEnabled() ? realtime.connect(token, () => syncChanges()) : null;
+    const timer = setInterval(syncChanges, disconnect ? SYNC_FALLBACK_INTERVAL_MS : SYNC_INTERVAL_MS);
+    return () => {
+      clearInterval(timer);
+      disconnect?.();
+    };
+  }, [isAuthenticated]);
+
   const handleSendCode = async () => {
     if (!phone.trim()) {
       toast({ title: 'Ошибка', description: 'Введите номер телефона', variant: 'destructive' });
@@ -126,12 +158,77 @@ export default function Index() {
       const result = await api.getChats(token);
       if (result.chats) {
         setChats(result.chats);
+        syncCursorRef.current = result.cursor;
       }
     } catch (error) {
       console.error('Failed to load chats:', error);
     }
   };
 
+  const flushReads = async () => {
+    readTimerRef.current = null;
+    const token = auth.getToken();
+    const pending = pendingReadsRef.current;
+    if (!token || !pending.size) return;
+    
+    const reads = [...pending.entries()].map(([chat_id, message_id]) => ({ chat_id, message_id }));
+    pending.clear();
+    try {
+      await api.markRead(token, reads);
+    } catch (error) {
+      console.error('Failed to mark messages read:', error);
+    }
+  };
+
+  const markRead = (chatId: number, messageId: number) => {
+    const pending = pendingReadsRef.current;
+    pending.set(chatId, Math.max(messageId, pending.get(chatId) ?? 0));
+    setChats((prev) => prev.map((chat) => (chat.id === chatId ? { ...chat, unread_count: 0 } : chat)));
+    if (!readTimerRef.current) {
+      readTimerRef.current = setTimeout(flushReads, READ_FLUSH_DELAY_MS);
+    }
+  };
+
+  const applySync = (changedChats: Chat[], newMessages: Message[]) => {
+    if (changedChats.length) {
+      setChats((prev) => {
+        const byId = new Map(prev.map((chat) => [chat.id, chat]));
+        changedChats.forEach((chat) => byId.set(chat.id, chat));
+        return [...byId.values()].sort((a, b) =>
+          (b.last_message_time ?? '').localeCompare(a.last_message_time ?? '')
+        );
+      });
+    }
+    
+    const incoming = newMessages.filter((message) => message.chat_id === selectedChatIdRef.current);
+    if (incoming.length) {
+      markRead(incoming[0].chat_id!, Math.max(...incoming.map((message) => message.id)));
+      setMessages((prev) => {
+        const seen = new Set(prev.map((message) => message.id));
+        return [...prev, ...incoming.filter((message) => !seen.has(message.id))];
+      });
+    }
+  };
+
+  const syncChanges = async () => {
+    const token = auth.getToken();
+    if (!token || syncCursorRef.current === null || syncingRef.current) return;
+    
+    syncingRef.current = true;
+    try {
+      let result;
+      do {
+        result = await api.sync(token, syncCursorRef.current);
+        if (result.error) break;
+        syncCursorRef.current = result.cursor;
+        applySync(result.chats, result.messages);
+      } while (result.has_more);
+    } catch (error) {
+      console.error('Failed to sync:', error);
+    }
+    syncingRef.current = false;
+  };
+
   const loadMessages = async (chatId: number) => {
     const token = auth.getToken();
     if (!token) return;
@@ -140,14 +237,44 @@ export default function Index() {
       const result = await api.getMessages(token, chatId);
       if (result.messages) {
         setMessages(result.messages);
+        if (result.messages.length) {
+          markRead(chatId, result.messages[result.messages.length - 1].id);
+        }
+        setOlderCursor(result.before_cursor);
+        setHasOlder(result.has_more);
       }
     } catch (error) {
       console.error('Failed to load messages:', error);
     }
   };
 
+  const loadOlderMessages = async () => {
+    const token = auth.getToken();
+    if (!token || !selectedChat || !hasOlder || !olderCursor || loadingOlder) return;
+    
+    setLoadingOlder(true);
+    try {
+      const result = await api.getMessages(token, selectedChat.id, { before: olderCursor });
+      if (result.messages) {
+        setMessages((prev) => [...result.messages, ...prev]);
+        setOlderCursor(result.before_cursor);
+        setHasOlder(result.has_more);
+      }
+    } catch (error) {
+      console.error('Failed to load older messages:', error);
+    }
+    setLoadingOlder(false);
+  };
+
+  const handleMessagesScroll = (e: React.UIEvent<HTMLDivElement>) => {
+    if ((e.target as HTMLElement).scrollTop < 80) {
+      loadOlderMessages();
+    }
+  };
+
   const handleSelectChat = (chat: Chat) => {
     setSelectedChat(chat);
+    selectedChatIdRef.current = chat.id;
     loadMessages(chat.id);
   };
 
@@ -165,8 +292,7 @@ export default function Index() {
       });
       
       setNewMessage('');
-      loadMessages(selectedChat.id);
-      loadChats();
+      syncChanges();
     } catch (error) {
       toast({ title: 'Ошибка', description: 'Не удалось отправить сообщение', variant: 'destructive' });
     }
@@ -179,31 +305,26 @@ export default function Index() {
     const token = auth.getToken();
     if (!token) return;
     
-    const reader = new FileReader();
-    reader.onload = async () => {
-      const base64 = (reader.result as string).split(',')[1];
+    try {
+      const uploadResult = await api.uploadFileDirect(token, file);
       
-      try {
-        const uploadResult = await api.uploadFile(token, base64, file.name, file.type);
-        
-        if (uploadResult.file_url) {
-          await api.sendMessage(token, {
-            chat_id: selectedChat.id,
-            content: file.name,
-            type: file.type.startsWith('image/') ? 'image' : 'file',
-            file_url: uploadResult.file_url,
-            file_name: file.name,
-          });
-          
-          loadMessages(selectedChat.id);
-          loadChats();
-          toast({ title: 'Успех', description: 'Файл отправлен' });
-        }
-      } catch (error) {
-        toast({ title: 'Ошибка', description: 'Не удалось загрузить файл', variant: 'destructive' });
-      }
-    };
-    reader.readAsDataURL(file);
+      await api.sendMessage(token, {
+        chat_id: selectedChat.id,
+        content: file.name,
+        type: file.type.startsWith('image/') ? 'image' : 'file',
+        file_url: uploadResult.file_url,
+        file_name: file.name,
+        thumb_url: uploadResult.thumb_url,
+        preview: uploadResult.preview,
+        width: uploadResult.width,
+        height: uploadResult.height,
+      });
+      
+      syncChanges();
+      toast({ title: 'Успех', description: 'Файл отправлен' });
+    } catch (error) {
+      toast({ title: 'Ошибка', description: 'Не удалось загрузить файл', variant: 'destructive' });
+    }
   };
 
   const handleSearchUsers = async () => {
@@ -236,20 +357,44 @@ export default function Index() {
       setShowSearch(false);
       setSearchPhone('');
       setSearchResults([]);
-      loadChats();
+      syncChanges();
       toast({ title: 'Успех', description: 'Чат создан' });
     } catch (error) {
       toast({ title: 'Ошибка', description: 'Не удалось создать чат', variant: 'destructive' });
     }
   };
 
+  const handleSaveProfile = async () => {
+    const token = auth.getToken();
+    if (!token || !editName.trim()) return;
+    
+    try {
+      const result = await api.updateProfile(token, { full_name: editName.trim() });
+      if (result.error) {
+        toast({ title: 'Ошибка', description: result.error, variant: 'destructive' });
+      } else {
+        auth.setUser(result.user);
+        setUser(result.user);
+        setShowProfile(false);
+      }
+    } catch (error) {
+      toast({ title: 'Ошибка', description: 'Не удалось сохранить профиль', variant: 'destructive' });
+    }
+  };
+
   const handleLogout = () => {
+    const token = auth.getToken();
+    if (token) {
+      api.logout(token).catch((error) => console.error('Failed to log out:', error));
+    }
     auth.removeToken();
     setIsAuthenticated(false);
     setUser(null);
     setChats([]);
     setMessages([]);
     setSelectedChat(null);
+    selectedChatIdRef.current = null;
+    syncCursorRef.current = null;
   };
 
   if (!isAuthenticated) {
@@ -321,7 +466,9 @@ export default function Index() {
           </Avatar>
           <div className="flex-1 min-w-0">
             <h3 className="font-semibold text-sm truncate">{selectedChat.title}</h3>
-            <p className="text-xs text-muted-foreground">В сети</p>
+            <p className="text-xs text-muted-foreground">
+              {selectedChat.type !== 'private' ? 'Группа' : selectedChat.is_online ? 'В сети' : 'Не в сети'}
+            </p>
           </div>
           <Button variant="ghost" size="icon">
             <Icon name="Phone" size={18} />
@@ -331,7 +478,7 @@ export default function Index() {
           </Button>
         </div>
 
-        <ScrollArea className="flex-1 p-4">
+        <ScrollArea className="flex-1 p-4" onScrollCapture={handleMessagesScroll}>
           <div className="space-y-3">
             {messages.map((message) => (
               <div
@@ -346,7 +493,17 @@ export default function Index() {
                   }`}
                 >
                   {message.type === 'image' && message.file_url && (
-                    <img src={message.file_url} alt="" className="rounded-lg mb-2 max-w-full" />
+                    <a href={message.file_url} target="_blank" rel="noreferrer">
+                      <img
+                        src={message.thumb_url ?? message.file_url}
+                        alt=""
+                        loading="lazy"
+                        width={message.width ?? undefined}
+                        height={message.height ?? undefined}
+                        className="rounded-lg mb-2 max-w-full h-auto bg-cover"
+                        style={message.preview ? { backgroundImage: `url(${message.preview})` } : undefined}
+                      />
+                    </a>
                   )}
                   {message.type === 'file' && (
                     <div className="flex items-center gap-2 mb-1">
@@ -357,6 +514,11 @@ export default function Index() {
                   <p className="text-sm whitespace-pre-wrap break-words">{message.content}</p>
                   <span className="text-xs opacity-70 mt-1 block">
                     {new Date(message.created_at).toLocaleTimeString('ru-RU', { hour: '2-digit', minute: '2-digit' })}
+                    {message.is_mine && !!message.seen_by && (
+                      <span className="ml-1">
+                        ✓✓{selectedChat.type === 'group' ? ` ${message.seen_by}` : ''}
+                      </span>
+                    )}
                   </span>
                 </div>
               </div>
@@ -624,7 +786,7 @@ export default function Index() {
               <label className="text-sm font-medium mb-2 block">Имя</label>
               <Input value={editName} onChange={(e) => setEditName(e.target.value)} />
             </div>
-            <Button className="w-full">Сохранить</Button>
+            <Button className="w-full" onClick={handleSaveProfile}>Сохранить</Button>
           </div>
         </DialogContent>
       </Dialog>